@@ -1,410 +1,798 @@
 # --- 修正後の正しいコード ---
+import time
+_rerun_started = time.perf_counter() # 再実行時間の計測開始
 import streamlit as st # stをインポート
 import os
-import google.generativeai as genai
-from google.generativeai.types import HarmCategory, HarmBlockThreshold
 import sys
+import logging
+import uuid
+import difflib
+from gemini_client import GeminiClient, PartialGenerationError, DEFAULT_MODEL_NAME
+from jobs import JobManager, DONE, FAILED, CANCELLED
+from telemetry import Telemetry
+from session_store import SessionStore, new_session_token
+from rate_limiter import (
+    PRIORITY_INTERACTIVE, PRIORITY_FOLLOW_UP, PRIORITY_BACKGROUND, PRIORITY_SPECULATIVE, is_retryable,
+)
+from prompts import (
+    QUESTIONS, ANALYSIS_PROMPT_TEMPLATES,
+    build_feedback_prompt, build_revision_prompt, build_analysis_prompt, build_edit_canvas_prompt,
+)
+from canvas_sections import diff_sections
+from context_cache import inline_prompt
+from engine import (
+    missing_required_inputs, plan_section_revision, revise_sections,
+    draft_prompt, feedback_request, revision_request, analysis_request,
+)
+from idea_index import build_idea_index
 # Streamlitのエラークラスをインポート (存在しない場合を考慮)
 try:
     from streamlit.errors import StreamlitAPIException
 except ImportError:
     StreamlitAPIException = Exception
 
-api_key = None # api_key変数を初期化
+logger = logging.getLogger(__name__)
+
+# 1回の再実行（Pythonスクリプト部分）にかける時間の目安。超えた場合はログに警告を出す
+RERUN_BUDGET_MS = float(os.getenv("LEAN_CANVAS_RERUN_BUDGET_MS", "50"))
+# 管理パネル（ステップごとのレイテンシなど）をサイドバーに表示するか
+SHOW_ADMIN_PANEL = os.getenv("LEAN_CANVAS_ADMIN_PANEL", "") not in ("", "0", "false")
+# 実行中のジョブがあるときに、その進捗表示を更新する間隔（秒）
+JOB_POLL_INTERVAL_SECONDS = 0.5
+# 先読み（ドラフト完成後、ボタンが押される前にフィードバックなどの生成を始めておく）の既定値
+SPECULATIVE_DEFAULT = os.getenv("LEAN_CANVAS_SPECULATIVE", "") not in ("", "0", "false")
+# 先読みする分析の数（これまでによく実行されたものから）
+SPECULATIVE_ANALYSES = int(os.getenv("LEAN_CANVAS_SPECULATIVE_ANALYSES", "1"))
+# プロセス全体で同時に実行する先読みジョブの上限
+SPECULATIVE_MAX_ACTIVE = int(os.getenv("LEAN_CANVAS_SPECULATIVE_MAX_ACTIVE", "4"))
+SPECULATIVE_LABEL_PREFIX = "speculative:"
+
+@st.cache_resource(show_spinner=False)
+def resolve_api_key():
+    """APIキーを (キー, エラーメッセージ) で返す。サーバープロセスごとに1回だけ解決する（失敗した場合は呼び出し側で消す）"""
+    try:
+        # まず Streamlit secrets を試す (デプロイ環境向け)
+        api_key = st.secrets.get("GEMINI_API_KEY")
+        if api_key is None: # .get はキーがない場合 None を返す (エラーは出さない場合がある)
+            raise StreamlitAPIException("SecretsにGEMINI_API_KEYが見つかりません") # 強制的にexceptに移行
+        if not api_key:
+            return None, "⚠️ GEMINI_API_KEY が Streamlit Secrets にありますが、値が空です。"
+        return api_key, None
+
+    except StreamlitAPIException:
+        # Streamlit secrets が見つからない場合 (ローカル環境など)
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            # 環境変数にも見つからない場合
+            return None, "⚠️ APIキーが設定されていません。Streamlit Secrets または環境変数に `GEMINI_API_KEY` を設定してください。"
+        return api_key, None
 
-try:
-    # まず Streamlit secrets を試す (デプロイ環境向け)
-    # ★★★ 引数に正しい名前 "GEMINI_API_KEY" を指定 ★★★
-    api_key = st.secrets.get("GEMINI_API_KEY")
-    if api_key is None: # .get はキーがない場合 None を返す (エラーは出さない場合がある)
-        raise StreamlitAPIException("SecretsにGEMINI_API_KEYが見つかりません") # 強制的にexceptに移行
-    if not api_key:
-         st.error("⚠️ GEMINI_API_KEY が Streamlit Secrets にありますが、値が空です。")
-         st.stop()
-
-except StreamlitAPIException:
-    # Streamlit secrets が見つからない場合 (ローカル環境など)
-    # ★★★ 引数に正しい名前 "GEMINI_API_KEY" を指定 ★★★
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        # 環境変数にも見つからない場合
-        st.error("⚠️ APIキーが設定されていません。Streamlit Secrets または環境変数に `GEMINI_API_KEY` を設定してください。")
-        st.stop()
-
-except Exception as e:
-    # その他の予期せぬエラー
-    st.error(f"❌ APIキーの読み込み中に予期せぬエラーが発生しました: {e}")
+    except Exception as e:
+        # その他の予期せぬエラー
+        return None, f"❌ APIキーの読み込み中に予期せぬエラーが発生しました: {e}"
+
+@st.cache_resource(show_spinner=False)
+def get_telemetry():
+    # 生成呼び出しの記録はプロセス全体で1つ。ポートが設定されていれば /metrics を公開する
+    telemetry = Telemetry()
+    metrics_port = os.getenv("LEAN_CANVAS_METRICS_PORT")
+    if metrics_port:
+        try:
+            telemetry.start_metrics_server(int(metrics_port))
+        except (OSError, ValueError) as e:
+            logger.warning("Could not start metrics endpoint on %s: %s", metrics_port, e)
+    return telemetry
+
+@st.cache_resource(show_spinner=False)
+def get_gemini_client(api_key):
+    # Geminiクライアントはプロセス全体で共有する（モデルの生成は最初のAPI呼び出しまで遅延）
+    return GeminiClient(api_key, DEFAULT_MODEL_NAME, telemetry=get_telemetry())
+
+api_key, api_key_error = resolve_api_key()
+if api_key_error:
+    # 失敗した結果はキャッシュに残さず、設定を直した後の再実行で改めて解決する
+    resolve_api_key.clear()
+    st.error(api_key_error)
     st.stop()
 
+@st.cache_resource(show_spinner=False)
+def get_job_manager():
+    # 生成ジョブの実行スレッドはプロセス全体で共有する
+    return JobManager()
 
-# APIキーが正常に取得できた場合のみ、genaiを設定
-if api_key:
-    try:
-        genai.configure(api_key=api_key)
-        model_name = 'gemini-1.5-flash-latest'
-        model = genai.GenerativeModel(model_name)
-    except Exception as e:
-        st.error(f"❌ Geminiモデルの初期化中にエラーが発生しました: {e}")
-        st.stop()
-else:
-    st.error("❌ APIキーの取得に失敗したため、初期化できませんでした。")
-    st.stop()
+@st.cache_resource(show_spinner=False)
+def get_session_store():
+    # 生成結果の保存先はプロセス全体で共有する（メモリには最近のセッションだけを置く）
+    return SessionStore()
 
-# Geminiクライアントの初期化
-try:
-    genai.configure(api_key=api_key)
-    # 使用するモデルを選択 (Flashは高速・低コスト、Proはより高性能)
-    model_name = 'gemini-1.5-flash-latest'
-    model = genai.GenerativeModel(model_name)
-    # st.success(f"Gemini ({model_name}) への接続準備完了！") # 任意：接続確認メッセージ
-except Exception as e:
-    st.error(f"❌ Geminiモデルの初期化中にエラーが発生しました: {e}")
-    st.stop() # エラーが発生したらアプリを停止
+@st.cache_resource(show_spinner=False)
+def get_idea_index(api_key):
+    # 過去の入力とドラフトの索引はプロセス全体で共有する（無効なら None）。埋め込みはGeminiクライアント経由で計算する
+    return build_idea_index(get_gemini_client(api_key))
+
+gemini_client = get_gemini_client(api_key)
+job_manager = get_job_manager()
+session_store = get_session_store()
+idea_index = get_idea_index(api_key)
 
 # --- Session State の初期化 ---
 # ユーザーの入力やAPIからの結果をアプリの再実行後も保持するために使用
-if 'user_inputs' not in st.session_state:
-    st.session_state.user_inputs = {} # ユーザーの初期入力を保持
-if 'canvas_draft' not in st.session_state:
-    st.session_state.canvas_draft = "" # 生成された最初のドラフトを保持
-if 'feedback' not in st.session_state:
-    st.session_state.feedback = ""    # 生成されたフィードバックを保持
-if 'revised_canvas' not in st.session_state:
-    st.session_state.revised_canvas = "" # 生成された改訂版を保持
-
-
-# --- 安全設定 ---
-# API呼び出し時に共通して使用する安全設定
-safety_settings = {
-    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-}
-
-# --- UIセクション ---
-
-# --- 1. コア情報入力フォーム ---
-st.header("1. アイデアのコア情報を入力")
-st.markdown("以下の項目について、具体的な情報を入力してください。")
-
-with st.form("lean_canvas_input_form"):
-    questions = {
-        "ターゲット顧客": "[顧客セグメント] あなたが最初に価値を届けたい具体的な顧客は誰ですか？",
-        "顧客の課題": "[課題] その顧客が抱えている最も重要な課題は何ですか？",
-        "提供する解決策": "[ソリューション] あなたの技術やアイデアは、その課題を具体的にどう解決しますか？",
-        "競合": "[競合] 現時点で考えられる主な競合製品・サービス、または顧客が課題を解決している代替手段は何ですか？",
-        "コア技術": "[ソリューション/優位性] アイデアの中心となる技術やアプローチは何ですか？ (任意)",
-        "既存比較と優位性": "[独自の価値提案/優位性] 既存の解決策や競合と比べて、あなたのアイデアは何がどう優れていますか？",
-        "市場情報": "[市場] ターゲット市場のおおよその規模や成長性について、現時点で分かっていることがあれば教えてください。(任意)"
-    }
-    # フォーム内にテキストエリアを配置
-    for key, question in questions.items():
-        st.session_state.user_inputs[key] = st.text_area(
-            question,
-            value=st.session_state.user_inputs.get(key, ""),
-            height=100,
-            key=f"input_{key}"
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex # API呼び出しの順番待ちでセッションを区別するためのID
+if 'session_token' not in st.session_state:
+    # URLの ?session=... があれば、そのセッションの生成結果を復元する
+    requested_token = st.query_params.get("session")
+    if requested_token and session_store.exists(requested_token):
+        st.session_state.session_token = requested_token
+    else:
+        if requested_token:
+            st.warning("⚠️ 指定されたセッションが見つからなかったため、新しいセッションを開始しました。")
+        st.session_state.session_token = new_session_token()
+    # ユーザーの初期入力を保持（フォームの初期値として使う）
+    st.session_state.user_inputs = dict(session_store.get(st.session_state.session_token, "user_inputs", {}))
+if st.query_params.get("session") != st.session_state.session_token:
+    st.query_params["session"] = st.session_state.session_token # このURLを共有すれば結果を復元できる
+
+# 生成されたドラフト・フィードバック・改訂版・分析結果はセッションストアに保持する
+results = session_store.session(st.session_state.session_token)
+if 'partial_outputs' not in st.session_state:
+    st.session_state.partial_outputs = {} # ストリーミング途中でエラーになった出力を保持
+if 'jobs' not in st.session_state:
+    st.session_state.jobs = {} # 実行中の生成ジョブ（保存先のキー → ジョブ情報）
+if 'generation_errors' not in st.session_state:
+    st.session_state.generation_errors = {} # 失敗した生成のエラーメッセージ
+if 'speculative' not in st.session_state:
+    st.session_state.speculative = {} # 先読み中のジョブ（保存先のキー → ジョブIDとプロンプト）
+if 'prompt_savings' not in st.session_state:
+    st.session_state.prompt_savings = {} # プロンプト圧縮による入力トークン数の削減（ステップ → (圧縮前, 圧縮後)）
+if 'similar_idea' not in st.session_state:
+    st.session_state.similar_idea = None # 入力に似た過去のアイデア（類似度・過去の入力とドラフト・今回の入力）
+if 'similar_lookup' not in st.session_state:
+    st.session_state.similar_lookup = None # 実行中の類似アイデアの検索（ジョブIDと今回の入力）
+
+
+# --- 生成ジョブ ---
+def superseded_state_keys(state_key):
+    # あるステップを再実行したときに、結果が無効になる後続ステップ
+    if state_key == "canvas_draft":
+        return [key for key in st.session_state.jobs if key != state_key]
+    if state_key == "feedback":
+        return ["revised_canvas"]
+    if state_key == "revised_canvas":
+        # 分析は改訂版を優先して使うため、改訂版が変われば作り直しになる
+        return [key for key in st.session_state.jobs if key.startswith("analysis_")]
+    return []
+
+def generation_priority(state_key):
+    # ドラフト生成を最優先し、追加分析は後回しにする
+    if state_key == "canvas_draft":
+        return PRIORITY_INTERACTIVE
+    if state_key.startswith("analysis_"):
+        return PRIORITY_BACKGROUND
+    return PRIORITY_FOLLOW_UP
+
+def cancel_generation(state_key):
+    job_info = st.session_state.jobs.pop(state_key, None)
+    if job_info:
+        job_manager.cancel(job_info["job_id"])
+        job_manager.pop(job_info["job_id"])
+
+def job_callbacks(job, state_key):
+    # スケジューラからの通知をジョブの状態に反映するコールバック
+    def on_wait(position):
+        job.check_cancelled() # 順番待ち中にキャンセルされたら待機をやめる
+        job.queue_position = position
+    def on_retry(attempt, delay, error):
+        job.retry_count = attempt
+        logger.warning("Retrying %s (attempt %d) in %.1fs: %s", state_key, attempt, delay, error)
+    return {"on_wait": on_wait, "on_retry": on_retry}
+
+def submit_job(state_key, error_message, task=None, job_id=None):
+    """task(job) をバックグラウンドジョブとして投入する（task は (テキスト, 応答オブジェクト) を返す）
+
+    結果は collect_finished_jobs() でセッションストアの results[state_key] に保存される。
+    同じステップの実行中ジョブと、結果が無効になる後続ステップのジョブはキャンセルする。
+    job_id を渡すと、新たに投入せずにそのジョブ（先読みしていたものなど）を引き継ぐ。
+    """
+    for key in [state_key] + superseded_state_keys(state_key):
+        cancel_generation(key)
+    st.session_state.partial_outputs.pop(state_key, None)
+    st.session_state.generation_errors.pop(state_key, None)
+
+    if job_id is None:
+        job_id = job_manager.submit(state_key, task)
+    st.session_state.jobs[state_key] = {"job_id": job_id, "error_message": error_message}
+    return job_id
+
+def generation_task(prompt, state_key, full_prompt=None, context=None, priority=None, refresh=False):
+    """1つのプロンプトを生成するジョブの処理を返す
+
+    full_prompt（圧縮前のプロンプト）を渡し、サイドバーで表示を有効にしていれば、生成後に入力トークン数の削減量を数える。
+    context は engine.canvas_context() の共有コンテキスト（コンテキストキャッシュを使わない場合は None）。
+    priority を省略するとステップごとの優先度（generation_priority）を使う。
+    refresh なら応答キャッシュを使わずに生成し直す（再生成ボタン用）。
+    """
+    session_id = st.session_state.session_id
+    if priority is None:
+        priority = generation_priority(state_key)
+    report_savings = full_prompt is not None and st.session_state.get("show_prompt_savings", False)
+
+    def task(job):
+        def on_text(text):
+            job.check_cancelled() # キャンセルされたらストリームの受信を打ち切る
+            job.queue_position = None
+            job.partial_text = text
+        job.check_cancelled()
+        result = gemini_client.generate(
+            prompt, on_text=on_text, session_id=session_id, priority=priority, step=state_key,
+            context=context, refresh=refresh, **job_callbacks(job, state_key),
+        )
+        if report_savings:
+            # 生成の後に数えるので、生成の待ち時間には影響しない
+            try:
+                # 共有コンテキストを使う場合も、Lean Canvasを含めた実際の入力全体と比べる
+                sent_prompt = inline_prompt(*context, prompt) if context is not None else prompt
+                savings = (gemini_client.count_tokens(full_prompt), gemini_client.count_tokens(sent_prompt))
+                job.info["token_savings"] = savings
+                logger.info("Prompt compaction for %s: %d -> %d tokens", state_key, *savings)
+            except Exception as e:
+                logger.warning("Could not count tokens for %s: %s", state_key, e)
+        return result
+
+    return task
+
+def submit_generation(prompt, state_key, error_message, full_prompt=None, context=None, refresh=False):
+    # 1つのプロンプトの生成をジョブとして投入する（同じプロンプトを先読み中なら、それを引き継ぐ）
+    # refresh（再生成）では先読みの結果もキャッシュから返りうるので引き継がない
+    if refresh:
+        cancel_speculative(state_key)
+    speculative_job_id = None if refresh else adopt_speculative(state_key, prompt)
+    if speculative_job_id is not None:
+        submit_job(state_key, error_message, job_id=speculative_job_id)
+        collect_finished_jobs() # 先読みが完了済みなら、この再実行のうちに結果を表示する
+        return speculative_job_id
+    return submit_job(state_key, error_message, generation_task(prompt, state_key, full_prompt, context, refresh=refresh))
+
+# --- 先読み ---
+def cancel_speculative(state_key=None):
+    # 先読み中のジョブを取り消す（state_key を省略するとすべて）
+    keys = [state_key] if state_key is not None else list(st.session_state.speculative)
+    for key in keys:
+        spec = st.session_state.speculative.pop(key, None)
+        if spec:
+            job_manager.cancel(spec["job_id"])
+            job_manager.pop(spec["job_id"])
+
+def adopt_speculative(state_key, prompt):
+    # 同じプロンプトを先読みしていれば、そのジョブIDを返す（入力が変わっていた・失敗していた場合は捨てる）
+    spec = st.session_state.speculative.get(state_key)
+    if spec is None:
+        return None
+    job = job_manager.get(spec["job_id"])
+    if spec["prompt"] != prompt or job is None or job.status in (FAILED, CANCELLED):
+        cancel_speculative(state_key)
+        return None
+    del st.session_state.speculative[state_key]
+    logger.info("Adopted speculative %s (%s)", state_key, job.status)
+    return spec["job_id"]
+
+def speculate(state_key, prompt, context=None):
+    """ボタンが押される前に生成を始めておく（押されたときに submit_generation が引き継ぐ）
+
+    他のリクエストが順番待ちしているときや、先読みジョブが多すぎるときは何もしない。
+    """
+    spec = st.session_state.speculative.get(state_key)
+    if spec is not None and spec["prompt"] == prompt:
+        return
+    cancel_speculative(state_key) # 元にしたLean Canvasが変わった
+    if results[state_key] or state_key in st.session_state.jobs:
+        return
+    if (gemini_client.scheduler.queue_length() > 0
+            or job_manager.active_count(SPECULATIVE_LABEL_PREFIX) >= SPECULATIVE_MAX_ACTIVE):
+        return
+    # 先読みは誰も求めていない生成なので、他のユーザーの実際の操作（分析を含む）より後に回す
+    task = generation_task(prompt, state_key, context=context, priority=PRIORITY_SPECULATIVE)
+    job_id = job_manager.submit(SPECULATIVE_LABEL_PREFIX + state_key, task)
+    st.session_state.speculative[state_key] = {"job_id": job_id, "prompt": prompt}
+
+def most_used_analyses(limit):
+    # これまでに（全セッションで）よく実行された分析を、多い順に最大 limit 件
+    counts = session_store.usage_counts()
+    used = [option for option in ANALYSIS_PROMPT_TEMPLATES if counts.get(f"analysis_{option}")]
+    return sorted(used, key=lambda option: -counts[f"analysis_{option}"])[:limit]
+
+def start_speculative_jobs():
+    # ドラフト（改訂版）ができたら、次に押されそうなフィードバックとよく使われる分析を先読みする
+    if not st.session_state.get("speculative_prefetch", SPECULATIVE_DEFAULT):
+        cancel_speculative()
+        return
+    draft = results["canvas_draft"]
+    if not draft or "canvas_draft" in st.session_state.jobs:
+        return
+    if not results["feedback"]:
+        speculate("feedback", *feedback_request(gemini_client, draft))
+    if "revised_canvas" in st.session_state.jobs:
+        return # 分析の元になるLean Canvasがこれから変わる
+    canvas_text = results["revised_canvas"] or draft
+    for option in most_used_analyses(SPECULATIVE_ANALYSES):
+        speculate(f"analysis_{option}", *analysis_request(gemini_client, option, canvas_text))
+
+def submit_section_revision(canvas_text, feedback_points, general_points, error_message, refresh=False):
+    """フィードバックで指摘のあったセクションだけを並列に再生成し、元のドラフトに差し込んだものを改訂版とする
+
+    feedback_points は {セクション名: [指摘, ...]}、general_points はどのセクションにも当てはまらない指摘。
+    refresh なら応答キャッシュを使わずに生成し直す。
+    """
+    session_id = st.session_state.session_id
+    priority = generation_priority("revised_canvas")
+
+    def task(job):
+        def on_progress(text):
+            # 完了したセクションから順に差し込んで途中経過として表示する
+            job.queue_position = None
+            job.partial_text = text
+        job.check_cancelled()
+        revised = revise_sections(
+            gemini_client, canvas_text, feedback_points, on_progress=on_progress,
+            check_cancelled=job.check_cancelled, general_points=general_points,
+            session_id=session_id, priority=priority, refresh=refresh,
+            **job_callbacks(job, "revised_canvas"),
+        )
+        return revised, None
+
+    return submit_job("revised_canvas", error_message, task)
+
+# --- 類似アイデア ---
+def start_similar_lookup(user_inputs):
+    """似た入力で以前に生成したドラフトをジョブとして探す（埋め込みの計算はAPI呼び出しなので、スクリプトスレッドでは行わない）
+
+    結果は show_similar_lookup_status() で受け取る。対象は同じセッションのアイデアだけ（共有する設定でなければ）。
+    """
+    cancel_similar_lookup()
+    st.session_state.similar_idea = None
+    session_id = st.session_state.session_id
+    owner = st.session_state.session_token
+
+    def task(job):
+        job.check_cancelled()
+        return idea_index.find_similar(
+            user_inputs, owner=owner, session_id=session_id, priority=PRIORITY_INTERACTIVE,
+            **job_callbacks(job, "similar_idea"),
         )
 
-    submitted = st.form_submit_button("🚀 Lean Canvas ドラフト生成")
-
-    # --- ボタンが押された後の処理 ---
-    if submitted:
-        # 以前の結果をクリア
-        st.session_state.canvas_draft = ""
-        st.session_state.feedback = ""
-        st.session_state.revised_canvas = ""
+    job_id = job_manager.submit("similar_idea", task)
+    st.session_state.similar_lookup = {"job_id": job_id, "user_inputs": user_inputs}
+
+def cancel_similar_lookup():
+    lookup = st.session_state.similar_lookup
+    st.session_state.similar_lookup = None
+    if lookup:
+        job_manager.cancel(lookup["job_id"])
+        job_manager.pop(lookup["job_id"])
+
+def show_similar_lookup_status():
+    """検索中はこの表示部分だけを一定間隔で再実行し、終わったら似たアイデアを表示するか、そのまま生成を始める"""
+    running = st.session_state.similar_lookup is not None
+
+    @st.fragment(run_every=JOB_POLL_INTERVAL_SECONDS if running else None)
+    def similar_lookup_status():
+        lookup = st.session_state.similar_lookup
+        if lookup is None:
+            return
+        job = job_manager.get(lookup["job_id"])
+        if job is not None and not job.finished:
+            if job.queue_position:
+                st.info(f"🔎 以前の似たアイデアを探しています（{job.queue_position}番目）...")
+            else:
+                st.info("🔎 以前の似たアイデアを探しています...")
+            return
+
+        st.session_state.similar_lookup = None
+        job_manager.pop(lookup["job_id"])
+        user_inputs = lookup["user_inputs"]
+        similar = job.result if job is not None and job.status == DONE else None
+        if job is not None and job.status == FAILED:
+            # 検索できなくても生成はできるので、そのまま進める
+            logger.warning("Similar idea lookup failed: %s", job.error)
+        if similar is not None:
+            # 以前のドラフトがすぐに使えるので、生成する前にどうするかを選んでもらう
+            score, entry = similar
+            st.session_state.similar_idea = {"score": score, "entry": entry, "user_inputs": user_inputs}
+            st.rerun()
+        start_draft(user_inputs, draft_prompt(user_inputs))
+
+    similar_lookup_status()
+
+def draft_task(prompt, user_inputs):
+    # ドラフトを生成し、できたものを類似検索の索引に加える（埋め込みの計算もジョブのスレッドで、後回しの優先度で行う）
+    generate = generation_task(prompt, "canvas_draft")
+    session_id = st.session_state.session_id
+    owner = st.session_state.session_token
+
+    def task(job):
+        text, response = generate(job)
+        if idea_index is not None:
+            try:
+                idea_index.add(user_inputs, text, owner=owner, session_id=session_id, priority=PRIORITY_BACKGROUND)
+            except Exception as e:
+                logger.warning("Could not add the draft to the idea index: %s", e)
+        return text, response
+
+    return task
+
+def start_draft(user_inputs, canvas_prompt=None, prior_draft=None):
+    """入力を確定して、以前の結果をクリアしたうえでドラフトを用意する
+
+    prior_draft（似たアイデアの過去のドラフト）を渡すと生成せずにそのまま使い、そうでなければ canvas_prompt を生成する。
+    """
+    st.session_state.similar_idea = None
+    results.pop("canvas_draft", "feedback", "revised_canvas")
+    st.session_state.revision_notice = None
+    st.session_state.partial_outputs = {}
+    st.session_state.generation_errors = {}
+    results["user_inputs"] = dict(user_inputs) # 復元用に入力も保存
+
+    # ドラフトを作り直すので、実行中のフィードバック・改訂・分析ジョブはキャンセルされ、
+    # 以前のドラフト・改訂版を登録した共有コンテキストも不要になる
+    if gemini_client.context_cache is not None:
+        gemini_client.context_cache.release(st.session_state.session_id)
+    cancel_speculative() # 入力が変わったので、先読みしていた結果も使わない
+    if prior_draft is not None:
+        for key in list(st.session_state.jobs):
+            cancel_generation(key)
+        results["canvas_draft"] = prior_draft
+    else:
+        submit_job("canvas_draft", "❌ Lean Canvasドラフト生成中にエラーが発生しました",
+                   draft_task(canvas_prompt, dict(user_inputs)))
+    st.rerun() # 以降のセクションをすべて作り直す
+
+def show_similar_idea(similar):
+    # 似たアイデアが見つかったときに、過去のドラフトを使うか・それを元に直すか・最初から生成するかを選んでもらう
+    entry = similar["entry"]
+    user_inputs = similar["user_inputs"]
+    st.info(f"💡 以前に生成した、よく似たアイデアのドラフトが見つかりました（類似度 {similar['score']:.2f}）")
+    with st.expander("見つかったドラフトを見る", expanded=False):
+        changed = [key for key, value in user_inputs.items() if value != entry["user_inputs"].get(key)]
+        if changed:
+            st.caption(f"今回の入力と異なる項目: {', '.join(changed)}")
+        st.markdown(entry["canvas_draft"])
+    col1, col2, col3 = st.columns(3)
+    if col1.button("✅ このドラフトを使う", help="APIを呼び出さず、見つかったドラフトをそのまま使います。"):
+        start_draft(user_inputs, prior_draft=entry["canvas_draft"])
+    if col2.button("✏️ このドラフトを元に修正", help="入力の違う部分だけを反映するよう、見つかったドラフトを修正します（最初から生成するより短いプロンプトで済みます）。"):
+        start_draft(user_inputs, build_edit_canvas_prompt(entry["canvas_draft"], entry["user_inputs"], user_inputs))
+    if col3.button("🆕 最初から生成"):
+        start_draft(user_inputs, draft_prompt(user_inputs))
+
+def collect_finished_jobs():
+    # 終了したジョブの結果をセッションストアに取り込む（再実行のたびに呼び出す）
+    for state_key, job_info in list(st.session_state.jobs.items()):
+        job = job_manager.get(job_info["job_id"])
+        if job is None:
+            # 期限切れなどでジョブが残っていない
+            del st.session_state.jobs[state_key]
+            continue
+        if not job.finished:
+            continue
+
+        job_manager.pop(job.job_id)
+        del st.session_state.jobs[state_key]
+        if job.status == DONE:
+            text, _response = job.result
+            results[state_key] = text
+            st.session_state.partial_outputs.pop(state_key, None)
+            if "token_savings" in job.info:
+                st.session_state.prompt_savings[state_key] = job.info["token_savings"]
+        elif job.status == FAILED:
+            # 途中までの出力はSession Stateに退避する（show_generation_status で表示）
+            if isinstance(job.error, PartialGenerationError) and job.error.partial_text:
+                st.session_state.partial_outputs[state_key] = job.error.partial_text
+            error_message = f"{job_info['error_message']}: {job.error}"
+            cause = job.error.__cause__ or job.error
+            if is_retryable(cause):
+                error_message += "（APIが混雑しています。しばらく待ってから再度お試しください）"
+            st.session_state.generation_errors[state_key] = error_message
+
+def show_generation_status(state_key, label="生成"):
+    """実行中なら受信済みのテキストを、失敗していればエラーと受信済みの部分を表示する
+
+    実行中の間は、この表示部分（フラグメント）だけを一定間隔で再実行して進捗を反映する。
+    ジョブが終わったら結果を取り込み、他のセクションにも反映するためにスクリプト全体を再実行する。
+    """
+    running = state_key in st.session_state.jobs
+
+    @st.fragment(run_every=JOB_POLL_INTERVAL_SECONDS if running else None)
+    def generation_status():
+        job_info = st.session_state.jobs.get(state_key)
+        if job_info:
+            job = job_manager.get(job_info["job_id"])
+            if job is None or job.finished:
+                collect_finished_jobs()
+                st.rerun()
+            if job.queue_position == 0:
+                st.info(f"⏳ APIが混雑しているため再試行を待っています... ({job.retry_count}回目)")
+            elif job.queue_position:
+                st.info(f"⏳ 順番待ち中です（{job.queue_position}番目）... (ジョブID: `{job.job_id[:8]}`)")
+            else:
+                st.info(f"⏳ {label}中です... (ジョブID: `{job.job_id[:8]}`)")
+            if job.partial_text:
+                st.markdown(job.partial_text + "▌")
+            return
+
+        error_message = st.session_state.generation_errors.get(state_key)
+        if error_message:
+            st.error(error_message)
+        partial = st.session_state.partial_outputs.get(state_key)
+        if partial and not results.get(state_key):
+            st.warning("⚠️ 生成が途中で中断されました。受信済みの部分を表示しています。")
+            st.markdown(partial)
+
+    generation_status()
+
+def submit_analyses(options, canvas_text):
+    # 選択された分析をそれぞれ別のジョブとして投入する
+    for option in options:
+        analysis_key = f'analysis_{option}'
+        # 既存の分析結果があればクリアし、キャッシュを使わずに生成し直す
+        refresh = bool(results[analysis_key])
+        results.pop(analysis_key)
+        session_store.record_usage(analysis_key)
+        analysis_prompt, context = analysis_request(gemini_client, option, canvas_text)
+        if analysis_prompt:
+            submit_generation(
+                analysis_prompt, analysis_key, f"❌ {option} 生成中にエラーが発生しました",
+                full_prompt=build_analysis_prompt(option, canvas_text, compact=False), context=context,
+                refresh=refresh,
+            )
+        else:
+            st.warning(f"{option} に対応するプロンプトが定義されていません。")
+
+collect_finished_jobs()
+
+# --- サイドバー: プロンプト圧縮の効果 ---
+with st.sidebar:
+    st.checkbox("📉 プロンプト圧縮の効果を表示", key="show_prompt_savings",
+                help="フィードバック・改訂・分析のプロンプトに必要なセクションだけを渡したことで、入力トークン数がどれだけ減ったかを表示します。")
+    if st.session_state.show_prompt_savings and st.session_state.prompt_savings:
+        rows = []
+        for step, (full_tokens, compact_tokens) in st.session_state.prompt_savings.items():
+            saved = (1 - compact_tokens / full_tokens) * 100 if full_tokens else 0
+            rows.append({"ステップ": step, "圧縮前": full_tokens, "圧縮後": compact_tokens, "削減率": f"{saved:.0f}%"})
+        st.table(rows)
+
+    st.checkbox("⚡ 次のステップを先読みする", value=SPECULATIVE_DEFAULT, key="speculative_prefetch",
+                help="ドラフトができた時点で、フィードバックとよく使われる分析の生成をバックグラウンドで始めておきます。ボタンを押したときにすぐ結果が表示されますが、使われなかった分もAPIの利用量に含まれます。")
+
+    st.caption("🔗 このページのURLを保存・共有すると、後から生成結果を復元できます。")
+
+    # --- 管理パネル ---
+    if SHOW_ADMIN_PANEL:
+        with st.expander("🛠 管理パネル: 生成呼び出しの統計", expanded=False):
+            telemetry_rows = gemini_client.telemetry.summary()
+            if telemetry_rows:
+                st.table([
+                    {
+                        "ステップ": row["step"],
+                        "呼び出し数": row["calls"],
+                        "エラー": row["errors"],
+                        "ヘッジ": row["hedged"],
+                        "キャッシュヒット率": f"{row['cache_hit_rate']:.0%}",
+                        "p50 (ms)": row["p50_ms"],
+                        "p95 (ms)": row["p95_ms"],
+                        "p99 (ms)": row["p99_ms"],
+                        "TTFT p50 (ms)": row["ttft_p50_ms"],
+                    }
+                    for row in telemetry_rows
+                ])
+            else:
+                st.caption("まだ生成呼び出しの記録がありません。")
+            model_rows = gemini_client.router.summary()
+            if model_rows:
+                st.caption("モデルごとのレイテンシ（ストリーミングは最初のトークンまで。p95 を超えるとヘッジする）")
+                st.table([
+                    {
+                        "モデル": row["model"],
+                        "ストリーミング": "○" if row["streaming"] else "",
+                        "記録数": row["samples"],
+                        "p50 (ms)": row["p50_ms"],
+                        "p95 (ms)": row["p95_ms"],
+                    }
+                    for row in model_rows
+                ])
+            if gemini_client.context_cache is not None:
+                stats = gemini_client.context_cache.stats
+                st.caption(
+                    f"共有コンテキスト: 登録 {stats['created']} / 再利用 {stats['reused']} / "
+                    f"削除 {stats['deleted']} / 登録失敗 {stats['failed']}"
+                )
+            if idea_index is not None:
+                st.caption(f"類似アイデアの索引: {len(idea_index)} 件（{idea_index.embedder.name}、しきい値 {idea_index.threshold}）")
+
+start_speculative_jobs()
 
-        # デバッグ用に追加
-        st.write("DEBUG: Submit button clicked.")
+# --- UIセクション ---
+# 各セクションはフラグメントとして独立に再実行される（ボタンを押しても、そのセクションだけが再実行・再送信される）。
+# 他のセクションの表示が変わる操作（結果のクリアや生成の完了）のときだけ、スクリプト全体を再実行する。
+
+@st.cache_data(show_spinner=False, max_entries=100)
+def render_section_diffs(old_canvas, new_canvas):
+    # 変更のあったセクションごとの unified diff を [(セクション名, diff), ...] で返す（同じ組み合わせでは再計算しない）
+    return [
+        (name, "\n".join(difflib.unified_diff(
+            old_body.splitlines(), new_body.splitlines(), "ドラフト", "改訂版", lineterm=""
+        )))
+        for name, old_body, new_body in diff_sections(old_canvas, new_canvas)
+    ]
 
-        # 必須項目チェック
-        required_keys = ["ターゲット顧客", "顧客の課題", "提供する解決策", "競合", "既存比較と優位性"]
-        all_required_filled = all(st.session_state.user_inputs.get(key) for key in required_keys)
+# --- 1. コア情報入力フォーム ---
+@st.fragment
+def input_section():
+    st.header("1. アイデアのコア情報を入力")
+    st.markdown("以下の項目について、具体的な情報を入力してください。")
+
+    with st.form("lean_canvas_input_form"):
+        # フォーム内にテキストエリアを配置
+        for key, question in QUESTIONS.items():
+            st.session_state.user_inputs[key] = st.text_area(
+                question,
+                value=st.session_state.user_inputs.get(key, ""),
+                height=100,
+                key=f"input_{key}"
+            )
+
+        submitted = st.form_submit_button("🚀 Lean Canvas ドラフト生成")
+
+        # --- ボタンが押された後の処理 ---
+        if submitted:
+            # 必須項目チェック
+            if missing_required_inputs(st.session_state.user_inputs):
+                 st.warning("⚠️ 必須項目（ターゲット顧客、顧客の課題、提供する解決策、競合、既存比較と優位性）をすべて入力してください。")
+            else:
+                user_inputs = dict(st.session_state.user_inputs)
+                if idea_index is not None:
+                    # 以前の似たアイデアを探してから生成する（見つからなければ検索の完了後に生成ジョブを投入）
+                    start_similar_lookup(user_inputs)
+                else:
+                    # 必須項目が満たされていれば生成ジョブを投入（プロンプトの定義は prompts.py）
+                    start_draft(user_inputs, draft_prompt(user_inputs))
 
-        # デバッグ用に追加
-        st.write(f"DEBUG: Required fields check passed: {all_required_filled}")
+    if st.session_state.similar_lookup:
+        show_similar_lookup_status()
+    elif st.session_state.similar_idea:
+        show_similar_idea(st.session_state.similar_idea)
 
-        if not all_required_filled:
-             st.warning("⚠️ 必須項目（ターゲット顧客、顧客の課題、提供する解決策、競合、既存比較と優位性）をすべて入力してください。")
-        else:
-            # 必須項目が満たされていればAPI呼び出しへ
-            with st.spinner("⏳ Lean Canvas ドラフトを生成中...🤖"):
-                # input_summary の作成
-                input_summary = "### 提供された情報:\n"
-                for key, value in st.session_state.user_inputs.items():
-                    input_summary += f"- {key}: {value if value else '(未入力)'}\n"
-
-                # デバッグ用に input_summary を表示
-                st.text_area("DEBUG Input Summary:", input_summary, height=200)
-
-                # プロンプトの定義 (元に戻したシンプルなバージョン)
-                canvas_prompt = f"""
-                あなたは経験豊富なインキュベーターです。
-                以下の提供された情報に基づいて、新規事業のアイデアを整理するため、Lean Canvasのドラフトを作成してください。
-                {input_summary}
-                ### 指示:
-                1. 上記の「提供された情報」を最大限活用し、Lean Canvasの各項目を埋めてください。
-                2. 特に「課題」「顧客セグメント」「ソリューション」「独自の価値提案」「圧倒的優位性」は具体的に記述してください。
-                3. 他の項目も推測できる範囲で記述してください。
-                4. 出力はMarkdown形式で見やすく記述してください。各項目は見出し（例：`**課題:**`）としてください。
-
-                ### Lean Canvas ドラフト案:
-                """
-
-                # デバッグ用に追加
-                st.write("DEBUG: Attempting to call Gemini API for canvas...")
-                # st.text_area("DEBUG Final Prompt Sent:", canvas_prompt, height=300) # 必要ならコメントアウト解除
-
-                # --- API呼び出しとデバッグ情報取得 (ここを修正) ---
-                try: # 外側のtry: API呼び出し全体を囲む
-                    canvas_response = model.generate_content(canvas_prompt, safety_settings=safety_settings)
-
-                    # デバッグ用に追加
-                    st.write("DEBUG: API call successful. Processing response...")
-
-                    st.session_state.canvas_draft = canvas_response.text
-
-                    # ★デバッグ用に追加 (API応答詳細)
-                    try: # 内側のtry: デバッグ情報取得部分を囲む
-                        finish_reason = "不明"
-                        prompt_feedback_info = "N/A"
-                        safety_ratings_info = "N/A"
-                        # candidates属性とリストの存在を確認
-                        if hasattr(canvas_response, 'candidates') and canvas_response.candidates:
-                             candidate = canvas_response.candidates[0] # 最初の候補を取得
-                             # 各属性の存在を確認してからアクセス
-                             if hasattr(candidate, 'finish_reason'):
-                                 finish_reason = candidate.finish_reason
-                             if hasattr(candidate, 'safety_ratings'):
-                                 safety_ratings_info = candidate.safety_ratings
-                        # prompt_feedback属性の存在を確認してからアクセス
-                        if hasattr(canvas_response, 'prompt_feedback'):
-                             prompt_feedback_info = canvas_response.prompt_feedback
-
-                        # Streamlit画面にデバッグ情報を表示
-                        st.subheader("DEBUG: API Response Details")
-                        st.write(f"- Finish Reason: `{finish_reason}`")
-                        st.write(f"- Prompt Feedback: `{prompt_feedback_info}`")
-                        st.write(f"- Safety Ratings: `{safety_ratings_info}`")
-
-                    except Exception as debug_e: # 内側のexcept
-                        st.warning(f"Could not retrieve all debug info from response: {debug_e}")
-
-                    # デバッグ用に追加 (Session State更新確認)
-                    st.write("DEBUG: canvas_draft session state updated.")
-
-                except Exception as e: # 外側のexcept: API呼び出し自体のエラーを捕捉
-                    # デバッグ用にエラーをUIにも表示
-                    st.error(f"❌ Lean Canvasドラフト生成中にエラーが発生しました(DEBUG): {e}")
-                    # ターミナルにもスタックトレースが表示されるはず
+input_section()
 
 # --- 3. ドラフト表示 ---
-# (変更なし)
-if st.session_state.canvas_draft:
+@st.fragment
+def draft_section():
+    show_generation_status("canvas_draft", "Lean Canvas ドラフトを生成")
+    if not results["canvas_draft"]:
+        return
     st.header("2. 生成された Lean Canvas ドラフト")
-    st.markdown(st.session_state.canvas_draft)
+    st.markdown(results["canvas_draft"])
     st.info("📝 これはAIによって生成されたドラフトです。内容を確認し、自身の考えと照らし合わせてください。")
 
     # --- 4. フィードバック取得 ---
     st.header("3. AIからのフィードバック")
     st.markdown("生成されたドラフトに対して、AI（VC役）からのフィードバックを取得します。")
     if st.button("🔍 フィードバックを取得する"):
+        had_feedback = bool(results["feedback"])
         # 以前のフィードバックと改訂版をクリア
-        st.session_state.feedback = ""
-        st.session_state.revised_canvas = ""
-        with st.spinner("⏳ フィードバックを生成中...🧐"):
-            # フィードバック用プロンプト
-            feedback_prompt = f"""
-            あなたは経験豊富なベンチャーキャピタリスト（VC）です。
-            以下のLean Canvasのドラフトを厳しくレビューし、建設的なフィードバックを提供してください。
-
-            ### レビュー対象のLean Canvas ドラフト:
-            ```markdown
-            {st.session_state.canvas_draft}
-            ```
-
-            ### フィードバックの観点:
-            1.  **強み (Strengths):** このプランの良い点、可能性を感じる点はどこですか？
-            2.  **弱み/懸念点 (Weaknesses/Concerns):** 不明瞭な点、矛盾している点、リスクが高いと考えられる点、具体性が不足している点はどこですか？ 仮説が甘い部分はありますか？
-            3.  **不足している視点 (Missing Perspectives):** 考慮されていない重要な要素（顧客ニーズの深掘り、競合分析、市場規模、市場トレンド、規制、仮説検証の方法など）はありますか？ 技術オリエンテッドになりすぎていませんか？
-            4.  **次に行うべきこと/問いかけ (Next Steps/Questions):** この事業アイデアを成功に近づけるために、作成者は次に何を考え、何を検証すべきですか？ 具体的な問いかけを最低3つ記述してください。
-
-            フィードバックは、単なる感想ではなく、具体的で、示唆に富み、行動につながるように記述してください。厳しい視点も歓迎します。出力はMarkdown形式でお願いします。
-            """
-            try:
-                # API呼び出し
-                feedback_response = model.generate_content(feedback_prompt, safety_settings=safety_settings)
-                # 結果をSession Stateに保存
-                st.session_state.feedback = feedback_response.text
-            except Exception as e:
-                st.error(f"❌ フィードバック生成中にエラーが発生しました: {e}")
+        results.pop("feedback", "revised_canvas")
+        st.session_state.revision_notice = None
+        # フィードバック用プロンプト（ドラフトは共有コンテキストとして渡せる場合がある）
+        feedback_prompt, draft_context = feedback_request(gemini_client, results["canvas_draft"])
+        # 生成ジョブを投入（完了時に結果をセッションストアに保存）
+        submit_generation(
+            feedback_prompt, "feedback", "❌ フィードバック生成中にエラーが発生しました",
+            full_prompt=build_feedback_prompt(results["canvas_draft"], compact=False), context=draft_context,
+            refresh=had_feedback, # 2回目以降のクリックでは、同じ答えをキャッシュから返さずに取得し直す
+        )
+        if had_feedback or results["feedback"]:
+            st.rerun() # 以前のフィードバックを消す／先読みしていた結果を表示するため、改訂セクションも作り直す
+    show_generation_status("feedback", "フィードバックを生成")
+
+draft_section()
 
 # --- 5. フィードバック表示 ---
-if st.session_state.feedback:
-     st.markdown("---") # 区切り線
-     st.subheader("AIからのフィードバック:")
-     st.markdown(st.session_state.feedback) # Markdownとして表示
-
-     # --- 6. 改訂版生成 ---
-     st.header("4. フィードバックを基にした改訂")
-     st.markdown("AIからのフィードバックを参考に、Lean Canvasの改訂版を生成します。")
-     if st.button("✍️ フィードバックを基に改訂版を生成する"):
-         st.session_state.revised_canvas = "" # 以前の改訂版をクリア
-         with st.spinner("⏳ 改訂版 Lean Canvas を生成中..."):
-             # 改訂用プロンプト
-             revision_prompt = f"""
-             あなたは経験豊富なビジネスストラテジストです。
-             以下の「元のLean Canvasドラフト」と、それに対する「フィードバック」を読み、フィードバックの内容を反映させて**改訂版のLean Canvas**を作成してください。
-
-             ### 元のLean Canvas ドラフト:
-             ```markdown
-             {st.session_state.canvas_draft}
-             ```
-
-             ### フィードバック:
-             ```markdown
-             {st.session_state.feedback}
-             ```
-
-             ### 改訂指示:
-             1.  フィードバックで指摘された弱点や懸念点に対処するように、元のドラフトの内容を修正・追記してください。
-             2.  フィードバックで提案された「次に行うべきこと」や「問いかけ」に対する答えを、可能な範囲でキャンバスの項目に反映させてください。（例：仮説検証の方法を[主要指標]に加える、リスクを[コスト構造]や[課題]で考慮するなど）
-             3.  元のドラフトの強みは維持・強化するようにしてください。
-             4.  改訂後のLean Canvas全体を出力してください。元のドラフトの形式を踏襲し、Markdown形式で見やすく記述してください。各項目は見出し（例：`**課題:**`）としてください。
-
-             ### 改訂版 Lean Canvas:
-             """
-             try:
-                 # API呼び出し
-                 revision_response = model.generate_content(revision_prompt, safety_settings=safety_settings)
-                 # 結果をSession Stateに保存
-                 st.session_state.revised_canvas = revision_response.text
-             except Exception as e:
-                 st.error(f"❌ 改訂版Lean Canvas生成中にエラーが発生しました: {e}")
-
-# --- 7. 改訂版表示 ---
-if st.session_state.revised_canvas:
-    st.markdown("---")
-    st.header("5. 改訂版 Lean Canvas")
-    st.markdown(st.session_state.revised_canvas)
-    st.success("✅ 改訂版が生成されました！この内容を基に、さらに具体的なアクションプランを検討しましょう。")
+@st.fragment
+def revision_section():
+    if not results["feedback"]:
+        return
+    st.markdown("---") # 区切り線
+    st.subheader("AIからのフィードバック:")
+    st.markdown(results["feedback"]) # Markdownとして表示
+
+    # --- 6. 改訂版生成 ---
+    st.header("4. フィードバックを基にした改訂")
+    st.markdown("AIからのフィードバックを参考に、Lean Canvasの改訂版を生成します。")
+    revision_modes = ["指摘のあったセクションだけ改訂する（高速）", "全体を再生成する"]
+    revision_mode = st.radio("改訂方法:", revision_modes, key="revision_mode", horizontal=True)
+    if st.button("✍️ フィードバックを基に改訂版を生成する"):
+        had_revision = bool(results["revised_canvas"])
+        results.pop("revised_canvas") # 以前の改訂版をクリア
+        revision_error_message = "❌ 改訂版Lean Canvas生成中にエラーが発生しました"
+
+        feedback_points, general_points = {}, []
+        st.session_state.revision_notice = None
+        if revision_mode == revision_modes[0]:
+            # 指摘をセクションに割り当て、該当するセクションだけを再生成する
+            feedback_points, general_points, st.session_state.revision_notice = plan_section_revision(
+                results["canvas_draft"], results["feedback"]
+            )
+
+        if feedback_points:
+            submit_section_revision(results["canvas_draft"], feedback_points, general_points, revision_error_message,
+                                    refresh=had_revision)
+        else:
+            # 改訂用プロンプト
+            revision_prompt, draft_context = revision_request(gemini_client, results["canvas_draft"], results["feedback"])
+            # 生成ジョブを投入（完了時に結果をセッションストアに保存）
+            submit_generation(
+                revision_prompt, "revised_canvas", revision_error_message,
+                full_prompt=build_revision_prompt(results["canvas_draft"], results["feedback"], compact=False),
+                context=draft_context, refresh=had_revision,
+            )
+        if had_revision:
+            st.rerun() # 分析の元になるLean Canvasが変わるので、分析セクションも作り直す
+    if st.session_state.get("revision_notice"):
+        # 全体の再生成に切り替えた理由や、セクションに割り当てられなかった指摘の扱い（再実行後も表示する）
+        st.info(f"ℹ️ {st.session_state.revision_notice}")
+    show_generation_status("revised_canvas", "改訂版 Lean Canvas を生成")
+
+    # --- 7. 改訂版表示 ---
+    if results["revised_canvas"]:
+        st.markdown("---")
+        st.header("5. 改訂版 Lean Canvas")
+        st.markdown(results["revised_canvas"])
+        st.success("✅ 改訂版が生成されました！この内容を基に、さらに具体的なアクションプランを検討しましょう。")
+
+        # ドラフトからの変更点をセクションごとに表示
+        section_diffs = render_section_diffs(results["canvas_draft"], results["revised_canvas"])
+        if section_diffs:
+            with st.expander(f"🔀 ドラフトからの変更点（{len(section_diffs)}セクション）", expanded=False):
+                for name, diff_text in section_diffs:
+                    st.markdown(f"**{name}**")
+                    st.code(diff_text, language="diff")
+
+revision_section()
 
 # --- フッター（任意） ---
 st.markdown("---")
 st.caption("Powered by Google Gemini & Streamlit")
 
 # --- 8. 他のフレームワークでの分析 ---
-if st.session_state.revised_canvas or st.session_state.canvas_draft: # ドラフトか改訂版があれば分析可能
+@st.fragment
+def analysis_section():
+    if not (results["revised_canvas"] or results["canvas_draft"]): # ドラフトか改訂版があれば分析可能
+        return
     st.header("6. 追加分析フレームワーク")
     st.markdown("Lean Canvasの内容を基に、他のビジネスフレームワークで分析を深めます。")
 
     # 分析に使用するLean Canvasのテキストを決定（改訂版があれば優先）
-    canvas_for_analysis = st.session_state.revised_canvas if st.session_state.revised_canvas else st.session_state.canvas_draft
-
-    # --- ↓↓↓ 選択肢リストを修正 ↓↓↓ ---
-    analysis_options = [
-        "選択してください...",
-        "バリュープロポジションキャンバス",
-        "4P分析", # 追加
-        "3C分析", # 追加
-        "SWOT分析"  # SWOTも例として追加（不要なら削除）
-        ]
-    # --- ↑↑↑ 選択肢リストを修正 ↑↑↑ ---
+    canvas_for_analysis = results["revised_canvas"] if results["revised_canvas"] else results["canvas_draft"]
+
+    analysis_options = ["選択してください..."] + list(ANALYSIS_PROMPT_TEMPLATES)
     selected_analysis = st.selectbox("実行したい分析を選択してください:", analysis_options, key="analysis_selectbox")
 
     # --- 分析実行ボタンと条件分岐 ---
     # selected_analysis が "選択してください..." でない場合のみボタンを表示
     if selected_analysis != "選択してください...":
         if st.button(f"📊 {selected_analysis} を実行する", key=f"run_{selected_analysis}_button"):
-            # Session Stateキーを生成
-            analysis_key = f'analysis_{selected_analysis}'
-            # 既存の分析結果があればクリア
-            if analysis_key in st.session_state:
-                del st.session_state[analysis_key]
-
-            with st.spinner(f"⏳ {selected_analysis} を生成中..."):
-                analysis_prompt = "" # プロンプトを初期化
-
-                # --- ↓↓↓ elif ブロックを追加 ↓↓↓ ---
-                if selected_analysis == "バリュープロポジションキャンバス":
-                    analysis_prompt = f"""
-                    あなたは顧客理解と価値提案の専門家です。
-                    以下のLean Canvasの情報（特に顧客セグメント、課題、独自の価値提案、ソリューション）を最重要視し、バリュープロポジションキャンバスの6つの要素を具体的に記述してください。
-                    ### Lean Canvas 情報:
-                    ```markdown
-                    {canvas_for_analysis}
-                    ```
-                    ### バリュープロポジションキャンバス案:
-                    ...(VPC用プロンプト詳細)...
-                    結果はMarkdown形式で見出しを付けて分かりやすく記述してください。
-                    """
-                elif selected_analysis == "4P分析": # ★4P分析の処理を追加
-                    analysis_prompt = f"""
-                    あなたは経験豊富なマーケティング戦略家です。
-                    以下のLean Canvasの情報に基づき、この事業のマーケティングミックスについて4P分析（Product, Price, Place, Promotion）の観点から具体的な戦略案を提案してください。
-
-                    ### Lean Canvas 情報:
-                    ```markdown
-                    {canvas_for_analysis}
-                    ```
-
-                    ### 4P分析案:
-                    **Product (製品・サービス):** (顧客の課題を解決する具体的な製品・サービスの詳細、特徴、品質、デザイン、ブランドなどについて)
-                    **Price (価格):** (価格設定戦略、価格帯、割引、支払い条件などについて)
-                    **Place (流通・場所):** (顧客が製品・サービスにアクセスできる場所や方法、チャネル、物流などについて。Lean Canvasの[チャネル]も参考に)
-                    **Promotion (販促):** (ターゲット顧客への認知度向上、関心喚起、購買意欲促進のための具体的な手法。広告、広報、SNS、イベントなどについて)
-
-                    結果はMarkdown形式で見出しを付けて分かりやすく記述してください。
-                    """
-                elif selected_analysis == "3C分析": # ★3C分析の処理を追加
-                    analysis_prompt = f"""
-                    あなたは経験豊富な経営コンサルタントです。
-                    以下のLean Canvasの情報、特に[顧客セグメント]、[課題]、[ソリューション]、[競合]、[圧倒的優位性]を参考に、この事業を取り巻く3C分析（Customer, Competitor, Company）を行ってください。
-
-                    ### Lean Canvas 情報:
-                    ```markdown
-                    {canvas_for_analysis}
-                    ```
-
-                    ### 3C分析:
-                    **Customer (市場・顧客):** (ターゲット顧客のニーズの深掘り、市場規模や成長性（もし情報があれば）、顧客の行動や意思決定プロセスについて分析してください)
-                    **Competitor (競合):** (Lean Canvasの[競合]で挙げられた競合や代替手段について、それらの強み・弱みを分析し、自社と比較してください)
-                    **Company (自社):** (自社の強み（特に[圧倒的優位性]）、弱み、利用可能なリソース（技術、人材、資金など）、経営課題について分析してください)
-
-                    結果はMarkdown形式で見出しを付けて分かりやすく記述してください。競合と比較した上での自社の位置づけが明確になるようにしてください。
-                    """
-                elif selected_analysis == "SWOT分析": # ★SWOT分析の処理を追加 (例として)
-                     analysis_prompt = f"""
-                     あなたは経験豊富なビジネスアナリストです。
-                     以下のLean Canvasの情報に基づき、この事業のSWOT分析（Strengths:強み, Weaknesses:弱み, Opportunities:機会, Threats:脅威）を行ってください。内部環境（強み・弱み）と外部環境（機会・脅威）を明確に区別してください。
-
-                     ### Lean Canvas:
-                     ```markdown
-                     {canvas_for_analysis}
-                     ```
-
-                     ### SWOT分析:
-                     **Strengths (強み):**
-                     **Weaknesses (弱み):**
-                     **Opportunities (機会):**
-                     **Threats (脅威):**
-
-                     結果はMarkdown形式で見出しを付けて分かりやすく記述してください。
-                     """
-                # --- ↑↑↑ elif ブロックを追加 ↑↑↑ ---
-
-                # プロンプトが生成されていればAPI呼び出し実行
-                if analysis_prompt:
-                    try:
-                        analysis_response = model.generate_content(analysis_prompt, safety_settings=safety_settings)
-                        # 分析結果をSession Stateに保存
-                        st.session_state[analysis_key] = analysis_response.text
-                    except Exception as e:
-                        st.error(f"❌ {selected_analysis} 生成中にエラーが発生しました: {e}")
-                else:
-                    st.warning("選択された分析に対応するプロンプトが定義されていません。")
+            # 分析ジョブを投入（既存の分析結果はクリアされる）
+            submit_analyses([selected_analysis], canvas_for_analysis)
+
+    # --- 複数の分析をまとめて並列実行 ---
+    selected_analyses = st.multiselect(
+        "まとめて実行する分析を選択してください:",
+        analysis_options[1:],
+        default=analysis_options[1:], # 既定ではすべて
+        key="analysis_multiselect"
+    )
+    if st.button("📊 選択した分析をまとめて実行する", key="run_selected_analyses_button", disabled=not selected_analyses):
+        # フレームワークごとに別のジョブとして並列に実行される
+        submit_analyses(selected_analyses, canvas_for_analysis)
 
     # --- 分析結果の表示 ---
     # ↓↓↓ 表示ループを修正 ↓↓↓
@@ -413,15 +801,32 @@ if st.session_state.revised_canvas or st.session_state.canvas_draft: # ドラフ
     analysis_displayed = False # 何か表示されたかどうかのフラグ
     for option in analysis_options[1:]: # "選択してください..." を除くリストでループ
         analysis_key = f'analysis_{option}'
-        if analysis_key in st.session_state and st.session_state[analysis_key]:
+        if analysis_key in st.session_state.jobs:
+            with st.expander(f"▼ {option} 結果（生成中）", expanded=True):
+                 show_generation_status(analysis_key, option + " を生成")
+                 analysis_displayed = True
+        elif analysis_key in results:
             with st.expander(f"▼ {option} 結果", expanded=False): # エキスパンダーで表示
-                 st.markdown(st.session_state[analysis_key])
+                 st.markdown(results[analysis_key])
                  analysis_displayed = True # 表示フラグを立てる
+        elif analysis_key in st.session_state.generation_errors:
+            with st.expander(f"▼ {option} 結果（エラー）", expanded=False):
+                 show_generation_status(analysis_key)
+                 analysis_displayed = True
 
     if not analysis_displayed:
         st.caption("実行したい分析を選択してボタンを押してください。") # まだ何も表示されていない場合
     # --- ↑↑↑ 表示ループを修正 ↑↑↑ ---
 
+analysis_section()
+
 # --- フッター（任意） ---
 # st.markdown("---")
-# st.caption("Powered by Google Gemini & Streamlit")
\ No newline at end of file
+# st.caption("Powered by Google Gemini & Streamlit")
+
+# --- 再実行時間の計測（スクリプト全体の再実行のみ） ---
+_rerun_ms = (time.perf_counter() - _rerun_started) * 1000
+if _rerun_ms > RERUN_BUDGET_MS:
+    logger.warning("Rerun took %.1f ms (budget %.0f ms)", _rerun_ms, RERUN_BUDGET_MS)
+else:
+    logger.debug("Rerun took %.1f ms", _rerun_ms)
@@ -0,0 +1,172 @@
+# --- バッチ評価CLI ---
+# 複数のアイデアをCSV/JSONLから読み込み、画面と同じ流れ（ドラフト → VCフィードバック → 改訂 → 追加分析）で
+# まとめて評価する。各ステージの結果はチェックポイントに保存されるため、中断しても再実行すれば続きから再開できる。
+# 結果ファイル（--out）に完了済み（status "ok"）として記録されたアイデアは、再実行時には処理も書き出しもしない。
+# 一部の分析だけが失敗したもの（status "partial"）は、再実行時にその分析だけをやり直す。
+#
+# 使い方:
+#   GEMINI_API_KEY=... python batch.py ideas.csv --out results.jsonl --markdown-dir reports --frameworks all
+#
+# 入力の列（JSONLならキー）は入力フォームの項目名（ターゲット顧客, 顧客の課題, ...）。"id" 列があれば識別子に使う。
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from engine import Checkpoint, missing_required_inputs, run_idea, render_markdown
+from gemini_client import GeminiClient, DEFAULT_MODEL_NAME
+from model_router import ModelRouter
+from prompts import QUESTIONS, ANALYSIS_PROMPT_TEMPLATES
+from rate_limiter import PRIORITY_BACKGROUND
+
+logger = logging.getLogger("batch")
+
+
+def read_ideas(path):
+    """CSVまたはJSONLからアイデアを読み込み、[(id, 入力dict), ...] を返す"""
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+
+    ideas = []
+    for index, row in enumerate(rows, start=1):
+        idea_id = str(row.get("id") or f"idea-{index:03d}")
+        user_inputs = {key: (row.get(key) or "").strip() for key in QUESTIONS}
+        ideas.append((idea_id, user_inputs))
+    return ideas
+
+
+def completed_ids(path):
+    """結果ファイルに status "ok" で記録済みのIDを返す（再開時に同じアイデアを二重に書き出さないため）"""
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue # 中断で途中までしか書かれなかった行
+            if record.get("status") == "ok":
+                done.add(record.get("id"))
+    return done
+
+
+def end_partial_line(path):
+    # 中断で最後の行が途中までしか書かれていなければ改行を足し、次の結果がその行に続けて書かれないようにする
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+def safe_filename(idea_id):
+    return re.sub(r"[^\w.-]+", "_", idea_id)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Lean Canvas のバッチ評価")
+    parser.add_argument("input", help="アイデアの一覧（.csv または .jsonl）")
+    parser.add_argument("--out", default="batch_results.jsonl", help="結果を追記するJSONLファイル")
+    parser.add_argument("--markdown-dir", help="アイデアごとのMarkdown報告書の出力先")
+    parser.add_argument("--checkpoint-dir", default=".batch_checkpoints", help="ステージごとの途中結果の保存先")
+    parser.add_argument("--frameworks", default="",
+                        help="実行する追加分析（カンマ区切り、または all）。例: 3C分析,SWOT分析")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に処理するアイデア数")
+    parser.add_argument("--full-revision", action="store_true",
+                        help="セクション単位ではなく、常に全体を再生成して改訂する")
+    parser.add_argument("--model", help="すべてのステップでこのモデルだけを使う（省略時はステップごとの設定に従う）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        print("⚠️ 環境変数 GEMINI_API_KEY を設定してください。", file=sys.stderr)
+        return 2
+
+    if args.frameworks == "all":
+        frameworks = list(ANALYSIS_PROMPT_TEMPLATES)
+    else:
+        frameworks = [name.strip() for name in args.frameworks.split(",") if name.strip()]
+    unknown = [name for name in frameworks if name not in ANALYSIS_PROMPT_TEMPLATES]
+    if unknown:
+        print(f"⚠️ 不明な分析フレームワーク: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    ideas = read_ideas(args.input)
+    # 前回までに完了したアイデアは処理も書き出しもしない（失敗・一部失敗したものは再実行して結果を追記する）
+    done = completed_ids(args.out)
+    end_partial_line(args.out)
+    remaining = [(idea_id, user_inputs) for idea_id, user_inputs in ideas if idea_id not in done]
+    if len(remaining) < len(ideas):
+        logger.info("Skipping %d ideas already recorded in %s", len(ideas) - len(remaining), args.out)
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+    if args.markdown_dir:
+        os.makedirs(args.markdown_dir, exist_ok=True)
+
+    router = ModelRouter({"default": [args.model]}) if args.model else None
+    client = GeminiClient(api_key, args.model or DEFAULT_MODEL_NAME, router=router)
+    out_lock = threading.Lock()
+    started = time.perf_counter()
+
+    def process(idea_id, user_inputs):
+        missing = missing_required_inputs(user_inputs)
+        if missing:
+            raise ValueError(f"必須項目が未入力です: {', '.join(missing)}")
+        checkpoint = Checkpoint(os.path.join(args.checkpoint_dir, f"{safe_filename(idea_id)}.json"))
+        results = run_idea(
+            client, user_inputs, frameworks, checkpoint=checkpoint,
+            incremental_revision=not args.full_revision,
+            session_id=idea_id, priority=PRIORITY_BACKGROUND,
+        )
+        if args.markdown_dir:
+            path = os.path.join(args.markdown_dir, f"{safe_filename(idea_id)}.md")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(render_markdown(idea_id, results, frameworks))
+        return results
+
+    succeeded = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+        futures = {executor.submit(process, idea_id, user_inputs): idea_id for idea_id, user_inputs in remaining}
+        for future in as_completed(futures):
+            idea_id = futures[future]
+            try:
+                results = future.result()
+                # 一部の分析が失敗したものは "partial" とし、再実行時に失敗したステージだけをやり直す
+                # （完了済みのステージはチェックポイントから読むのでAPIを呼ばない）
+                status = "partial" if results["errors"] else "ok"
+                record = {"id": idea_id, "status": status, **results}
+                if status == "ok":
+                    succeeded += 1
+            except Exception as e:
+                logger.error("%s failed: %s", idea_id, e)
+                record = {"id": idea_id, "status": "error", "error": f"{type(e).__name__}: {e}"}
+            # 完了したものから順に書き出す
+            with out_lock, open(args.out, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            logger.info("%s: %s", idea_id, record["status"])
+
+    elapsed_minutes = (time.perf_counter() - started) / 60
+    throughput = succeeded / elapsed_minutes if elapsed_minutes > 0 else 0.0
+    logger.info("Finished %d/%d ideas in %.1f min (%.2f ideas/min)",
+                succeeded, len(remaining), elapsed_minutes, throughput)
+    return 0 if succeeded == len(remaining) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
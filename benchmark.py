@@ -0,0 +1,585 @@
+# --- 負荷試験・ベンチマーク ---
+# Gemini API の代わりに、応答時間・生成速度・エラー（429・安全性ブロック）を設定できる偽のモデルを使い、
+# 複数のセッションが同時に 入力 → ドラフト → フィードバック → 改訂 → 追加分析 と進める様子を
+# Streamlit の AppTest で再現して計測する（APIの利用枠は消費しない）。
+# - スクリプト全体の再実行にかかった時間（app.py 自身の計測値）のパーセンタイル
+# - 各ステップのボタンを押してから結果が表示されるまでの時間
+# - API呼び出し数（成功・429・ブロックの内訳）
+# - セッションあたりのメモリ（Session State と保存された生成結果の大きさ）
+# 結果をベースラインとして保存しておけば、app.py を変更した後に同じ条件で比較できる。
+# 計測値はマシンの性能に左右されるため、ベースラインは変更前のコードで、比較と同じマシン上で保存すること。
+#
+# 使い方:
+#   python benchmark.py --sessions 8 --save-baseline benchmark_baseline.json
+#   python benchmark.py --sessions 8 --baseline benchmark_baseline.json   # 許容範囲を超えて悪化していれば終了コード1
+#
+# 応答キャッシュ・セッションDBなどは毎回一時ディレクトリに作り直す。
+# レート制限（LEAN_CANVAS_RPM など）やコンテキストキャッシュの設定は、環境変数で指定すればそれに従う。
+import argparse
+import heapq
+import json
+import logging
+import math
+import os
+import pickle
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from types import SimpleNamespace
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+# ベンチマーク中は実際のAPIのクォータを気にしなくてよいので、既定ではレート制限をほぼ無効にする
+BENCHMARK_ENV_DEFAULTS = {
+    "GEMINI_API_KEY": "benchmark",
+    "LEAN_CANVAS_RPM": "100000",
+    "LEAN_CANVAS_TPM": "1000000000",
+    "LEAN_CANVAS_CONTEXT_CACHE": "off",
+    "LEAN_CANVAS_EMBEDDINGS": "off",
+}
+
+# 計測するステップ（ボタンを押してから、結果が表示されるまで）
+STEPS = ["draft", "feedback", "revision", "analysis"]
+
+# ベースラインとの比較で、許容範囲を超えて大きくなったら悪化とみなす指標
+COMPARED_METRICS = [
+    "rerun_ms.p50", "rerun_ms.p95",
+    *[f"steps.{step}.{stat}" for step in STEPS for stat in ("p50", "p95")],
+    "api_calls.per_session",
+    "memory.per_session_bytes",
+]
+
+logger = logging.getLogger("benchmark")
+
+
+# --- 偽のGeminiモデル ---
+class FakeModelConfig:
+    def __init__(self, latency_median=0.3, latency_sigma=0.5, tokens_per_second=200.0,
+                 rate_limit_rate=0.0, block_rate=0.0, seed=0):
+        self.latency_median = latency_median # 最初のトークンまでの時間の中央値（秒、対数正規分布）
+        self.latency_sigma = latency_sigma
+        self.tokens_per_second = tokens_per_second
+        self.rate_limit_rate = rate_limit_rate # 429（ResourceExhausted）を返す割合
+        self.block_rate = block_rate # 安全性フィルタでブロックされる割合
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._attempts = {} # (モデル名, プロンプト) → 呼び出し回数
+
+    def sample(self, model_name, prompt):
+        """(最初のトークンまでの秒数, 429にするか, ブロックするか)
+
+        スレッドの実行順に左右されないよう、乱数はプロンプトと何回目の呼び出しか（再試行・ヘッジ）から決める。
+        同じ設定・同じシードなら、実行のたびに各呼び出しが同じ応答時間・同じエラーになる。
+        """
+        with self._lock:
+            attempt = self._attempts.get((model_name, prompt), 0)
+            self._attempts[(model_name, prompt)] = attempt + 1
+        rng = random.Random(f"{self.seed}:{model_name}:{attempt}:{prompt}")
+        latency = rng.lognormvariate(math.log(self.latency_median), self.latency_sigma)
+        return latency, rng.random() < self.rate_limit_rate, rng.random() < self.block_rate
+
+
+class CallStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"total": 0, "ok": 0, "rate_limited": 0, "blocked": 0}
+        self.by_kind = {}
+
+    def record(self, kind, outcome):
+        with self._lock:
+            self.counts["total"] += 1
+            self.counts[outcome] += 1
+            self.by_kind[kind] = self.by_kind.get(kind, 0) + 1
+
+
+def classify_prompt(prompt):
+    # プロンプトの内容から、どのステップの呼び出しかを判定する
+    if "ベンチャーキャピタリスト" in prompt:
+        return "feedback"
+    if "のセクションだけを" in prompt:
+        return "section_revision"
+    if "改訂版 Lean Canvas:" in prompt:
+        return "revision"
+    if "Lean Canvas ドラフト案:" in prompt:
+        return "draft"
+    return "analysis"
+
+
+def fake_response_text(kind, prompt):
+    # 後続のステップ（セクション分割・フィードバックの振り分け）が実際と同じように動く形のテキスト
+    variant = zlib.crc32(prompt.encode("utf-8")) % 1000
+    if kind in ("draft", "revision"):
+        from canvas_sections import CANVAS_SECTIONS
+        return "\n\n".join(
+            f"**{name}:**\n- {name}についての仮説（案{variant}）\n- 検証が必要な前提条件と、その確かめ方"
+            for name in CANVAS_SECTIONS
+        )
+    if kind == "feedback":
+        return (
+            "**強み:**\n- 課題設定が具体的です。\n\n"
+            "**弱み/懸念点:**\n- 収益の流れ: 価格設定の根拠が曖昧です。\n"
+            "- チャネル: 最初の顧客をどう獲得するかが不明です。\n"
+            "- 主要指標: 仮説の検証方法が示されていません。\n\n"
+            f"**次に行うべきこと:**\n- 顧客インタビューを10件行ってください（{variant}）。"
+        )
+    if kind == "section_revision":
+        return f"- 指摘を反映して具体化した内容（案{variant}）\n- 検証方法と判断基準"
+    return f"### 分析結果（{variant}）\n" + "\n".join(f"- 観点{i}: 分析内容の要約" for i in range(1, 9))
+
+
+class _Chunk:
+    def __init__(self, text):
+        self._text = text
+
+    @property
+    def text(self):
+        if self._text is None:
+            raise ValueError("The response was blocked (simulated).")
+        return self._text
+
+
+class FakeResponse:
+    def __init__(self, chunks, prompt_tokens, delay_per_chunk, blocked=False):
+        self._chunks = chunks
+        self._delay_per_chunk = delay_per_chunk
+        self.blocked = blocked
+        output_tokens = sum(len(chunk) // 2 for chunk in chunks)
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=prompt_tokens, candidates_token_count=output_tokens,
+            total_token_count=prompt_tokens + output_tokens, cached_content_token_count=0,
+        )
+        self.candidates = [] if blocked else [SimpleNamespace(finish_reason=SimpleNamespace(name="STOP"))]
+        self.prompt_feedback = SimpleNamespace(block_reason=SimpleNamespace(name="SAFETY") if blocked else None)
+
+    @property
+    def text(self):
+        if self.blocked:
+            raise ValueError("The response was blocked (simulated).")
+        return "".join(self._chunks)
+
+    def __iter__(self):
+        if self.blocked:
+            yield _Chunk(None)
+            return
+        for chunk in self._chunks:
+            time.sleep(self._delay_per_chunk)
+            yield _Chunk(chunk)
+
+
+class FakeGenerativeModel:
+    """genai.GenerativeModel の代わり。install_fake_model() で差し替える"""
+
+    config = None
+    stats = None
+    CHUNK_CHARS = 32
+
+    def __init__(self, model_name, **kwargs):
+        self.model_name = model_name
+
+    def count_tokens(self, contents):
+        return SimpleNamespace(total_tokens=max(1, len(str(contents)) // 2))
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        prompt = str(contents)
+        kind = classify_prompt(prompt)
+        latency, rate_limited, blocked = self.config.sample(self.model_name, prompt)
+        time.sleep(latency)
+        if rate_limited:
+            from google.api_core.exceptions import ResourceExhausted
+            self.stats.record(kind, "rate_limited")
+            raise ResourceExhausted("Resource has been exhausted (simulated).")
+        self.stats.record(kind, "blocked" if blocked else "ok")
+
+        text = fake_response_text(kind, prompt)
+        chunks = [text[i:i + self.CHUNK_CHARS] for i in range(0, len(text), self.CHUNK_CHARS)]
+        delay_per_chunk = (self.CHUNK_CHARS / 2) / self.config.tokens_per_second
+        response = FakeResponse(chunks, len(prompt) // 2, delay_per_chunk, blocked=blocked)
+        if not stream:
+            time.sleep(delay_per_chunk * len(chunks)) # 応答全体が生成されるまで待つ
+        return response
+
+
+def install_fake_model(config, stats):
+    import google.generativeai as genai
+    FakeGenerativeModel.config = config
+    FakeGenerativeModel.stats = stats
+    genai.GenerativeModel = FakeGenerativeModel
+
+
+# --- 再実行時間の収集 ---
+class RerunTimeHandler(logging.Handler):
+    # app.py が出力する "Rerun took ... ms" のログから、再実行にかかった時間を集める
+    def __init__(self):
+        super().__init__(level=logging.DEBUG)
+        self.values = []
+
+    def emit(self, record):
+        if isinstance(record.msg, str) and record.msg.startswith("Rerun took"):
+            self.values.append(record.args[0])
+
+
+def summarize(values):
+    from telemetry import percentile
+    values = sorted(values)
+    if not values:
+        return {"count": 0, "p50": None, "p95": None, "p99": None, "max": None}
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "max": round(values[-1], 3),
+    }
+
+
+# --- セッションの再現 ---
+class StepFailed(Exception):
+    pass
+
+
+class SimulatedSession:
+    """1人のユーザーが AppTest 上で全ステップを順に進める
+
+    steps() はジェネレータで、待つ必要があるとき（生成の完了待ち・考える時間）は再開する時刻を yield する。
+    全セッションを run_sessions() が1つのスレッドで再開時刻の順に進める。
+    """
+
+    def __init__(self, index, args, apptest_run_ms):
+        self.index = index
+        self.args = args
+        self.apptest_run_ms = apptest_run_ms # 全セッション共通のリスト（AppTest.run() 1回あたりの時間）
+        self.at = None
+        self.result = {"index": index, "completed": False, "failed_step": None, "error": None, "steps": {},
+                       "session_token": None, "session_state_bytes": 0}
+
+    def _run(self, element=None):
+        started = time.perf_counter()
+        if element is None:
+            self.at.run()
+        else:
+            element.run()
+        self.apptest_run_ms.append((time.perf_counter() - started) * 1000)
+        if self.at.exception:
+            raise StepFailed(f"exception: {self.at.exception[0].value}")
+
+    def _wait_until(self, step, ready):
+        # ジョブの完了を待つ（ブラウザでは進捗表示のフラグメントが定期的に再実行されるのと同じく、一定間隔で再実行する）
+        deadline = time.monotonic() + self.args.step_timeout
+        while not ready():
+            if self.at.error:
+                raise StepFailed(f"{step}: {self.at.error[0].value}")
+            if time.monotonic() > deadline:
+                raise StepFailed(f"{step}: timed out after {self.args.step_timeout}s")
+            yield time.monotonic() + self.args.poll_interval
+            self._run()
+
+    def _button(self, text):
+        for button in self.at.button:
+            if text in button.label:
+                return button
+        raise StepFailed(f"button not found: {text}")
+
+    def _has_header(self, text):
+        return any(text in header.value for header in self.at.header)
+
+    def _analyses_done(self):
+        labels = [expander.label for expander in self.at.expander]
+        return any("結果" in label for label in labels) and not any("（生成中）" in label for label in labels)
+
+    def steps(self):
+        from prompts import QUESTIONS
+        from streamlit.testing.v1 import AppTest
+        self.at = AppTest.from_file(APP_PATH, default_timeout=self.args.step_timeout)
+        step = "open"
+        try:
+            self._run()
+            for step in STEPS:
+                started = time.perf_counter()
+                if step == "draft":
+                    for key, text_area in zip(QUESTIONS, self.at.text_area):
+                        text_area.input(f"{key}についてのサンプル入力（セッション{self.index}）")
+                    self._run(self._button("ドラフト生成").click())
+                    yield from self._wait_until(step, lambda: self._has_header("2. 生成された Lean Canvas ドラフト"))
+                elif step == "feedback":
+                    self._run(self._button("フィードバックを取得する").click())
+                    yield from self._wait_until(
+                        step, lambda: any("AIからのフィードバック:" in s.value for s in self.at.subheader))
+                elif step == "revision":
+                    self._run(self._button("改訂版を生成する").click())
+                    yield from self._wait_until(step, lambda: self._has_header("5. 改訂版 Lean Canvas"))
+                else:
+                    if self.args.analyses is not None:
+                        multiselect = self.at.multiselect(key="analysis_multiselect")
+                        multiselect.set_value(list(multiselect.options)[:self.args.analyses])
+                    self._run(self._button("まとめて実行する").click())
+                    yield from self._wait_until(step, self._analyses_done)
+                self.result["steps"][step] = time.perf_counter() - started
+                yield time.monotonic() + self.args.think_time # 結果を読んでから次のボタンを押すまでの時間
+            self.result["completed"] = True
+        except Exception as e:
+            self.result["failed_step"] = step
+            self.result["error"] = f"{type(e).__name__}: {e}"
+            logger.warning("Session %d failed at %s: %s", self.index, step, self.result["error"])
+
+        state = self.at.session_state
+        if "session_token" in state:
+            self.result["session_token"] = state["session_token"]
+        self.result["session_state_bytes"] = session_state_bytes(state)
+
+
+def run_sessions(sessions, ramp_up):
+    """全セッションを1つのスレッドで、再開時刻の早いものから順に進める
+
+    AppTest はプロセス全体の状態（Runtime のモックなど）を書き換えるため、複数スレッドから同時に実行すると不安定になる。
+    スクリプトの再実行は1つずつ行い、生成ジョブ（バックグラウンドのスレッド）だけが並行して進む。
+    """
+    started = time.monotonic()
+    interval = ramp_up / len(sessions) if sessions else 0
+    queue = [(started + session.index * interval, session.index, session.steps()) for session in sessions]
+    heapq.heapify(queue)
+    while queue:
+        resume_at, index, steps = heapq.heappop(queue)
+        delay = resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            heapq.heappush(queue, (next(steps), index, steps))
+        except StopIteration:
+            pass
+
+
+def session_state_bytes(state):
+    # Session State に保持されている値の大きさ（pickle できないものは除く）
+    total = 0
+    for key in state.keys():
+        if str(key).startswith("$$"): # AppTest・Streamlit内部の値
+            continue
+        try:
+            total += len(pickle.dumps(state[key]))
+        except Exception:
+            continue
+    return total
+
+
+def stored_result_bytes(db_path, tokens):
+    # 各セッションの生成結果をセッションストアに読み込んだときの大きさ（メモリ上限の計算に使う値）
+    from session_store import SessionStore
+    store = SessionStore(db_path)
+    for token in tokens:
+        store.get(token, "user_inputs")
+    return store.stats()["hot_bytes"]
+
+
+# --- 実行 ---
+def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix="lean_canvas_benchmark_")
+    logger.info("Writing caches, sessions and telemetry to %s", workdir)
+    for name, value in BENCHMARK_ENV_DEFAULTS.items():
+        os.environ.setdefault(name, value)
+    db_path = os.path.join(workdir, "sessions.sqlite3")
+    os.environ.update({
+        "LEAN_CANVAS_CACHE_DIR": os.path.join(workdir, "cache"),
+        "LEAN_CANVAS_SESSION_DB": db_path,
+        "LEAN_CANVAS_TELEMETRY_LOG": os.path.join(workdir, "telemetry.jsonl"),
+        "LEAN_CANVAS_INDEX_DIR": os.path.join(workdir, "index"),
+    })
+
+    stats = CallStats()
+    install_fake_model(FakeModelConfig(
+        latency_median=args.latency_median, latency_sigma=args.latency_sigma,
+        tokens_per_second=args.tokens_per_second, rate_limit_rate=args.rate_limit_rate,
+        block_rate=args.block_rate, seed=args.seed,
+    ), stats)
+
+    # AppTest では app.py は __main__ として実行される。再実行時間のログは集計に回し、画面には出さない
+    app_logger = logging.getLogger("__main__")
+    rerun_handler = RerunTimeHandler()
+    app_logger.addHandler(rerun_handler)
+    app_logger.setLevel(logging.DEBUG)
+    app_logger.propagate = False
+
+    # 1回目の実行（モジュールの import や共有リソースの生成）は別に計測する
+    from streamlit.testing.v1 import AppTest
+    started = time.perf_counter()
+    AppTest.from_file(APP_PATH, default_timeout=args.step_timeout).run()
+    cold_start_ms = (time.perf_counter() - started) * 1000
+    rerun_handler.values.clear()
+
+    if args.trace_memory:
+        tracemalloc.start()
+    traced_before = tracemalloc.get_traced_memory()[0] if args.trace_memory else 0
+
+    # 同時に args.sessions 人が操作するのを args.rounds 回繰り返し、全ラウンドの計測値をまとめて集計する
+    # （セッションごとに入力が異なるので、前のラウンドの応答キャッシュには当たらない）
+    apptest_run_ms = []
+    sessions = []
+    started = time.perf_counter()
+    for round_index in range(args.rounds):
+        batch = [SimulatedSession(round_index * args.sessions + index, args, apptest_run_ms)
+                 for index in range(args.sessions)]
+        run_sessions(batch, args.ramp_up)
+        sessions.extend(batch)
+    wall_seconds = time.perf_counter() - started
+    session_results = [session.result for session in sessions]
+    total_sessions = len(sessions)
+
+    traced_per_session = None
+    if args.trace_memory:
+        # AppTest（Session State を含む）が残っている間に測る
+        traced_per_session = round((tracemalloc.get_traced_memory()[0] - traced_before) / max(1, total_sessions))
+        tracemalloc.stop()
+    app_logger.removeHandler(rerun_handler)
+    app_logger.propagate = True
+
+    completed = [result for result in session_results if result["completed"]]
+    tokens = [result["session_token"] for result in session_results if result["session_token"]]
+    state_bytes = [result["session_state_bytes"] for result in session_results]
+    stored_bytes = stored_result_bytes(db_path, tokens)
+    return {
+        "config": {
+            "sessions": args.sessions, "rounds": args.rounds, "analyses": args.analyses, "think_time": args.think_time,
+            "ramp_up": args.ramp_up, "latency_median": args.latency_median, "latency_sigma": args.latency_sigma,
+            "tokens_per_second": args.tokens_per_second, "rate_limit_rate": args.rate_limit_rate,
+            "block_rate": args.block_rate, "seed": args.seed,
+        },
+        "wall_seconds": round(wall_seconds, 3),
+        "cold_start_ms": round(cold_start_ms, 1),
+        "completed_sessions": len(completed),
+        "failures": [
+            {"index": result["index"], "step": result["failed_step"], "error": result["error"]}
+            for result in session_results if not result["completed"]
+        ],
+        "rerun_ms": summarize(rerun_handler.values),
+        "apptest_run_ms": summarize(apptest_run_ms),
+        "steps": {
+            step: summarize([result["steps"][step] for result in session_results if step in result["steps"]])
+            for step in STEPS
+        },
+        "api_calls": {
+            **stats.counts,
+            "per_session": round(stats.counts["total"] / max(1, total_sessions), 2),
+            "by_kind": dict(sorted(stats.by_kind.items())),
+        },
+        "memory": {
+            "session_state_bytes": summarize(state_bytes),
+            "stored_result_bytes": stored_bytes,
+            "per_session_bytes": round((sum(state_bytes) + stored_bytes) / max(1, total_sessions)),
+            "traced_per_session_bytes": traced_per_session,
+        },
+    }
+
+
+def metric_value(report, name):
+    value = report
+    for part in name.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def compare_with_baseline(report, baseline, tolerance):
+    """ベースラインとの比較結果の行と、悪化した指標の一覧を返す"""
+    rows = []
+    regressions = []
+    for name in COMPARED_METRICS:
+        current, previous = metric_value(report, name), metric_value(baseline, name)
+        if current is None or not previous:
+            continue
+        change = current / previous - 1
+        regressed = change > tolerance
+        rows.append(f"{name:<32} {previous:>12} → {current:>12} ({change:+.0%}){'  ← 悪化' if regressed else ''}")
+        if regressed:
+            regressions.append(name)
+    if report["completed_sessions"] < baseline.get("completed_sessions", 0):
+        regressions.append("completed_sessions")
+        rows.append(f"{'completed_sessions':<32} {baseline['completed_sessions']:>12} → "
+                    f"{report['completed_sessions']:>12}  ← 悪化")
+    if report["config"] != baseline.get("config"):
+        rows.append("⚠️ ベースラインと設定が異なるため、比較結果は参考程度です。")
+    return rows, regressions
+
+
+def print_report(report):
+    config = report["config"]
+    print(f"セッション: {report['completed_sessions']}/{config['sessions'] * config['rounds']} 完了 "
+          f"（{report['wall_seconds']:.1f} 秒、初回の実行 {report['cold_start_ms']:.0f} ms）")
+    rerun = report["rerun_ms"]
+    print(f"再実行 (ms): p50 {rerun['p50']} / p95 {rerun['p95']} / p99 {rerun['p99']} / max {rerun['max']} "
+          f"（{rerun['count']} 回）")
+    for step, values in report["steps"].items():
+        print(f"  {step:<10} (秒): p50 {values['p50']} / p95 {values['p95']} / max {values['max']}")
+    calls = report["api_calls"]
+    print(f"API呼び出し: {calls['total']} 回（セッションあたり {calls['per_session']}、"
+          f"429 {calls['rate_limited']}、ブロック {calls['blocked']}） {calls['by_kind']}")
+    memory = report["memory"]
+    print(f"メモリ: セッションあたり {memory['per_session_bytes']} bytes"
+          + (f"（tracemalloc: {memory['traced_per_session_bytes']} bytes）"
+             if memory["traced_per_session_bytes"] is not None else ""))
+    for failure in report["failures"]:
+        print(f"  ✗ セッション{failure['index']} ({failure['step']}): {failure['error']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Lean Canvas アプリの負荷試験・ベンチマーク（偽のGeminiモデルを使用）")
+    parser.add_argument("--sessions", type=int, default=8, help="同時に操作するセッション数")
+    parser.add_argument("--rounds", type=int, default=3,
+                        help="同時操作を繰り返す回数（多いほど計測値のばらつきが小さくなる）")
+    parser.add_argument("--analyses", type=int, help="まとめて実行する分析の数（省略時は画面の既定どおりすべて）")
+    parser.add_argument("--think-time", type=float, default=0.5, help="結果が表示されてから次のボタンを押すまでの秒数")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="全セッションを開始し終えるまでの秒数")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="生成の完了を確認する間隔（秒）")
+    parser.add_argument("--step-timeout", type=float, default=120.0, help="1ステップの完了を待つ上限（秒）")
+    parser.add_argument("--latency-median", type=float, default=0.3, help="偽のモデルが最初のトークンを返すまでの秒数（中央値）")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="応答時間のばらつき（対数正規分布のσ）")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="偽のモデルの生成速度")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="429を返す呼び出しの割合（0〜1）")
+    parser.add_argument("--block-rate", type=float, default=0.0, help="安全性フィルタでブロックする呼び出しの割合（0〜1）")
+    parser.add_argument("--seed", type=int, default=0, help="応答時間・エラーの乱数のシード")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="tracemalloc でセッションあたりのメモリも測る（計測中は処理が遅くなる）")
+    parser.add_argument("--out", help="結果のJSONの保存先")
+    parser.add_argument("--save-baseline", help="結果をベースラインとして保存する")
+    parser.add_argument("--baseline", help="比較するベースラインのJSON")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="ベースラインからの悪化をどこまで許容するか（0.25 なら25%%）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    logging.getLogger("benchmark").setLevel(logging.INFO)
+    sys.path.insert(0, os.path.dirname(APP_PATH))
+
+    report = run_benchmark(args)
+    print_report(report)
+    for path in (args.out, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            logger.info("Saved %s", path)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows, regressions = compare_with_baseline(report, baseline, args.tolerance)
+        print(f"\nベースライン {args.baseline} との比較（許容 +{args.tolerance:.0%}）:")
+        for row in rows:
+            print("  " + row)
+        if regressions:
+            print(f"❌ 悪化した指標: {', '.join(regressions)}")
+            return 1
+        print("✅ 許容範囲内です。")
+    # ブロックを注入していなければ、すべてのセッションが最後まで進むはず
+    if args.block_rate == 0 and report["completed_sessions"] < args.sessions * args.rounds:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
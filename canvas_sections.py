@@ -0,0 +1,293 @@
+# --- Lean Canvas のセクション分割 ---
+# 生成されたLean Canvas（Markdown）を `**課題:**` のような見出しごとに分割し、
+# 後続のプロンプトには必要なセクションだけを渡せるようにする。
+import re
+from functools import lru_cache
+
+# 標準のセクション名（表示順）
+CANVAS_SECTIONS = [
+    "課題",
+    "顧客セグメント",
+    "独自の価値提案",
+    "ソリューション",
+    "チャネル",
+    "収益の流れ",
+    "コスト構造",
+    "主要指標",
+    "圧倒的優位性",
+    "競合",
+]
+
+# 見出しの表記ゆれ（見出しに含まれる語 → 標準のセクション名）。長いものから順に照合する
+SECTION_ALIASES = {
+    "顧客セグメント": "顧客セグメント",
+    "独自の価値提案": "独自の価値提案",
+    "価値提案": "独自の価値提案",
+    "ソリューション": "ソリューション",
+    "解決策": "ソリューション",
+    "チャネル": "チャネル",
+    "チャネル（経路）": "チャネル",
+    "収益の流れ": "収益の流れ",
+    "収益": "収益の流れ",
+    "コスト構造": "コスト構造",
+    "コスト": "コスト構造",
+    "主要指標": "主要指標",
+    "主要な指標": "主要指標",
+    "KPI": "主要指標",
+    "圧倒的優位性": "圧倒的優位性",
+    "圧倒的な優位性": "圧倒的優位性",
+    "優位性": "圧倒的優位性",
+    "競合": "競合",
+    "課題": "課題",
+}
+
+_ALIASES_BY_LENGTH = sorted(SECTION_ALIASES, key=len, reverse=True)
+
+# 見出し行: `**課題:**` / `**1. 課題 (Problem)**:` / `- **課題:** 本文` / `### 課題`
+_BOLD_HEADING = re.compile(r"^\s*(?:[-*]\s+)?\*\*(?P<title>[^*]+?)\*\*\s*[:：]?\s*(?P<rest>.*)$")
+_HASH_HEADING = re.compile(r"^\s*#{1,6}\s+(?P<title>.+?)\s*$")
+_LIST_BULLET = re.compile(r"^\s*[-*+]\s+")
+_RULE = re.compile(r"^\s*(?:-{3,}|\*{3,}|_{3,})\s*$")
+_TITLE_NOISE = re.compile(r"^\s*\d+[.)]\s*|[:：]\s*$|\s*[（(][^）)]*[）)]\s*")
+
+# これより少ないセクションしか見つからない場合は、分割に失敗したとみなして元のテキストを使う
+MIN_SECTIONS_FOR_COMPACTION = 3
+
+
+def normalize_heading(title, exact=False):
+    """見出し文字列を標準のセクション名に変換する（該当しなければ None）
+
+    exact なら見出し全体が別名と一致する場合だけ変換する（箇条書きの中の `**コスト削減効果:**` のような小見出し用）。
+    """
+    cleaned = _TITLE_NOISE.sub("", title).strip()
+    if exact:
+        return SECTION_ALIASES.get(cleaned)
+    for alias in _ALIASES_BY_LENGTH:
+        if alias in cleaned:
+            # 「課題」は「顧客の課題を解決する…」のような文中の語にも一致するので、見出しが短い場合だけ採用する
+            if alias == "課題" and len(cleaned) > 8:
+                continue
+            return SECTION_ALIASES[alias]
+    return None
+
+
+@lru_cache(maxsize=256)
+def _parse(canvas_text):
+    sections = {}
+    current = None
+    lines = []
+    for line in canvas_text.splitlines():
+        match = _BOLD_HEADING.match(line) or _HASH_HEADING.match(line)
+        # 箇条書きの太字はセクション内の小見出しのことが多いので、セクション名そのものの場合だけ見出しとみなす
+        name = normalize_heading(match.group("title"), exact=bool(_LIST_BULLET.match(line))) if match else None
+        if name is not None and name not in sections:
+            if current is not None:
+                sections[current] = "\n".join(lines).strip()
+            current = name
+            rest = match.groupdict().get("rest") or ""
+            lines = [rest] if rest.strip() else []
+            continue
+        if _RULE.match(line):
+            # 区切り線の後は締めの挨拶などなので、次の見出しまで捨てる
+            if current is not None:
+                sections[current] = "\n".join(lines).strip()
+            current = None
+            lines = []
+            continue
+        if current is not None:
+            lines.append(line)
+        # 最初の見出しより前（前置きの文章など）は捨てる
+    if current is not None:
+        sections[current] = "\n".join(lines).strip()
+    return tuple(sections.items())
+
+
+def parse_canvas(canvas_text):
+    """Lean Canvasのテキストを {セクション名: 本文} に分割する（結果はテキストごとにキャッシュされる）"""
+    return dict(_parse(canvas_text or ""))
+
+
+def _squeeze(text):
+    # 連続する空行や行末の空白を詰める
+    text = re.sub(r"[ \t]+\n", "\n", text)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+def compact_canvas(canvas_text, section_names=None):
+    """必要なセクションだけを含む、コンパクトなLean Canvasのテキストを返す
+
+    section_names が None なら全セクションを含める。
+    分割に失敗した場合や、必要なセクションが見つからない場合は元のテキストをそのまま使う。
+    """
+    sections = parse_canvas(canvas_text)
+    if len(sections) < MIN_SECTIONS_FOR_COMPACTION:
+        return _squeeze(canvas_text or "")
+
+    names = [name for name in CANVAS_SECTIONS if name in sections]
+    if section_names is not None:
+        wanted = [name for name in section_names if name in sections]
+        if not wanted:
+            return _squeeze(canvas_text)
+        names = wanted
+    return "\n\n".join(f"**{name}:**\n{_squeeze(sections[name])}" for name in names)
+
+
+def compact_text(text):
+    return _squeeze(text or "")
+
+
+# フィードバック中の語 → 関係するセクション（SECTION_ALIASES に加えて照合する）
+# 「顧客」「市場」のようにどの指摘にも出てくる語は、ほぼ全セクションに割り当たってしまうので含めない
+FEEDBACK_KEYWORDS = {
+    "価格": "収益の流れ",
+    "マネタイズ": "収益の流れ",
+    "ビジネスモデル": "収益の流れ",
+    "販売": "チャネル",
+    "集客": "チャネル",
+    "マーケティング": "チャネル",
+    "指標": "主要指標",
+    "ターゲット": "顧客セグメント",
+    "ニーズ": "課題",
+    "ペイン": "課題",
+    "差別化": "圧倒的優位性",
+    "参入障壁": "圧倒的優位性",
+    "機能": "ソリューション",
+    "費用": "コスト構造",
+    "資金": "コスト構造",
+}
+
+# フィードバックの観点（FEEDBACK_PROMPT_TEMPLATE の4つの見出し）のうち、改訂の対象になるもの・ならないもの。
+# 見出しの先頭の語で判定する（番号や括弧書きは除いて比較）
+FEEDBACK_PART_MARKERS = {
+    "弱み": True,
+    "懸念": True,
+    "不足": True,
+    "次に": True,
+    "問いかけ": True,
+    "weakness": True,
+    "concern": True,
+    "missing": True,
+    "next": True,
+    "強み": False,
+    "良い点": False,
+    "総評": False,
+    "まとめ": False,
+    "strength": False,
+    "summary": False,
+}
+
+_BULLET = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+")
+
+
+def _feedback_part(line):
+    """フィードバックの観点の見出し行なら (改訂の対象か, 見出しと同じ行の本文) を返す（見出しでなければ None）
+
+    `### 2. 弱み/懸念点` や `**2. 弱み/懸念点 (Weaknesses):**`、`2. **弱み/懸念点:** 本文` を見出しとみなす。
+    `- **収益モデル:** ...` のような `-` `*` の箇条書きは観点の中の指摘として扱う。
+    """
+    match = _HASH_HEADING.match(line)
+    rest = ""
+    if match is None:
+        if _LIST_BULLET.match(line):
+            return None
+        match = _BOLD_HEADING.match(_BULLET.sub("", line))
+        if match is None:
+            return None
+        rest = match.group("rest")
+    title = _TITLE_NOISE.sub("", match.group("title").replace("*", "")).strip().lower()
+    for marker, critical in FEEDBACK_PART_MARKERS.items():
+        if title.startswith(marker):
+            return critical, rest.strip()
+    return None
+
+
+def _feedback_points(feedback_text):
+    # 弱み・不足している視点・次に行うべきことの観点に書かれた指摘だけを取り出す
+    # （観点の見出しが見つからない形式なら、すべての行を指摘として扱う）
+    lines = (feedback_text or "").splitlines()
+    parts = [_feedback_part(line) for line in lines]
+    if not any(part is not None for part in parts):
+        return [_BULLET.sub("", line).strip() for line in lines if not _HASH_HEADING.match(line)]
+    points = []
+    critical = False
+    for line, part in zip(lines, parts):
+        if part is not None:
+            critical, rest = part
+            if critical and rest:
+                points.append(rest)
+            continue
+        if critical and not _HASH_HEADING.match(line):
+            points.append(_BULLET.sub("", line).strip())
+    return points
+
+
+def _assign_feedback(feedback_text):
+    # 指摘ごとに関係するセクションを求め、(割り当て, どのセクションにも当てはまらない指摘のリスト) を返す
+    points = {}
+    unmapped = []
+    for point in _feedback_points(feedback_text):
+        if not point or _RULE.match(point):
+            continue
+        matched = set()
+        for alias in _ALIASES_BY_LENGTH:
+            if alias in point:
+                matched.add(SECTION_ALIASES[alias])
+        for keyword, name in FEEDBACK_KEYWORDS.items():
+            if keyword in point:
+                matched.add(name)
+        for name in matched:
+            points.setdefault(name, []).append(point)
+        if not matched:
+            unmapped.append(point)
+    return {name: points[name] for name in CANVAS_SECTIONS if name in points}, unmapped
+
+
+def map_feedback_to_sections(feedback_text):
+    """フィードバックの指摘（弱み・不足している視点・次に行うべきことの各行）を関係するセクションに割り当てる
+
+    強みとして挙げられた点は改訂の対象にしない。
+    戻り値は {セクション名: [指摘, ...]}（CANVAS_SECTIONS の順）。どのセクションにも当てはまらない指摘は含めない。
+    """
+    return _assign_feedback(feedback_text)[0]
+
+
+def unmapped_feedback_points(feedback_text):
+    """どのセクションにも当てはまらなかった指摘を返す（市場規模・規制などLean Canvas全体に関わるもの）"""
+    return _assign_feedback(feedback_text)[1]
+
+
+def render_sections(sections):
+    # {セクション名: 本文} を `**課題:**` 形式のMarkdownに戻す
+    names = [name for name in CANVAS_SECTIONS if name in sections]
+    names += [name for name in sections if name not in CANVAS_SECTIONS]
+    return "\n\n".join(f"**{name}:**\n{_squeeze(sections[name])}" for name in names)
+
+
+def extract_section_body(generated_text, section_name):
+    # セクション単位で再生成した出力から本文だけを取り出す（見出しを付けて返してきた場合に備える）
+    sections = parse_canvas(generated_text)
+    if section_name in sections:
+        return sections[section_name]
+    return _squeeze(generated_text or "")
+
+
+def merge_sections(canvas_text, updates):
+    """元のLean Canvasの一部のセクションを updates（{セクション名: 新しい本文}）で置き換える"""
+    sections = parse_canvas(canvas_text)
+    sections.update(updates)
+    return render_sections(sections)
+
+
+def diff_sections(old_canvas, new_canvas):
+    """セクションごとに比較し、変更のあったものを [(セクション名, 変更前, 変更後), ...] で返す"""
+    old_sections = parse_canvas(old_canvas)
+    new_sections = parse_canvas(new_canvas)
+    if len(old_sections) < MIN_SECTIONS_FOR_COMPACTION or len(new_sections) < MIN_SECTIONS_FOR_COMPACTION:
+        return []
+    changes = []
+    for name in CANVAS_SECTIONS:
+        old = _squeeze(old_sections.get(name, ""))
+        new = _squeeze(new_sections.get(name, ""))
+        if old != new:
+            changes.append((name, old, new))
+    return changes
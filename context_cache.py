@@ -0,0 +1,263 @@
+# --- 共有コンテキストのキャッシュ ---
+# ドラフト（または改訂版）ができた後の フィードバック・改訂・各分析 では、同じLean Canvasを毎回プロンプトに含めて送っている。
+# そのLean Canvasと共通の前置きを「キャッシュ済みコンテキスト」としてモデル側に1回だけ登録し、
+# 後続の呼び出しからはそれを参照することで、入力トークンの処理時間と費用を減らす。
+# - 同じ内容のコンテキストはセッションをまたいで共有する（内容のハッシュで識別）
+# - セッションごとに直近のコンテキストだけを保持し、ドラフトや改訂版が変われば古いものは削除する
+#   （ステップによってモデルが違うので、同じLean Canvasでもモデルごとに登録される。保持する数はLean Canvas単位で数える）
+# - バックエンドは Gemini の CachedContent と、オフラインで試せるローカル版の2つ
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from rate_limiter import estimate_input_tokens
+
+# "gemini"（既定）/ "local"（オフライン検証用）/ "off"
+DEFAULT_BACKEND = os.getenv("LEAN_CANVAS_CONTEXT_CACHE", "gemini")
+DEFAULT_TTL_SECONDS = int(os.getenv("LEAN_CANVAS_CONTEXT_TTL", str(30 * 60)))
+# キャッシュできるコンテキストの最小トークン数（Gemini 1.5 の下限は 32,768）。これより短いものはプロンプトに直接含める
+# 通常の長さのLean Canvasは下限に届かないので、ほとんどの場合はプロンプトに直接含めることになる
+DEFAULT_MIN_TOKENS = int(os.getenv("LEAN_CANVAS_CONTEXT_MIN_TOKENS", "32768"))
+# Gemini のコンテキストキャッシュはバージョン付きのモデル（"gemini-1.5-flash-002" など）でしか使えない
+_VERSIONED_MODEL = re.compile(r"-\d{3}$")
+# セッションごとに保持するコンテキストの数（ドラフト用と改訂版用。Lean Canvas単位で数える）
+CONTEXTS_PER_SESSION = 2
+# 期限の少し前に作り直す（呼び出し中に期限切れにならないように）
+EXPIRY_MARGIN_SECONDS = 60
+# 登録に失敗した内容は、しばらくの間は登録を試みずにプロンプトに直接含める
+FAILURE_BACKOFF_SECONDS = 5 * 60
+
+# 登録済みのコンテキストを参照できなかった（期限切れで削除済みなど）ことを示すエラー
+STALE_CONTEXT_ERROR_NAMES = {"NotFound", "PermissionDenied", "FailedPrecondition", "LookupError"}
+
+logger = logging.getLogger(__name__)
+
+
+def make_context_key(model_name, system_instruction, context_text):
+    raw = "\0".join([model_name, system_instruction or "", context_text])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def make_content_key(system_instruction, context_text):
+    # モデルによらない、コンテキストの内容だけのキー（セッションごとの保持数を数える単位）
+    return make_context_key("", system_instruction, context_text)
+
+
+def is_stale_context_error(error):
+    return type(error).__name__ in STALE_CONTEXT_ERROR_NAMES
+
+
+def inline_prompt(system_instruction, context_text, prompt):
+    # キャッシュを使わない場合に送るプロンプト（共通の前置き → コンテキスト → 各ステップの指示）
+    return "\n".join(part for part in (system_instruction, context_text, prompt) if part)
+
+
+class GeminiContextBackend:
+    """Gemini の CachedContent を使うバックエンド"""
+
+    def supports(self, model_name):
+        return bool(_VERSIONED_MODEL.search(model_name))
+
+    def create(self, model_name, system_instruction, context_text, ttl_seconds):
+        import datetime
+        from google.generativeai import caching
+        model = model_name if model_name.startswith("models/") else f"models/{model_name}"
+        return caching.CachedContent.create(
+            model=model,
+            system_instruction=system_instruction,
+            contents=[context_text],
+            ttl=datetime.timedelta(seconds=ttl_seconds),
+        )
+
+    def model_for(self, handle, base_model):
+        import google.generativeai as genai
+        return genai.GenerativeModel.from_cached_content(cached_content=handle)
+
+    def delete(self, handle):
+        handle.delete()
+
+
+class _LocalHandle:
+    def __init__(self, name, system_instruction, context_text):
+        self.name = name
+        self.system_instruction = system_instruction
+        self.context_text = context_text
+
+
+class _LocalCachedModel:
+    # 登録済みのコンテキストをプロンプトの前に付けて、元のモデルを呼び出す
+    def __init__(self, handle, base_model):
+        self.handle = handle
+        self.base_model = base_model
+
+    def generate_content(self, prompt, **kwargs):
+        full_prompt = inline_prompt(self.handle.system_instruction, self.handle.context_text, prompt)
+        return self.base_model.generate_content(full_prompt, **kwargs)
+
+
+class LocalContextBackend:
+    """プロセス内に保持するだけのバックエンド（APIなしで登録・参照・削除の流れを確かめるためのもの）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handles = {}
+        self._counter = 0
+
+    def supports(self, model_name):
+        return True
+
+    def create(self, model_name, system_instruction, context_text, ttl_seconds):
+        with self._lock:
+            self._counter += 1
+            handle = _LocalHandle(f"local-context-{self._counter}", system_instruction, context_text)
+            self._handles[handle.name] = handle
+            return handle
+
+    def model_for(self, handle, base_model):
+        if handle.name not in self._handles:
+            raise LookupError(f"Cached context {handle.name} not found")
+        return _LocalCachedModel(handle, base_model)
+
+    def delete(self, handle):
+        with self._lock:
+            self._handles.pop(handle.name, None)
+
+    def __len__(self):
+        return len(self._handles)
+
+
+class _Entry:
+    def __init__(self):
+        self.ready = threading.Event()
+        self.handle = None
+        self.expires_at = 0.0
+        self.sessions = set()
+
+
+class ContextCache:
+    def __init__(self, backend, ttl_seconds=DEFAULT_TTL_SECONDS, min_tokens=DEFAULT_MIN_TOKENS):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        self._lock = threading.Lock()
+        self._entries = {} # キー → _Entry
+        self._sessions = {} # セッションID → OrderedDict(内容のキー → {モデルごとのキー, ...})（使われた順）
+        self.stats = {"created": 0, "reused": 0, "deleted": 0, "failed": 0}
+
+    def accepts(self, system_instruction, context_text):
+        # 登録できる長さか（短いものはプロンプトに直接含めたほうが、ステップごとに必要な部分だけを送れる）
+        # 出力分の予約は含めず、コンテキストそのものの長さで判断する
+        return estimate_input_tokens(system_instruction + context_text) >= self.min_tokens
+
+    def acquire(self, model_name, system_instruction, context_text, session_id):
+        """コンテキストを登録（登録済みなら再利用）し、参照用のハンドルを返す
+
+        登録に失敗した場合や、モデルがキャッシュに対応していない場合は None を返す（呼び出し側はプロンプトに直接含める）。
+        """
+        if not self.backend.supports(model_name):
+            return None
+        key = make_context_key(model_name, system_instruction, context_text)
+        content_key = make_content_key(system_instruction, context_text)
+        stale = []
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.ready.is_set() and time.time() >= entry.expires_at:
+                # 期限切れ（または失敗後の待機期間が終わった）ので作り直す
+                stale.append(self._drop(key))
+                entry = None
+            creator = entry is None
+            if creator:
+                entry = _Entry()
+                self._entries[key] = entry
+            stale += self._touch(session_id, content_key, key, entry)
+        self._delete(stale)
+
+        if creator:
+            try:
+                entry.handle = self.backend.create(model_name, system_instruction, context_text, self.ttl_seconds)
+                entry.expires_at = time.time() + self.ttl_seconds - EXPIRY_MARGIN_SECONDS
+                self.stats["created"] += 1
+                with self._lock:
+                    orphaned = self._entries.get(key) is not entry
+                if orphaned:
+                    # 登録中に手放された（ドラフトが作り直されたなど）。今回の呼び出しには使い、すぐに削除する
+                    self._delete([entry.handle])
+            except Exception as e:
+                logger.warning("Could not create cached context: %s", e)
+                entry.expires_at = time.time() + FAILURE_BACKOFF_SECONDS
+                self.stats["failed"] += 1
+            finally:
+                entry.ready.set()
+        else:
+            # 同じ内容を登録中の別の呼び出しがあれば、その完了を待つ
+            entry.ready.wait()
+            if entry.handle is not None:
+                self.stats["reused"] += 1
+        return entry.handle
+
+    def model_for(self, handle, base_model):
+        return self.backend.model_for(handle, base_model)
+
+    def discard(self, handle):
+        # 参照に失敗した（モデル側で削除済みなど）コンテキストを捨て、次回作り直す
+        with self._lock:
+            stale = [self._drop(key) for key, entry in list(self._entries.items()) if entry.handle is handle]
+        self._delete(stale)
+
+    def release(self, session_id):
+        """セッションが使っていたコンテキストを手放す（他のセッションが使っていなければ削除する）"""
+        with self._lock:
+            used = self._sessions.pop(session_id, {})
+            stale = [self._leave(session_id, key) for keys in used.values() for key in keys]
+        self._delete(stale)
+
+    # 以下の _touch / _leave / _drop はロックを取った状態で呼び、削除すべきハンドルを返す
+    # （削除はAPI呼び出しになるので、ロックを外してから _delete で行う）
+    def _touch(self, session_id, content_key, key, entry):
+        # セッションの直近のコンテキストとして記録し、古いもの（Lean Canvas単位）を手放す
+        used = self._sessions.setdefault(session_id, OrderedDict())
+        used.setdefault(content_key, set()).add(key)
+        used.move_to_end(content_key)
+        entry.sessions.add(session_id)
+        stale = []
+        while len(used) > CONTEXTS_PER_SESSION:
+            _, old_keys = used.popitem(last=False)
+            stale += [self._leave(session_id, old_key) for old_key in old_keys]
+        return stale
+
+    def _leave(self, session_id, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        entry.sessions.discard(session_id)
+        return self._drop(key) if not entry.sessions else None
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        return entry.handle if entry is not None else None
+
+    def _delete(self, handles):
+        for handle in handles:
+            if handle is None:
+                continue
+            try:
+                self.backend.delete(handle)
+                self.stats["deleted"] += 1
+            except Exception as e:
+                # 期限切れで既に消えている場合など。モデル側のTTLで最終的には削除される
+                logger.debug("Could not delete cached context: %s", e)
+
+
+def build_context_cache(backend_name=DEFAULT_BACKEND):
+    # 設定に応じたキャッシュを返す（"off" なら None）
+    if backend_name == "off":
+        return None
+    if backend_name == "local":
+        return ContextCache(LocalContextBackend(), min_tokens=0)
+    if backend_name == "gemini":
+        return ContextCache(GeminiContextBackend())
+    raise ValueError(f"Unknown context cache backend: {backend_name}")
@@ -0,0 +1,238 @@
+# --- Lean Canvas 生成パイプライン ---
+# 入力フォームの内容 → ドラフト → VCフィードバック → 改訂 → 追加分析 という流れを、
+# Streamlitに依存しない関数としてまとめたもの。画面（app.py）とバッチ処理（batch.py）の両方から使う。
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+from prompts import (
+    QUESTIONS, REQUIRED_KEYS,
+    build_input_summary, build_canvas_prompt, build_feedback_prompt, build_shared_context,
+    build_revision_prompt, build_section_revision_prompt, build_analysis_prompt,
+)
+from canvas_sections import (
+    CANVAS_SECTIONS, MIN_SECTIONS_FOR_COMPACTION, parse_canvas,
+    map_feedback_to_sections, unmapped_feedback_points, extract_section_body, merge_sections,
+)
+
+# セクション単位の改訂で同時に生成するセクション数の上限
+MAX_SECTION_WORKERS = 4
+# 指摘がこの割合以上のセクションに及ぶ場合は、全体を再生成したほうが整合性を保ちやすい
+SECTION_REVISION_MAX_RATIO = 0.6
+# セクションの完了を待つ間にキャンセルを確認する間隔
+CANCEL_CHECK_INTERVAL_SECONDS = 0.2
+
+
+def missing_required_inputs(user_inputs):
+    return [key for key in REQUIRED_KEYS if not user_inputs.get(key)]
+
+
+def canvas_context(client, canvas_text):
+    """コンテキストキャッシュに登録する共有コンテキスト (前置き, Lean Canvas) を返す
+
+    キャッシュが無効な場合や、短すぎて登録できない場合は None（各ステップのプロンプトにLean Canvasを直接含める）。
+    """
+    context_cache = getattr(client, "context_cache", None)
+    if context_cache is None:
+        return None
+    context = build_shared_context(canvas_text)
+    return context if context_cache.accepts(*context) else None
+
+
+# 以下の *_request は各ステップの (プロンプト, 共有コンテキスト) を返す。
+# 画面側はこれをジョブとして投入し、バッチ側は generate_* で直接呼び出す
+def draft_prompt(user_inputs):
+    return build_canvas_prompt(build_input_summary(user_inputs))
+
+
+def feedback_request(client, canvas_text):
+    context = canvas_context(client, canvas_text)
+    return build_feedback_prompt(canvas_text, shared_context=context is not None), context
+
+
+def revision_request(client, canvas_text, feedback_text):
+    context = canvas_context(client, canvas_text)
+    return build_revision_prompt(canvas_text, feedback_text, shared_context=context is not None), context
+
+
+def analysis_request(client, option, canvas_text):
+    # 対応するプロンプトがなければプロンプトは空文字
+    context = canvas_context(client, canvas_text)
+    return build_analysis_prompt(option, canvas_text, shared_context=context is not None), context
+
+
+def generate_draft(client, user_inputs, **generate_kwargs):
+    return client.generate(draft_prompt(user_inputs), step="canvas_draft", **generate_kwargs)[0]
+
+
+def generate_feedback(client, canvas_text, **generate_kwargs):
+    prompt, context = feedback_request(client, canvas_text)
+    return client.generate(prompt, step="feedback", context=context, **generate_kwargs)[0]
+
+
+def plan_section_revision(canvas_text, feedback_text):
+    """セクション単位で改訂できるか判断する
+
+    戻り値は (指摘の割り当て {セクション名: [指摘, ...]}, どのセクションにも当てはまらない指摘, 利用者へのお知らせ)。
+    全体を再生成すべき場合は割り当てが空になり、お知らせにその理由が入る。
+    当てはまらない指摘は捨てずに、各セクションの改訂で全体に関する指摘として参照させる。
+    """
+    if len(parse_canvas(canvas_text)) < MIN_SECTIONS_FOR_COMPACTION:
+        return {}, [], "ドラフトをセクションに分割できなかったため、全体を再生成します。"
+    feedback_points = map_feedback_to_sections(feedback_text)
+    if not feedback_points or len(feedback_points) >= len(CANVAS_SECTIONS) * SECTION_REVISION_MAX_RATIO:
+        return {}, [], "指摘が多くのセクションに及ぶ（または特定できない）ため、全体を再生成します。"
+    general_points = unmapped_feedback_points(feedback_text)
+    if general_points:
+        return feedback_points, general_points, (
+            f"特定のセクションに割り当てられなかった指摘が {len(general_points)} 件あります。"
+            "改訂する各セクションに全体への指摘として渡しますが、すべてを確実に反映するには「全体を再生成する」を選んでください。"
+        )
+    return feedback_points, [], None
+
+
+def revise_sections(client, canvas_text, feedback_points, on_progress=None, check_cancelled=None,
+                    general_points=(), **generate_kwargs):
+    """指摘のあったセクションだけを並列に再生成し、元のドラフトに差し込んだテキストを返す
+
+    general_points（どのセクションにも当てはまらない指摘）は各セクションのプロンプトに添える。
+    on_progress(途中までの改訂版) はセクションが1つ完了するたびに呼ばれる。
+    check_cancelled() は区切りごとに呼ばれ、例外を投げると中断できる。
+    """
+    context = canvas_context(client, canvas_text)
+    prompts_by_section = {
+        name: build_section_revision_prompt(
+            canvas_text, name, points, shared_context=context is not None, general_points=general_points,
+        )
+        for name, points in feedback_points.items()
+    }
+    updates = {}
+
+    def generate_section(prompt):
+        # 順番待ちの間にキャンセルされたセクションは呼び出さない
+        if check_cancelled is not None:
+            check_cancelled()
+        return client.generate(prompt, step="revised_canvas_section", context=context, **generate_kwargs)
+
+    executor = ThreadPoolExecutor(max_workers=min(MAX_SECTION_WORKERS, len(prompts_by_section)))
+    try:
+        futures = {
+            executor.submit(generate_section, prompt): name
+            for name, prompt in prompts_by_section.items()
+        }
+        pending = set(futures)
+        while pending:
+            # 完了を待つ間も定期的にキャンセルを確認する
+            done, pending = wait(pending, timeout=CANCEL_CHECK_INTERVAL_SECONDS, return_when=FIRST_COMPLETED)
+            if check_cancelled is not None:
+                check_cancelled()
+            for future in done:
+                name = futures[future]
+                updates[name] = extract_section_body(future.result()[0], name)
+            if done and on_progress is not None:
+                # 完了したセクションから順に差し込んで途中経過として渡す
+                on_progress(merge_sections(canvas_text, updates))
+    except BaseException:
+        # キャンセル・失敗時は開始前のセクションを取り消し、実行中のものの完了も待たない
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+    return merge_sections(canvas_text, updates)
+
+
+def generate_revision(client, canvas_text, feedback_text, incremental=True, **generate_kwargs):
+    if incremental:
+        feedback_points, general_points, _notice = plan_section_revision(canvas_text, feedback_text)
+        if feedback_points:
+            return revise_sections(client, canvas_text, feedback_points, general_points=general_points,
+                                   **generate_kwargs)
+    prompt, context = revision_request(client, canvas_text, feedback_text)
+    return client.generate(prompt, step="revised_canvas", context=context, **generate_kwargs)[0]
+
+
+def generate_analysis(client, option, canvas_text, **generate_kwargs):
+    prompt, context = analysis_request(client, option, canvas_text)
+    if not prompt:
+        raise ValueError(f"{option} に対応するプロンプトが定義されていません。")
+    return client.generate(prompt, step=f"analysis_{option}", context=context, **generate_kwargs)[0]
+
+
+class Checkpoint:
+    """1件のアイデアについて、完了したステージの結果をJSONファイルに保存する（中断後の再開用）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.data = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.data = json.load(f)
+
+    def get(self, stage):
+        return self.data.get(stage)
+
+    def save(self, stage, value):
+        with self._lock:
+            self.data[stage] = value
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+def run_idea(client, user_inputs, frameworks=(), checkpoint=None, incremental_revision=True,
+             **generate_kwargs):
+    """1件のアイデアを ドラフト → フィードバック → 改訂 → 分析 の順に処理し、結果の dict を返す
+
+    checkpoint を渡すと、完了済みのステージはAPIを呼ばずに保存済みの結果を使う。
+    分析はフレームワークごとに並列で実行し、失敗はフレームワークごとに errors に記録する。
+    """
+    results = {"user_inputs": dict(user_inputs), "errors": {}}
+
+    def stage(name, run):
+        saved = checkpoint.get(name) if checkpoint is not None else None
+        if saved is not None:
+            return saved
+        value = run()
+        if checkpoint is not None:
+            checkpoint.save(name, value)
+        return value
+
+    results["canvas_draft"] = stage("canvas_draft", lambda: generate_draft(client, user_inputs, **generate_kwargs))
+    results["feedback"] = stage("feedback", lambda: generate_feedback(client, results["canvas_draft"], **generate_kwargs))
+    results["revised_canvas"] = stage("revised_canvas", lambda: generate_revision(
+        client, results["canvas_draft"], results["feedback"], incremental=incremental_revision, **generate_kwargs
+    ))
+
+    if frameworks:
+        with ThreadPoolExecutor(max_workers=len(frameworks)) as executor:
+            futures = {
+                executor.submit(stage, f"analysis_{option}", lambda option=option: generate_analysis(
+                    client, option, results["revised_canvas"], **generate_kwargs
+                )): option
+                for option in frameworks
+            }
+            for future in as_completed(futures):
+                option = futures[future]
+                try:
+                    results[f"analysis_{option}"] = future.result()
+                except Exception as e:
+                    results["errors"][f"analysis_{option}"] = f"{type(e).__name__}: {e}"
+    return results
+
+
+def render_markdown(idea_id, results, frameworks=()):
+    # 1件分の結果をMarkdownの報告書にまとめる
+    parts = [f"# {idea_id}", "", "## 入力"]
+    for key in QUESTIONS:
+        parts.append(f"- {key}: {results['user_inputs'].get(key) or '(未入力)'}")
+    for title, key in (("Lean Canvas ドラフト", "canvas_draft"), ("VCフィードバック", "feedback"),
+                       ("改訂版 Lean Canvas", "revised_canvas")):
+        parts += ["", f"## {title}", "", results.get(key, "")]
+    for option in frameworks:
+        key = f"analysis_{option}"
+        body = results.get(key) or f"（エラー: {results['errors'].get(key, '未実行')}）"
+        parts += ["", f"## {option}", "", body]
+    return "\n".join(parts) + "\n"
+
@@ -0,0 +1,348 @@
+# --- Geminiクライアント ---
+# モデルハンドル・安全設定・応答キャッシュをサーバープロセス全体で1つだけ作り、全セッションで共有する。
+# google.generativeai の import とモデル生成は重いため、最初に実際のAPI呼び出しが必要になるまで遅延させる
+# （キャッシュヒットだけで済む間は import すら行わない）。
+import logging
+import threading
+import time
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+from response_cache import ResponseCache, DEFAULT_CACHE_DIR, make_cache_key
+from rate_limiter import (
+    QuotaScheduler, PRIORITY_INTERACTIVE, DEFAULT_EMBEDDING_REQUESTS_PER_MINUTE, estimate_tokens, estimate_input_tokens,
+)
+from telemetry import Telemetry
+from context_cache import build_context_cache, inline_prompt, is_stale_context_error
+from model_router import ModelRouter, should_fall_back, DEFAULT_FAST_MODEL
+
+DEFAULT_MODEL_NAME = DEFAULT_FAST_MODEL
+
+# API呼び出し時に共通して使用する安全設定（カテゴリ名 → しきい値名）
+# Enumへの変換は import を遅延させるため build_safety_settings() で行う
+SAFETY_SETTINGS_SPEC = {
+    "HARM_CATEGORY_HARASSMENT": "BLOCK_MEDIUM_AND_ABOVE",
+    "HARM_CATEGORY_HATE_SPEECH": "BLOCK_MEDIUM_AND_ABOVE",
+    "HARM_CATEGORY_SEXUALLY_EXPLICIT": "BLOCK_MEDIUM_AND_ABOVE",
+    "HARM_CATEGORY_DANGEROUS_CONTENT": "BLOCK_MEDIUM_AND_ABOVE",
+}
+
+logger = logging.getLogger(__name__)
+
+
+class PartialGenerationError(Exception):
+    # ストリーミング途中でエラーになった場合に、それまでに受信したテキストを保持する
+    def __init__(self, partial_text, cause):
+        super().__init__(str(cause))
+        self.partial_text = partial_text
+
+
+class _HedgeLost(Exception):
+    # 並行して送ったもう一方のリクエストが先に応答したので、こちらは打ち切る
+    pass
+
+
+def _start_thread(fn, *args):
+    # fn(*args) を別スレッドで実行し、結果を Future で返す
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="gemini-hedge", daemon=True).start()
+    return future
+
+
+def build_safety_settings():
+    from google.generativeai.types import HarmCategory, HarmBlockThreshold
+    return {
+        HarmCategory[category]: HarmBlockThreshold[threshold]
+        for category, threshold in SAFETY_SETTINGS_SPEC.items()
+    }
+
+
+class GeminiClient:
+    def __init__(self, api_key, model_name=DEFAULT_MODEL_NAME, cache=None, scheduler=None, telemetry=None,
+                 context_cache=None, router=None, embedding_scheduler=None):
+        self.api_key = api_key
+        self.model_name = model_name # ルートが設定されていないステップと、トークン数の計算に使う
+        self.cache = cache if cache is not None else ResponseCache(DEFAULT_CACHE_DIR)
+        # 全セッションのAPI呼び出しはこのスケジューラを通る（レート制限・公平な順番待ち・再試行）
+        self.scheduler = scheduler if scheduler is not None else QuotaScheduler()
+        # 埋め込みは別のクォータなので、生成の順番待ちとは分ける（ドラフトが自分の類似検索の後ろに並ばないように）
+        self.embedding_scheduler = (
+            embedding_scheduler if embedding_scheduler is not None
+            else QuotaScheduler(requests_per_minute=DEFAULT_EMBEDDING_REQUESTS_PER_MINUTE)
+        )
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        # 後続ステップで共通のLean Canvasをモデル側に登録して使い回す（無効なら None）
+        self.context_cache = context_cache if context_cache is not None else build_context_cache()
+        # ステップごとのモデルの選択・ヘッジ・フォールバック
+        self.router = router if router is not None else ModelRouter()
+        self._init_lock = threading.Lock()
+        self._models = {}
+        self._safety_settings = None
+
+    def _ensure_model(self, model_name=None):
+        # 初回のみ genai を import してモデルを生成する（複数スレッドから呼ばれても1回だけ）
+        model_name = model_name or self.model_name
+        model = self._models.get(model_name)
+        if model is None:
+            with self._init_lock:
+                model = self._models.get(model_name)
+                if model is None:
+                    started = time.perf_counter()
+                    import google.generativeai as genai
+                    if self._safety_settings is None:
+                        genai.configure(api_key=self.api_key)
+                        self._safety_settings = build_safety_settings()
+                    model = genai.GenerativeModel(model_name)
+                    self._models[model_name] = model
+                    logger.info("Gemini model %s initialized in %.0f ms",
+                                model_name, (time.perf_counter() - started) * 1000)
+        return model
+
+    def count_tokens(self, text):
+        # プロンプトの入力トークン数を数える（生成は行わない）
+        return self._ensure_model().count_tokens(text).total_tokens
+
+    def _call_model(self, prompt, on_text, model):
+        # 1回分のAPI呼び出し。(テキスト, 応答オブジェクト) を返す
+        if on_text is None:
+            response = model.generate_content(prompt, safety_settings=self._safety_settings)
+            try:
+                return response.text, response # ブロックされた場合はここで例外となり、キャッシュされない
+            except Exception as e:
+                e.response = response # テレメトリでブロック理由を記録するため
+                raise
+
+        text = ""
+        response = None
+        try:
+            response = model.generate_content(prompt, safety_settings=self._safety_settings, stream=True)
+            for chunk in response:
+                text += chunk.text
+                on_text(text)
+        except Exception as e:
+            error = PartialGenerationError(text, e)
+            error.response = response
+            raise error from e
+        return text, response
+
+    def _attempt(self, model_name, prompt, context, session_id, on_text):
+        # 指定したモデルで1回呼び出す。共有コンテキストは登録済みのものを参照し、登録できなければプロンプトに直接含める
+        if context is None:
+            return self._call_model(prompt, on_text, self._ensure_model(model_name))
+        system_instruction, context_text = context
+        handle = None
+        if self.context_cache is not None:
+            handle = self.context_cache.acquire(model_name, system_instruction, context_text, session_id)
+        if handle is None:
+            return self._call_model(inline_prompt(system_instruction, context_text, prompt), on_text,
+                                    self._ensure_model(model_name))
+        try:
+            model = self.context_cache.model_for(handle, self._ensure_model(model_name))
+            return self._call_model(prompt, on_text, model)
+        except Exception as e:
+            if is_stale_context_error(e.__cause__ or e):
+                # 期限切れなどで参照できなかったので、次回は登録し直す
+                self.context_cache.discard(handle)
+            raise
+
+    def _race(self, model_name, call, on_text, try_acquire_hedge):
+        """call(on_text) を実行し、直近の p95 を過ぎても応答がなければ同じリクエストをもう1つ送る
+
+        先に応答した（ストリーミングなら最初のトークンが届いた）方の結果を使い、もう一方は打ち切る。
+        戻り値は (結果, ヘッジしたか)
+        """
+        streaming = on_text is not None
+        hedge_after = self.router.hedge_after(model_name, streaming)
+        lock = threading.Lock()
+        state = {"winner": None, "responded_at": None}
+        started = time.perf_counter()
+
+        def claim(index):
+            with lock:
+                if state["winner"] is None:
+                    state["winner"] = index
+                    state["responded_at"] = time.perf_counter()
+                return state["winner"] == index
+
+        def attempt(index):
+            def on_text_claimed(text):
+                if not claim(index):
+                    raise _HedgeLost()
+                on_text(text)
+            result = call(on_text_claimed if streaming else None)
+            if not claim(index):
+                raise _HedgeLost()
+            return result
+
+        hedged = False
+        if hedge_after is None:
+            result = attempt(0)
+        else:
+            futures = {_start_thread(attempt, 0): 0}
+            done, _ = wait(futures, timeout=hedge_after)
+            # ストリーミングは最初のトークンが届いていれば応答済み（ストリーム全体の完了は待たない）
+            with lock:
+                hedge = not done and state["winner"] is None and try_acquire_hedge()
+            if hedge:
+                logger.info("%s did not respond within %.1fs; sending a hedged request", model_name, hedge_after)
+                futures[_start_thread(attempt, 1)] = 1
+                hedged = True
+            result = self._first_result(futures, state)
+
+        # ヘッジした場合も先に応答した時点までの時間を記録する（遅かった方は少なくともこれだけかかった）
+        self.router.record(model_name, state["responded_at"] - started, streaming)
+        return result, hedged
+
+    @staticmethod
+    def _first_result(futures, state):
+        # 先に応答した方の結果を返す。応答前に失敗した方は無視し、両方失敗したらエラーを投げる
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as e:
+                    if isinstance(e.__cause__ or e, _HedgeLost):
+                        continue
+                    if state["winner"] == futures[future]:
+                        raise # ストリーミングの途中で失敗した
+                    error = e
+        raise error
+
+    def _call_routed(self, route, prompt, context, session_id, priority, tokens, on_text, on_wait, recorder):
+        # ルートのモデルを順に試す（最初のモデルの分のクォータは呼び出し元のスケジューラで確保済み）
+        for index, model_name in enumerate(route):
+            if index > 0:
+                self.scheduler.acquire(session_id, priority, tokens, on_wait=on_wait)
+                recorder.fallback()
+            try:
+                result, hedged = self._race(
+                    model_name,
+                    lambda callback: self._attempt(model_name, prompt, context, session_id, callback),
+                    on_text,
+                    lambda: self.scheduler.try_acquire(session_id, tokens),
+                )
+            except Exception as e:
+                cause = e.__cause__ or e
+                if index == len(route) - 1 or not should_fall_back(cause):
+                    raise
+                logger.warning("%s failed, falling back to %s: %s", model_name, route[index + 1], cause)
+                continue
+            recorder.model_name = model_name
+            if hedged:
+                recorder.hedge()
+            return result
+
+    def generate(self, prompt, on_text=None, session_id=None, priority=PRIORITY_INTERACTIVE,
+                 on_wait=None, on_retry=None, step=None, context=None, refresh=False):
+        """キャッシュ経由でGeminiを呼び出し、(テキスト, 応答オブジェクト) を返す
+
+        on_text を渡すとストリーミングで呼び出し、受信済みのテキスト全体を引数に逐次呼び出す。
+        API呼び出しはスケジューラで順番待ちとなり、on_wait(順番) / on_retry(回数, 待ち秒数, エラー) で状況を通知する。
+        step（"feedback" など）はテレメトリの集計単位で、使うモデルもこれで決まる（ModelRouter）。
+        context（(共通の前置き, Lean Canvas)）を渡すと、それをプロンプトの前に置く共有コンテキストとして扱い、
+        コンテキストキャッシュが有効なら登録済みのものを参照する。
+        refresh なら保存済みの応答を使わずにAPIを呼び出し、キャッシュを新しい応答で置き換える（再生成用）。
+        キャッシュヒット時や、同じプロンプトを処理中の別の呼び出しの結果を共有した場合、応答オブジェクトは None
+        """
+        route = self.router.models_for(step) or [self.model_name]
+        session_id = session_id or "default"
+        full_prompt = inline_prompt(*context, prompt) if context is not None else prompt
+        # 応答はステップで優先するモデルのものとしてキャッシュする（フォールバック先のモデルの応答は保存しない）
+        cache_key = make_cache_key(route[0], full_prompt, SAFETY_SETTINGS_SPEC)
+        raw_response = {}
+        recorder = self.telemetry.start_call(step, route[0], session_id)
+        # 呼び出し元のコールバックが投げたエラー（ジョブのキャンセルなど）。同じプロンプトを待つ他の呼び出しには共有しない
+        caller_errors = []
+
+        def caller_callback(callback):
+            if callback is None:
+                return None
+
+            def wrapped(*args):
+                try:
+                    return callback(*args)
+                except Exception as e:
+                    caller_errors.append(e)
+                    raise
+            return wrapped
+
+        on_text = caller_callback(on_text)
+        on_wait = caller_callback(on_wait)
+        on_retry = caller_callback(on_retry)
+
+        def on_text_recorded(text):
+            recorder.first_token()
+            on_text(text)
+
+        def on_retry_recorded(attempt, delay, error):
+            recorder.retry()
+            if on_retry is not None:
+                on_retry(attempt, delay, error)
+
+        def call_api():
+            estimated_tokens = estimate_tokens(full_prompt)
+            stream_callback = on_text_recorded if on_text is not None else None
+            text, response = self.scheduler.run(
+                lambda: self._call_routed(
+                    route, prompt, context, session_id, priority, estimated_tokens,
+                    stream_callback, on_wait, recorder,
+                ),
+                session_id, priority, estimated_tokens,
+                on_wait=on_wait, on_retry=on_retry_recorded,
+            )
+            raw_response["response"] = response
+            # 実際の使用トークン数が分かればバケットを補正する
+            usage = getattr(response, "usage_metadata", None)
+            total_tokens = getattr(usage, "total_token_count", None)
+            if total_tokens:
+                self.scheduler.reconcile(estimated_tokens, total_tokens)
+            return text
+
+        try:
+            text, cache_hit = self.cache.get_or_compute(
+                cache_key, call_api, is_private_error=lambda error: bool(caller_errors),
+                should_store=lambda text: recorder.model_name == route[0], refresh=refresh,
+            )
+        except Exception as e:
+            recorder.finish(getattr(e, "response", None), error=e)
+            raise
+        recorder.finish(raw_response.get("response"), cache_hit=cache_hit)
+        return text, raw_response.get("response")
+
+    def embed(self, text, model_name, session_id=None, priority=PRIORITY_INTERACTIVE, on_wait=None, on_retry=None,
+              task_type="SEMANTIC_SIMILARITY"):
+        """埋め込みベクトル（floatのリスト）を返す
+
+        埋め込み用のスケジューラで順番待ちし（on_wait / on_retry は生成と同じ）、ステップ "embedding" としてテレメトリに記録する。
+        """
+        session_id = session_id or "default"
+        recorder = self.telemetry.start_call("embedding", model_name, session_id)
+
+        def on_retry_recorded(attempt, delay, error):
+            recorder.retry()
+            if on_retry is not None:
+                on_retry(attempt, delay, error)
+
+        def call_api():
+            self._ensure_model() # genai の import と APIキーの設定（初回のみ）
+            import google.generativeai as genai
+            return genai.embed_content(model=model_name, content=text, task_type=task_type)["embedding"]
+
+        try:
+            embedding = self.embedding_scheduler.run(
+                call_api, session_id, priority, estimate_input_tokens(text), on_wait=on_wait, on_retry=on_retry_recorded,
+            )
+        except Exception as e:
+            recorder.finish(error=e)
+            raise
+        recorder.finish()
+        return embedding
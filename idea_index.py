@@ -0,0 +1,176 @@
+# --- 類似アイデアの検索 ---
+# 過去に入力されたアイデア（user_inputs）と、そのとき生成されたドラフトを埋め込みベクトルで索引し、
+# 新しい入力が過去のものとほぼ同じなら、そのドラフトをすぐに提示したり、差分だけを直す短いプロンプトの下書きに使ったりする。
+# 完全一致しか拾えない応答キャッシュと違い、言い回しを少し変えただけの入力も見つけられる。
+# - ベクトルは NumPy 配列として、エントリはJSONとしてディスクに保存する
+# - 埋め込みは Gemini の埋め込みモデルと、オフラインで試せるローカル版（文字n-gramのハッシュ）の2つ
+# - 索引はプロセス全体で1つだが、検索で見つかるのは同じセッション（ユーザー）のエントリだけ（共有する設定にしない限り）
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_INDEX_DIR = os.getenv(
+    "LEAN_CANVAS_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".index", "ideas"),
+)
+# "gemini"（既定）/ "local"（オフライン検証用）/ "off"
+DEFAULT_EMBEDDER = os.getenv("LEAN_CANVAS_EMBEDDINGS", "gemini")
+DEFAULT_THRESHOLD = float(os.getenv("LEAN_CANVAS_SIMILARITY_THRESHOLD", "0.9"))
+# 他のユーザーが過去に入力したアイデアとドラフトも検索の対象にするか（既定では自分のものだけ）
+DEFAULT_SHARED = os.getenv("LEAN_CANVAS_SHARE_SIMILAR_IDEAS", "") not in ("", "0", "false")
+DEFAULT_MAX_ENTRIES = 2000
+GEMINI_EMBEDDING_MODEL = "models/text-embedding-004"
+LOCAL_EMBEDDING_DIM = 512
+
+logger = logging.getLogger(__name__)
+
+
+def idea_text(user_inputs):
+    # 埋め込みに使うテキスト（項目名と内容を1行ずつ。未入力の項目は除く）
+    return "\n".join(f"{key}: {value}" for key, value in user_inputs.items() if value)
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class GeminiEmbedder:
+    """Gemini の埋め込みモデルを使う（生成と同じく GeminiClient のスケジューラとテレメトリを通る）"""
+
+    name = GEMINI_EMBEDDING_MODEL
+
+    def __init__(self, client):
+        self.client = client
+
+    def embed(self, text, **call_kwargs):
+        # call_kwargs（session_id・priority・on_wait など）はそのまま GeminiClient.embed() に渡す
+        embedding = self.client.embed(text, self.name, **call_kwargs)
+        return _normalize(np.asarray(embedding, dtype=np.float32))
+
+
+class LocalEmbedder:
+    """文字の2-gram・3-gramをハッシュして数えるだけの埋め込み（APIなしで索引と検索の流れを確かめるためのもの）"""
+
+    name = "local-char-ngram"
+
+    def __init__(self, dim=LOCAL_EMBEDDING_DIM):
+        self.dim = dim
+
+    def embed(self, text, **call_kwargs):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for n in (2, 3):
+            for i in range(len(text) - n + 1):
+                digest = hashlib.blake2b(text[i:i + n].encode("utf-8"), digest_size=4).digest()
+                vector[int.from_bytes(digest, "little") % self.dim] += 1.0
+        return _normalize(vector)
+
+
+class IdeaIndex:
+    def __init__(self, embedder, index_dir=DEFAULT_INDEX_DIR, threshold=DEFAULT_THRESHOLD,
+                 max_entries=DEFAULT_MAX_ENTRIES, shared=DEFAULT_SHARED):
+        self.embedder = embedder
+        self.index_dir = index_dir
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._vectors = None # (エントリ数, 次元) の float32 配列（正規化済み）
+        self._entries = []
+        os.makedirs(index_dir, exist_ok=True)
+        self._load()
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.index_dir, "vectors.npy")
+
+    @property
+    def _entries_path(self):
+        return os.path.join(self.index_dir, "entries.json")
+
+    def _load(self):
+        try:
+            with open(self._entries_path, encoding="utf-8") as f:
+                data = json.load(f)
+            vectors = np.load(self._vectors_path)
+        except (OSError, ValueError):
+            return
+        # 埋め込みの方式が変わっていたら使えないので、作り直す
+        if data.get("embedder") != self.embedder.name or len(data["entries"]) != len(vectors):
+            logger.info("Discarding idea index built with %s", data.get("embedder"))
+            return
+        self._entries = data["entries"]
+        self._vectors = vectors
+
+    def _save(self):
+        # ロックを取った状態で呼ぶ。書き込み途中のファイルを読まれないよう、一時ファイル経由で置き換える
+        tmp_vectors = f"{self._vectors_path}.tmp"
+        with open(tmp_vectors, "wb") as f:
+            np.save(f, self._vectors)
+        tmp_entries = f"{self._entries_path}.tmp"
+        with open(tmp_entries, "w", encoding="utf-8") as f:
+            json.dump({"embedder": self.embedder.name, "entries": self._entries}, f, ensure_ascii=False)
+        os.replace(tmp_vectors, self._vectors_path)
+        os.replace(tmp_entries, self._entries_path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, user_inputs, canvas_draft, owner=None, **call_kwargs):
+        """入力と生成されたドラフトを索引に加える（上限を超えたら古いものから捨てる）
+
+        owner は入力したユーザーのセッショントークン。call_kwargs は埋め込みの計算に渡す。
+        """
+        vector = self.embedder.embed(idea_text(user_inputs), **call_kwargs)
+        entry = {"user_inputs": dict(user_inputs), "canvas_draft": canvas_draft, "owner": owner,
+                 "created_at": time.time()}
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = vector[np.newaxis, :]
+            else:
+                self._vectors = np.vstack([self._vectors, vector])
+            self._entries.append(entry)
+            if len(self._entries) > self.max_entries:
+                self._vectors = self._vectors[-self.max_entries:]
+                self._entries = self._entries[-self.max_entries:]
+            self._save()
+
+    def find_similar(self, user_inputs, owner=None, **call_kwargs):
+        """最も似ている過去のエントリを (類似度, エントリ) で返す（しきい値未満なら None）
+
+        共有する設定でなければ、owner（セッショントークン）が同じエントリだけを対象にする。
+        対象のエントリがなければ埋め込みを計算しない。call_kwargs は埋め込みの計算に渡す。
+        """
+        with self._lock:
+            vectors, entries = self._vectors, self._entries
+        if vectors is None or not entries:
+            return None
+        candidates = [
+            i for i, entry in enumerate(entries)
+            if self.shared or (owner is not None and entry.get("owner") == owner)
+        ]
+        if not candidates:
+            return None
+        query = self.embedder.embed(idea_text(user_inputs), **call_kwargs)
+        scores = vectors[candidates] @ query # 正規化済みなので内積がコサイン類似度
+        best = int(np.argmax(scores))
+        score = float(scores[best])
+        if score < self.threshold:
+            return None
+        return score, entries[candidates[best]]
+
+
+def build_idea_index(client, embedder_name=DEFAULT_EMBEDDER):
+    # 設定に応じた索引を返す（"off" なら None）。Gemini の埋め込みは client（GeminiClient）を通して呼び出す
+    if embedder_name == "off":
+        return None
+    if embedder_name == "local":
+        return IdeaIndex(LocalEmbedder())
+    if embedder_name == "gemini":
+        return IdeaIndex(GeminiEmbedder(client))
+    raise ValueError(f"Unknown embedder: {embedder_name}")
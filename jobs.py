@@ -0,0 +1,132 @@
+# --- バックグラウンド生成ジョブ ---
+# 生成処理をスクリプトスレッドから切り離し、ジョブIDで管理する。
+# - 結果はジョブに保持されるため、Streamlitの再実行をまたいでも失われない
+# - 画面側はジョブIDを Session State に保存し、再実行のたびに状態を確認する
+# - 不要になったジョブはキャンセルできる（開始前なら実行せず、ストリーミング中なら受信を打ち切る）
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# ジョブのほとんどの時間は QuotaScheduler の順番待ちなので、同時実行数はスケジューラで制限し、ここは十分に大きくする。
+# 小さいとクォータ待ちのジョブがスレッドを占有し、後から来た優先度の高いジョブがスケジューラの順番待ちにすら入れない
+# （スレッドは必要になった分だけ作られる）
+DEFAULT_MAX_WORKERS = int(os.getenv("LEAN_CANVAS_JOB_WORKERS", "256"))
+# 回収されないまま残った終了済みジョブを保持する時間（セッションが閉じられた場合など）
+FINISHED_JOB_TTL_SECONDS = 60 * 60
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id, label):
+        self.job_id = job_id
+        self.label = label
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        self.partial_text = "" # ストリーミング中に受信済みのテキスト
+        self.queue_position = None # API呼び出しの順番待ちでの位置（0はリトライ待ち）
+        self.retry_count = 0
+        self.info = {} # 付加情報（プロンプトのトークン数など）
+        self.created_at = time.time()
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+        self._future = None
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def check_cancelled(self):
+        # 処理の区切りで呼び出し、キャンセルされていれば中断する
+        if self.cancelled:
+            raise JobCancelled(f"job {self.job_id} was cancelled")
+
+    def _finish(self, status):
+        self.status = status
+        self.finished_at = time.time()
+
+
+class JobManager:
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, label, fn):
+        """fn(job) をバックグラウンドで実行し、ジョブIDを返す"""
+        job = Job(uuid.uuid4().hex, label)
+        with self._lock:
+            self._prune()
+            self._jobs[job.job_id] = job
+        job._future = self._executor.submit(self._run, job, fn)
+        return job.job_id
+
+    def _run(self, job, fn):
+        if job.cancelled:
+            job._finish(CANCELLED)
+            return
+        job.status = RUNNING
+        try:
+            result = fn(job)
+        except JobCancelled:
+            job._finish(CANCELLED)
+            return
+        except Exception as e:
+            if job.cancelled:
+                job._finish(CANCELLED)
+            else:
+                job.error = e
+                job._finish(FAILED)
+            return
+        if job.cancelled:
+            # 完了したが、その間にキャンセルされていた（結果は使わない）
+            job._finish(CANCELLED)
+        else:
+            job.result = result
+            job._finish(DONE)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return
+        job._cancel_event.set()
+        if job._future is not None and job._future.cancel():
+            # まだ開始していなかった
+            job._finish(CANCELLED)
+
+    def active_count(self, label_prefix=""):
+        # ラベルが label_prefix で始まる、終了していないジョブの数
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.finished and job.label.startswith(label_prefix))
+
+    def pop(self, job_id):
+        with self._lock:
+            return self._jobs.pop(job_id, None)
+
+    def _prune(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and now - job.finished_at > FINISHED_JOB_TTL_SECONDS
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,104 @@
+# --- モデルの振り分けとヘッジ ---
+# ステップごとに使うモデルを設定から選び（例: ドラフト・分析は高速なモデル、VCフィードバックは高性能なモデル）、
+# モデルごとの直近のレイテンシを記録する。
+# - 応答が直近の p95 を超えても返ってこない場合は、同じリクエストをもう1つ送り（ヘッジ）、先に応答した方を使う
+# - エラーになった場合は、ルートの次のモデルで呼び出し直す
+# ヘッジの判断には、ストリーミングなら最初のトークンまでの時間、そうでなければ応答全体の時間を使う。
+import json
+import os
+import threading
+from collections import defaultdict, deque
+
+from telemetry import percentile
+
+# コンテキストキャッシュはバージョン付きのモデル名（"gemini-1.5-flash-002" など）でしか使えないので、
+# 使う場合はこれらの環境変数でバージョンを指定する（"-latest" のままならキャッシュせずにプロンプトに直接含める）
+DEFAULT_FAST_MODEL = os.getenv("LEAN_CANVAS_FAST_MODEL", "gemini-1.5-flash-latest")
+DEFAULT_STRONG_MODEL = os.getenv("LEAN_CANVAS_STRONG_MODEL", "gemini-1.5-pro-latest")
+
+# ステップ名 → [優先するモデル, フォールバック先, ...]
+# ステップ名が見つからなければ末尾の "_..." を外しながら探し（"analysis_SWOT分析" → "analysis"）、最後に "default" を使う。
+# LEAN_CANVAS_MODEL_ROUTES にJSONで指定すると上書きできる。
+DEFAULT_ROUTES = {
+    "default": [DEFAULT_FAST_MODEL, DEFAULT_STRONG_MODEL],
+    "feedback": [DEFAULT_STRONG_MODEL, DEFAULT_FAST_MODEL],
+}
+
+HEDGE_ENABLED = os.getenv("LEAN_CANVAS_HEDGE", "1") not in ("", "0", "false")
+# ヘッジを始めるのに必要な記録数（少ないうちは p95 があてにならない）
+HEDGE_MIN_SAMPLES = 20
+HEDGE_PERCENTILE = 95
+# p95 がこれより短くてもヘッジまでは最低これだけ待つ（秒）
+HEDGE_MIN_DELAY_SECONDS = 1.0
+# レイテンシを記録する直近の件数（モデルごと）
+LATENCY_WINDOW = 200
+
+
+def load_routes():
+    routes = dict(DEFAULT_ROUTES)
+    override = os.getenv("LEAN_CANVAS_MODEL_ROUTES")
+    if override:
+        routes.update(json.loads(override))
+    return routes
+
+
+# 次のモデルを試すエラー（サーバーエラー・モデルが見つからない・使えない）
+FALLBACK_ERROR_NAMES = {"InternalServerError", "ServiceUnavailable", "DeadlineExceeded", "GatewayTimeout", "NotFound"}
+FALLBACK_STATUS_CODES = {404}
+
+
+def should_fall_back(error):
+    # サーバーエラーやモデルが使えない場合だけ次のモデルを試す。
+    # 429 はスケジューラのバックオフに任せ、400/401/403 やキャンセル・ブロックのようにモデルを変えても
+    # 結果が変わらないものは対象外
+    if type(error).__name__ in FALLBACK_ERROR_NAMES:
+        return True
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and (code in FALLBACK_STATUS_CODES or 500 <= code < 600)
+
+
+class ModelRouter:
+    def __init__(self, routes=None, hedging=HEDGE_ENABLED):
+        self.routes = routes if routes is not None else load_routes()
+        self.hedging = hedging
+        self._lock = threading.Lock()
+        # (モデル名, ストリーミングか) → 直近のレイテンシ（秒）
+        self._latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+
+    def models_for(self, step):
+        """ステップに使うモデルを優先順に返す"""
+        name = step or "default"
+        while name:
+            if name in self.routes:
+                return list(self.routes[name])
+            name = name.rpartition("_")[0]
+        return list(self.routes.get("default", []))
+
+    def record(self, model_name, seconds, streaming):
+        with self._lock:
+            self._latencies[(model_name, streaming)].append(seconds)
+
+    def hedge_after(self, model_name, streaming):
+        """この秒数を過ぎても応答がなければヘッジする（ヘッジしない場合は None）"""
+        if not self.hedging:
+            return None
+        with self._lock:
+            samples = sorted(self._latencies[(model_name, streaming)])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY_SECONDS, percentile(samples, HEDGE_PERCENTILE))
+
+    def summary(self):
+        # モデルごとの記録数とレイテンシ（管理パネル用）
+        with self._lock:
+            latencies = {key: sorted(values) for key, values in self._latencies.items()}
+        return [
+            {
+                "model": model_name,
+                "streaming": streaming,
+                "samples": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000),
+                "p95_ms": round(percentile(values, 95) * 1000),
+            }
+            for (model_name, streaming), values in sorted(latencies.items()) if values
+        ]
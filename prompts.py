@@ -0,0 +1,272 @@
+# --- プロンプト定義 ---
+# 入力フォームの質問項目と、各ステップでGeminiに送るプロンプトのテンプレート。
+# モジュールとして一度だけ読み込まれ、全セッション・全再実行で共有される。
+from canvas_sections import compact_canvas, compact_text
+
+# 入力フォームの質問（キー → 質問文）
+QUESTIONS = {
+    "ターゲット顧客": "[顧客セグメント] あなたが最初に価値を届けたい具体的な顧客は誰ですか？",
+    "顧客の課題": "[課題] その顧客が抱えている最も重要な課題は何ですか？",
+    "提供する解決策": "[ソリューション] あなたの技術やアイデアは、その課題を具体的にどう解決しますか？",
+    "競合": "[競合] 現時点で考えられる主な競合製品・サービス、または顧客が課題を解決している代替手段は何ですか？",
+    "コア技術": "[ソリューション/優位性] アイデアの中心となる技術やアプローチは何ですか？ (任意)",
+    "既存比較と優位性": "[独自の価値提案/優位性] 既存の解決策や競合と比べて、あなたのアイデアは何がどう優れていますか？",
+    "市場情報": "[市場] ターゲット市場のおおよその規模や成長性について、現時点で分かっていることがあれば教えてください。(任意)"
+}
+
+# 必須項目
+REQUIRED_KEYS = ["ターゲット顧客", "顧客の課題", "提供する解決策", "競合", "既存比較と優位性"]
+
+# ドラフト生成用プロンプト（{input_summary} に入力内容の要約が入る）
+CANVAS_PROMPT_TEMPLATE = """
+    あなたは経験豊富なインキュベーターです。
+    以下の提供された情報に基づいて、新規事業のアイデアを整理するため、Lean Canvasのドラフトを作成してください。
+    {input_summary}
+    ### 指示:
+    1. 上記の「提供された情報」を最大限活用し、Lean Canvasの各項目を埋めてください。
+    2. 特に「課題」「顧客セグメント」「ソリューション」「独自の価値提案」「圧倒的優位性」は具体的に記述してください。
+    3. 他の項目も推測できる範囲で記述してください。
+    4. 出力はMarkdown形式で見やすく記述してください。各項目は見出し（例：`**課題:**`）としてください。
+
+    ### Lean Canvas ドラフト案:
+    """
+
+# フィードバック用プロンプト（{canvas} にレビュー対象のドラフトが入る）
+FEEDBACK_PROMPT_TEMPLATE = """
+    あなたは経験豊富なベンチャーキャピタリスト（VC）です。
+    以下のLean Canvasのドラフトを厳しくレビューし、建設的なフィードバックを提供してください。
+
+    ### レビュー対象のLean Canvas ドラフト:
+    ```markdown
+    {canvas}
+    ```
+
+    ### フィードバックの観点:
+    1.  **強み (Strengths):** このプランの良い点、可能性を感じる点はどこですか？
+    2.  **弱み/懸念点 (Weaknesses/Concerns):** 不明瞭な点、矛盾している点、リスクが高いと考えられる点、具体性が不足している点はどこですか？ 仮説が甘い部分はありますか？
+    3.  **不足している視点 (Missing Perspectives):** 考慮されていない重要な要素（顧客ニーズの深掘り、競合分析、市場規模、市場トレンド、規制、仮説検証の方法など）はありますか？ 技術オリエンテッドになりすぎていませんか？
+    4.  **次に行うべきこと/問いかけ (Next Steps/Questions):** この事業アイデアを成功に近づけるために、作成者は次に何を考え、何を検証すべきですか？ 具体的な問いかけを最低3つ記述してください。
+
+    フィードバックは、単なる感想ではなく、具体的で、示唆に富み、行動につながるように記述してください。厳しい視点も歓迎します。出力はMarkdown形式でお願いします。
+    """
+
+# 改訂用プロンプト（{canvas} に元のドラフト、{feedback} にフィードバックが入る）
+REVISION_PROMPT_TEMPLATE = """
+    あなたは経験豊富なビジネスストラテジストです。
+    以下の「元のLean Canvasドラフト」と、それに対する「フィードバック」を読み、フィードバックの内容を反映させて**改訂版のLean Canvas**を作成してください。
+
+    ### 元のLean Canvas ドラフト:
+    ```markdown
+    {canvas}
+    ```
+
+    ### フィードバック:
+    ```markdown
+    {feedback}
+    ```
+
+    ### 改訂指示:
+    1.  フィードバックで指摘された弱点や懸念点に対処するように、元のドラフトの内容を修正・追記してください。
+    2.  フィードバックで提案された「次に行うべきこと」や「問いかけ」に対する答えを、可能な範囲でキャンバスの項目に反映させてください。（例：仮説検証の方法を[主要指標]に加える、リスクを[コスト構造]や[課題]で考慮するなど）
+    3.  元のドラフトの強みは維持・強化するようにしてください。
+    4.  改訂後のLean Canvas全体を出力してください。元のドラフトの形式を踏襲し、Markdown形式で見やすく記述してください。各項目は見出し（例：`**課題:**`）としてください。
+
+    ### 改訂版 Lean Canvas:
+    """
+
+# セクション単位の改訂用プロンプト（{canvas} に元のドラフト、{section} に改訂するセクション名、{points} に関係する指摘が入る）
+SECTION_REVISION_PROMPT_TEMPLATE = """
+    あなたは経験豊富なビジネスストラテジストです。
+    以下の「元のLean Canvasドラフト」のうち、**[{section}]** のセクションだけを、「フィードバックの指摘」を反映して改訂してください。
+
+    ### 元のLean Canvas ドラフト:
+    ```markdown
+    {canvas}
+    ```
+
+    ### [{section}] に関するフィードバックの指摘:
+    {points}
+{general_points}
+    ### 改訂指示:
+    1.  指摘された弱点や懸念点に対処するように、[{section}] の内容を修正・追記してください。
+    2.  他のセクションとの整合性を保ってください。他のセクションは出力しないでください。
+    3.  見出しは付けず、[{section}] の本文だけをMarkdown形式で出力してください。
+
+    ### 改訂版 [{section}]:
+    """
+
+# 類似した過去のドラフトを下敷きにした生成用プロンプト（{canvas} に過去のドラフト、{changes} に入力の違いが入る）
+EDIT_CANVAS_PROMPT_TEMPLATE = """
+    あなたは経験豊富なインキュベーターです。
+    以下の「元のLean Canvasドラフト」は、よく似た事業アイデアについて作成したものです。
+    「入力の変更点」を反映するように修正し、新しいアイデアのLean Canvasドラフトを作成してください。
+
+    ### 元のLean Canvas ドラフト:
+    ```markdown
+    {canvas}
+    ```
+
+    ### 入力の変更点:
+    {changes}
+
+    ### 指示:
+    1.  変更点に関係する項目だけを修正し、それ以外の項目は元のドラフトを活かしてください。
+    2.  修正後のLean Canvas全体を、元のドラフトと同じMarkdown形式（各項目は見出し（例：`**課題:**`））で出力してください。
+
+    ### Lean Canvas ドラフト案:
+    """
+
+# 追加分析フレームワークごとのプロンプト（{canvas} に分析対象のLean Canvasが入る）
+ANALYSIS_PROMPT_TEMPLATES = {
+    "バリュープロポジションキャンバス": """
+    あなたは顧客理解と価値提案の専門家です。
+    以下のLean Canvasの情報（特に顧客セグメント、課題、独自の価値提案、ソリューション）を最重要視し、バリュープロポジションキャンバスの6つの要素を具体的に記述してください。
+    ### Lean Canvas 情報:
+    ```markdown
+    {canvas}
+    ```
+    ### バリュープロポジションキャンバス案:
+    ...(VPC用プロンプト詳細)...
+    結果はMarkdown形式で見出しを付けて分かりやすく記述してください。
+    """,
+    "4P分析": """
+    あなたは経験豊富なマーケティング戦略家です。
+    以下のLean Canvasの情報に基づき、この事業のマーケティングミックスについて4P分析（Product, Price, Place, Promotion）の観点から具体的な戦略案を提案してください。
+
+    ### Lean Canvas 情報:
+    ```markdown
+    {canvas}
+    ```
+
+    ### 4P分析案:
+    **Product (製品・サービス):** (顧客の課題を解決する具体的な製品・サービスの詳細、特徴、品質、デザイン、ブランドなどについて)
+    **Price (価格):** (価格設定戦略、価格帯、割引、支払い条件などについて)
+    **Place (流通・場所):** (顧客が製品・サービスにアクセスできる場所や方法、チャネル、物流などについて。Lean Canvasの[チャネル]も参考に)
+    **Promotion (販促):** (ターゲット顧客への認知度向上、関心喚起、購買意欲促進のための具体的な手法。広告、広報、SNS、イベントなどについて)
+
+    結果はMarkdown形式で見出しを付けて分かりやすく記述してください。
+    """,
+    "3C分析": """
+    あなたは経験豊富な経営コンサルタントです。
+    以下のLean Canvasの情報、特に[顧客セグメント]、[課題]、[ソリューション]、[競合]、[圧倒的優位性]を参考に、この事業を取り巻く3C分析（Customer, Competitor, Company）を行ってください。
+
+    ### Lean Canvas 情報:
+    ```markdown
+    {canvas}
+    ```
+
+    ### 3C分析:
+    **Customer (市場・顧客):** (ターゲット顧客のニーズの深掘り、市場規模や成長性（もし情報があれば）、顧客の行動や意思決定プロセスについて分析してください)
+    **Competitor (競合):** (Lean Canvasの[競合]で挙げられた競合や代替手段について、それらの強み・弱みを分析し、自社と比較してください)
+    **Company (自社):** (自社の強み（特に[圧倒的優位性]）、弱み、利用可能なリソース（技術、人材、資金など）、経営課題について分析してください)
+
+    結果はMarkdown形式で見出しを付けて分かりやすく記述してください。競合と比較した上での自社の位置づけが明確になるようにしてください。
+    """,
+    "SWOT分析": """
+    あなたは経験豊富なビジネスアナリストです。
+    以下のLean Canvasの情報に基づき、この事業のSWOT分析（Strengths:強み, Weaknesses:弱み, Opportunities:機会, Threats:脅威）を行ってください。内部環境（強み・弱み）と外部環境（機会・脅威）を明確に区別してください。
+
+    ### Lean Canvas:
+    ```markdown
+    {canvas}
+    ```
+
+    ### SWOT分析:
+    **Strengths (強み):**
+    **Weaknesses (弱み):**
+    **Opportunities (機会):**
+    **Threats (脅威):**
+
+    結果はMarkdown形式で見出しを付けて分かりやすく記述してください。
+    """,
+}
+
+# 分析ごとに参照するLean Canvasのセクション（None は全セクション）
+ANALYSIS_SECTIONS = {
+    "バリュープロポジションキャンバス": ["顧客セグメント", "課題", "独自の価値提案", "ソリューション"],
+    "4P分析": ["顧客セグメント", "課題", "独自の価値提案", "ソリューション", "チャネル", "収益の流れ", "コスト構造"],
+    "3C分析": ["顧客セグメント", "課題", "ソリューション", "競合", "圧倒的優位性"],
+    "SWOT分析": None,
+}
+
+# --- 共有コンテキスト ---
+# ドラフト後のステップ（フィードバック・改訂・分析）で共通の前置きとLean Canvas。
+# コンテキストキャッシュを使う場合はこれをモデル側に1回だけ登録し、各ステップのプロンプトからはLean Canvasを省いて参照させる。
+SHARED_CONTEXT_SYSTEM_INSTRUCTION = (
+    "あなたは新規事業の立ち上げを支援する専門家です。"
+    "これから示すLean Canvasについて、この後の指示で指定される役割と観点で作業してください。"
+)
+SHARED_CONTEXT_TEMPLATE = """### 対象のLean Canvas:
+```markdown
+{canvas}
+```"""
+# 各ステップのプロンプトでLean Canvasの代わりに置く文言
+CANVAS_REFERENCE = "（冒頭に示した「対象のLean Canvas」を参照してください）"
+_CANVAS_BLOCK = "```markdown\n    {canvas}\n    ```"
+
+def build_shared_context(canvas_text):
+    # (共通の前置き, Lean Canvas) を返す。どのステップでも同じ内容になるよう、全セクションを含める
+    return SHARED_CONTEXT_SYSTEM_INSTRUCTION, SHARED_CONTEXT_TEMPLATE.format(canvas=compact_canvas(canvas_text))
+
+def _format(template, canvas_text, shared_context, **fields):
+    # shared_context=True のときはLean Canvasを含めず、共有コンテキストを参照させる
+    if shared_context:
+        return template.replace(_CANVAS_BLOCK, CANVAS_REFERENCE).format(**fields)
+    return template.format(canvas=canvas_text, **fields)
+
+def build_input_summary(user_inputs):
+    input_summary = "### 提供された情報:\n"
+    for key, value in user_inputs.items():
+        input_summary += f"- {key}: {value if value else '(未入力)'}\n"
+    return input_summary
+
+def build_canvas_prompt(input_summary):
+    return CANVAS_PROMPT_TEMPLATE.format(input_summary=input_summary)
+
+def build_edit_canvas_prompt(prior_canvas, prior_inputs, user_inputs):
+    # 過去のドラフトと、そのときの入力から変わった項目だけを渡す（入力全体は送らない）
+    changes = "\n    ".join(
+        f"- {key}: 「{prior_inputs.get(key) or '(未入力)'}」→「{value or '(未入力)'}」"
+        for key, value in user_inputs.items() if value != prior_inputs.get(key)
+    )
+    return EDIT_CANVAS_PROMPT_TEMPLATE.format(
+        canvas=compact_canvas(prior_canvas), changes=changes or "- (変更なし)",
+    )
+
+# compact=True のとき、Lean Canvasはセクションごとに分割して必要な部分だけを渡す（前置きや締めの文章も除く）
+# shared_context=True のときは、Lean Canvasは build_shared_context() の共有コンテキストとして別に渡す
+def build_feedback_prompt(canvas_text, compact=True, shared_context=False):
+    if compact:
+        canvas_text = compact_canvas(canvas_text)
+    return _format(FEEDBACK_PROMPT_TEMPLATE, canvas_text, shared_context)
+
+def build_revision_prompt(canvas_text, feedback_text, compact=True, shared_context=False):
+    if compact:
+        canvas_text = compact_canvas(canvas_text)
+        feedback_text = compact_text(feedback_text)
+    return _format(REVISION_PROMPT_TEMPLATE, canvas_text, shared_context, feedback=feedback_text)
+
+def build_section_revision_prompt(canvas_text, section_name, feedback_points, shared_context=False,
+                                  general_points=()):
+    # general_points はどのセクションにも割り当てられなかった指摘（関係する場合だけ反映させる）
+    points = "\n    ".join(f"- {point}" for point in feedback_points)
+    general = ""
+    if general_points:
+        general = (
+            f"\n    ### Lean Canvas全体に関する指摘（[{section_name}] に関係するものがあれば反映してください）:\n    "
+            + "\n    ".join(f"- {point}" for point in general_points)
+            + "\n"
+        )
+    return _format(
+        SECTION_REVISION_PROMPT_TEMPLATE, compact_canvas(canvas_text), shared_context,
+        section=section_name, points=points, general_points=general,
+    )
+
+def build_analysis_prompt(option, canvas_text, compact=True, shared_context=False):
+    # 対応するプロンプトがなければ空文字を返す
+    template = ANALYSIS_PROMPT_TEMPLATES.get(option)
+    if template is None:
+        return ""
+    if compact:
+        canvas_text = compact_canvas(canvas_text, ANALYSIS_SECTIONS.get(option))
+    return _format(template, canvas_text, shared_context)
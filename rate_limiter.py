@@ -0,0 +1,190 @@
+# --- Gemini呼び出しのレート制限とリトライ ---
+# サーバープロセス内の全セッションからのAPI呼び出しを1つのスケジューラに通し、
+# - リクエスト数/分・トークン数/分をトークンバケットで制限
+# - 待ち行列は優先度（ドラフト > フィードバック・改訂 > 分析 > 先読み）→ セッション間の公平性 → 到着順 で並べる
+# - 429/503 などの再試行可能なエラーは、ジッター付きの指数バックオフで再試行する
+import itertools
+import os
+import random
+import threading
+import time
+
+# 優先度（小さいほど先に処理される）
+PRIORITY_INTERACTIVE = 0 # ドラフト生成
+PRIORITY_FOLLOW_UP = 1 # フィードバック・改訂
+PRIORITY_BACKGROUND = 2 # 追加分析
+PRIORITY_SPECULATIVE = 3 # 先読み（まだ誰も求めていない生成なので最後）
+
+DEFAULT_REQUESTS_PER_MINUTE = float(os.getenv("LEAN_CANVAS_RPM", "15"))
+DEFAULT_TOKENS_PER_MINUTE = float(os.getenv("LEAN_CANVAS_TPM", "1000000"))
+# 埋め込みモデルは生成モデルとは別のクォータなので、別のスケジューラで制限する（GeminiClient.embed）
+DEFAULT_EMBEDDING_REQUESTS_PER_MINUTE = float(os.getenv("LEAN_CANVAS_EMBEDDING_RPM", "1500"))
+DEFAULT_MAX_RETRIES = int(os.getenv("LEAN_CANVAS_MAX_RETRIES", "4"))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+# 出力トークン数は呼び出し前に分からないため、見込みとして予約しておく量
+OUTPUT_TOKEN_RESERVE = 1024
+
+# 再試行してよいエラー（google.api_core.exceptions のクラス名 / HTTPステータス）
+RETRYABLE_ERROR_NAMES = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable",
+                         "InternalServerError", "DeadlineExceeded"}
+RETRYABLE_STATUS_CODES = {429, 500, 503, 504}
+
+
+def estimate_input_tokens(text):
+    # 日本語は概ね1〜2文字で1トークンなので、少し多めに見積もる
+    return max(1, len(text) // 2)
+
+
+def estimate_tokens(text):
+    # クォータの確保に使う見積もり（入力に出力分の予約を加える）
+    return estimate_input_tokens(text) + OUTPUT_TOKEN_RESERVE
+
+
+def is_retryable(error):
+    if type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and code in RETRYABLE_STATUS_CODES
+
+
+def backoff_delay(attempt):
+    # フルジッター付き指数バックオフ
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0 # 1秒あたりの補充量
+        self.tokens = per_minute
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        """amount を消費できるまでの秒数（0なら今すぐ消費できる）"""
+        self._refill()
+        # 容量を超える要求は、満タンになった時点で通す
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        self._refill()
+        self.tokens -= amount
+
+    def refund(self, amount):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _Ticket:
+    def __init__(self, session_id, priority, tokens, rank, seq):
+        self.session_id = session_id
+        self.priority = priority
+        self.tokens = tokens
+        self.rank = rank # そのセッションがこれまでに処理された回数（公平性のため）
+        self.seq = seq
+
+    @property
+    def sort_key(self):
+        return (self.priority, self.rank, self.seq)
+
+
+class QuotaScheduler:
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE, max_retries=DEFAULT_MAX_RETRIES):
+        self.max_retries = max_retries
+        self._request_bucket = TokenBucket(requests_per_minute)
+        self._token_bucket = TokenBucket(tokens_per_minute)
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._served = {} # セッションID → 処理回数
+        self._seq = itertools.count()
+
+    def _position(self, ticket):
+        return sorted(self._waiting, key=lambda t: t.sort_key).index(ticket) + 1
+
+    def acquire(self, session_id, priority, tokens, on_wait=None):
+        """順番とクォータが回ってくるまで待つ
+
+        on_wait(待ち行列内の順番) は待機中に定期的に呼ばれる（例外を投げると待機を中断できる）
+        """
+        with self._cond:
+            ticket = _Ticket(session_id, priority, tokens, self._served.get(session_id, 0), next(self._seq))
+            self._waiting.append(ticket)
+            try:
+                while True:
+                    head = min(self._waiting, key=lambda t: t.sort_key)
+                    wait = 1.0
+                    if head is ticket:
+                        wait = max(self._request_bucket.wait_time(1), self._token_bucket.wait_time(tokens))
+                        if wait == 0:
+                            self._request_bucket.consume(1)
+                            self._token_bucket.consume(tokens)
+                            self._served[session_id] = self._served.get(session_id, 0) + 1
+                            return
+                    if on_wait is not None:
+                        on_wait(self._position(ticket))
+                    self._cond.wait(timeout=min(wait, 1.0))
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+
+    def try_acquire(self, session_id, tokens):
+        """待たずにクォータを確保できれば確保して True を返す（順番待ちがいる場合は False）
+
+        ヘッジのように、余裕があるときだけ送りたい追加のリクエストに使う
+        """
+        with self._cond:
+            if self._waiting:
+                return False
+            if self._request_bucket.wait_time(1) > 0 or self._token_bucket.wait_time(tokens) > 0:
+                return False
+            self._request_bucket.consume(1)
+            self._token_bucket.consume(tokens)
+            self._served[session_id] = self._served.get(session_id, 0) + 1
+            return True
+
+    def reconcile(self, estimated_tokens, actual_tokens):
+        # 見積もりと実際の使用トークン数の差をバケットに反映する
+        with self._cond:
+            if actual_tokens < estimated_tokens:
+                self._token_bucket.refund(estimated_tokens - actual_tokens)
+            else:
+                self._token_bucket.consume(actual_tokens - estimated_tokens)
+            self._cond.notify_all()
+
+    def queue_length(self):
+        with self._cond:
+            return len(self._waiting)
+
+    def run(self, fn, session_id, priority, tokens, on_wait=None, on_retry=None):
+        """クォータを確保してから fn() を呼び出し、再試行可能なエラーならバックオフして再試行する
+
+        on_retry(再試行回数, 待ち秒数, エラー) は再試行の前に呼ばれる
+        """
+        attempt = 0
+        while True:
+            self.acquire(session_id, priority, tokens, on_wait=on_wait)
+            try:
+                return fn()
+            except Exception as e:
+                cause = e.__cause__ if e.__cause__ is not None else e
+                if attempt >= self.max_retries or not is_retryable(cause):
+                    raise
+                delay = backoff_delay(attempt)
+                attempt += 1
+                if on_retry is not None:
+                    on_retry(attempt, delay, cause)
+                # 待機中もキャンセルなどを受け付けられるよう、細かく区切って待つ
+                deadline = time.monotonic() + delay
+                while (remaining := deadline - time.monotonic()) > 0:
+                    if on_wait is not None:
+                        on_wait(0)
+                    time.sleep(min(0.5, remaining))
@@ -0,0 +1,213 @@
+# --- Gemini応答キャッシュ ---
+# 同じ (モデル名, プロンプト, 安全設定, 生成設定) への応答をディスクに保存し、
+# 別セッションや再実行からも再利用できるようにする。
+# - LRU: 参照時にファイルの更新時刻を更新し、古いものから削除
+# - TTL: 一定時間を過ぎたエントリは無効
+# - サイズ上限: エントリ数と合計バイト数の両方で制限（エントリの一覧はメモリに持ち、書き込みのたびにディレクトリを走査しない）
+# - single-flight: 同じキーへの同時リクエストは1回のAPI呼び出しを共有
+#   （実行していた呼び出し元がキャンセルなど自分の都合で中断した場合は、待っていた呼び出し元の1つが代わりに実行する）
+import hashlib
+import json
+import os
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.getenv(
+    "LEAN_CANVAS_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "responses"),
+)
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024  # 50MB
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60  # 7日
+# 他のプロセスが同じディレクトリに書き込んだ分を反映するため、この回数の書き込みごとにディレクトリを走査し直す
+RESCAN_EVERY_WRITES = 200
+
+
+def make_cache_key(model_name, prompt, safety_settings=None, generation_config=None):
+    """キャッシュキー（SHA-256）を生成する"""
+    # 安全設定は Enum を含む辞書なので、文字列化して並べ替えてから使う
+    safety = sorted((str(k), str(v)) for k, v in (safety_settings or {}).items())
+    payload = {
+        "model": model_name,
+        "prompt": prompt,
+        "safety_settings": safety,
+        "generation_config": generation_config or {},
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    # 実行中のリクエスト1件分（後から来た呼び出し元はこれを待つ）
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False # 実行していた呼び出し元が中断した（結果もエラーも共有しない）
+
+
+class ResponseCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._index_lock = threading.Lock()
+        self._index = None # パス → (参照時刻, バイト数)。最初の書き込みで作る
+        self._writes_since_scan = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """キャッシュされたテキストを返す（なければ None）"""
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - entry.get("created_at", 0) > self.ttl_seconds:
+            # 期限切れ
+            self._remove(path)
+            return None
+
+        try:
+            os.utime(path)  # LRU用に参照時刻を更新
+        except OSError:
+            pass
+        self._touch(path)
+        return entry.get("text")
+
+    def set(self, key, text):
+        """テキストを保存し、上限を超えていれば古いものから削除する"""
+        self._write(key, text)
+        self._evict()
+
+    def _write(self, key, text):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {"created_at": time.time(), "text": text}
+        # 書き込み途中のファイルを読まれないよう、一時ファイル経由で置き換える
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._touch(path, os.path.getsize(path))
+
+    def get_or_compute(self, key, compute, is_private_error=None, should_store=None, refresh=False):
+        """キャッシュにあればそれを、なければ compute() を1回だけ実行して結果を返す
+
+        戻り値は (テキスト, キャッシュヒットしたか)
+        is_private_error(エラー) が True になるエラー（呼び出し元のキャンセルなど）は、同じキーを待っている
+        他の呼び出し元には共有せず、そのうちの1つが改めて compute() を実行する。
+        should_store(結果) が False なら、結果は待っていた呼び出し元と共有するだけで保存しない。
+        refresh なら保存済みの結果を使わずに compute() を実行し、結果で置き換える（再生成ボタン用）。
+        """
+        while True:
+            cached = None if refresh else self.get(key)
+            if cached is not None:
+                return cached, True
+
+            with self._lock:
+                flight = self._in_flight.get(key)
+                leader = flight is None
+                if leader:
+                    # 直前に別のリクエストが完了している可能性があるので再確認
+                    cached = None if refresh else self.get(key)
+                    if cached is not None:
+                        return cached, True
+                    flight = _Flight()
+                    self._in_flight[key] = flight
+
+            if leader:
+                break
+            # 同じプロンプトを処理中のリクエストの結果を共有する
+            flight.event.wait()
+            if flight.abandoned:
+                continue # 実行していた呼び出し元が中断したので、改めて実行する（または別の呼び出し元を待つ）
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        stored = False
+        try:
+            result = compute()
+            if should_store is None or should_store(result):
+                # 書き込みはここで済ませ（直後に来た呼び出し元がキャッシュから読めるように）、
+                # 古いエントリの削除は待っている呼び出し元に結果を渡した後で行う
+                self._write(key, result)
+                stored = True
+            flight.result = result
+        except Exception as e:
+            if is_private_error is not None and is_private_error(e):
+                flight.abandoned = True
+            else:
+                flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            flight.event.set()
+        if stored:
+            self._evict()
+        return result, False
+
+    def _entries(self):
+        entries = []
+        for root, _dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _touch(self, path, size=None):
+        # メモリ上の一覧の参照時刻（と書き込んだ場合はサイズ）を更新する
+        with self._index_lock:
+            if self._index is None:
+                return
+            if size is None:
+                if path not in self._index:
+                    return
+                size = self._index[path][1]
+            self._index[path] = (time.time(), size)
+
+    def _evict(self):
+        with self._index_lock:
+            self._writes_since_scan += 1
+            if self._index is None or self._writes_since_scan >= RESCAN_EVERY_WRITES:
+                self._index = {path: (mtime, size) for mtime, size, path in self._entries()}
+                self._writes_since_scan = 0
+            total_bytes = sum(size for _mtime, size in self._index.values())
+            if len(self._index) <= self.max_entries and total_bytes <= self.max_bytes:
+                return
+            entries = sorted((mtime, size, path) for path, (mtime, size) in self._index.items())  # 参照が古い順
+        remaining = len(entries)
+        now = time.time()
+        for mtime, size, path in entries:
+            over = remaining > self.max_entries or total_bytes > self.max_bytes
+            if not over and now - mtime <= self.ttl_seconds:
+                break
+            self._remove(path)
+            remaining -= 1
+            total_bytes -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        with self._index_lock:
+            if self._index is not None:
+                self._index.pop(path, None)
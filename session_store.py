@@ -0,0 +1,180 @@
+# --- セッションストア ---
+# 生成されたテキスト（ドラフト・フィードバック・改訂版・分析結果）を st.session_state ではなくここに保存する。
+# - 書き込みはその都度SQLiteへ（zlibで圧縮したJSON）。再接続やサーバー再起動後もトークンで復元できる
+# - メモリには最近使われたセッションだけを置き、しばらく使われていないものやメモリ上限を超えた分は捨てる
+#   （ディスクには保存済みなので、次に参照されたときに読み直す）
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+DEFAULT_DB_PATH = os.getenv(
+    "LEAN_CANVAS_SESSION_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".sessions", "sessions.sqlite3"),
+)
+DEFAULT_MAX_HOT_SESSIONS = int(os.getenv("LEAN_CANVAS_MAX_HOT_SESSIONS", "200"))
+DEFAULT_MAX_HOT_BYTES = int(os.getenv("LEAN_CANVAS_MAX_HOT_BYTES", str(64 * 1024 * 1024)))
+DEFAULT_IDLE_SECONDS = 10 * 60 # これより長く使われていないセッションはメモリから外す
+DEFAULT_RETENTION_SECONDS = 30 * 24 * 60 * 60 # これより長く更新されていないセッションは削除する
+PURGE_INTERVAL_SECONDS = 60 * 60
+
+
+def new_session_token():
+    return secrets.token_urlsafe(16)
+
+
+def _encode(data):
+    return zlib.compress(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+
+def _decode(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def _size_of(data):
+    # メモリ使用量の目安（文字列の長さの合計）
+    return sum(len(key) + len(json.dumps(value, ensure_ascii=False)) for key, value in data.items())
+
+
+class StoredSession:
+    """1セッション分のデータへのアクセス（dict のように使う）"""
+
+    def __init__(self, store, token):
+        self.store = store
+        self.token = token
+
+    def get(self, key, default=""):
+        return self.store.get(self.token, key, default)
+
+    def __getitem__(self, key):
+        return self.store.get(self.token, key, "")
+
+    def __setitem__(self, key, value):
+        self.store.set(self.token, key, value)
+
+    def __contains__(self, key):
+        return bool(self.store.get(self.token, key, None))
+
+    def pop(self, *keys):
+        self.store.delete(self.token, *keys)
+
+
+class SessionStore:
+    def __init__(self, db_path=DEFAULT_DB_PATH, max_hot_sessions=DEFAULT_MAX_HOT_SESSIONS,
+                 max_hot_bytes=DEFAULT_MAX_HOT_BYTES, idle_seconds=DEFAULT_IDLE_SECONDS,
+                 retention_seconds=DEFAULT_RETENTION_SECONDS):
+        self.max_hot_sessions = max_hot_sessions
+        self.max_hot_bytes = max_hot_bytes
+        self.idle_seconds = idle_seconds
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._hot = OrderedDict() # トークン → [データ, サイズ, 最終アクセス時刻]（古い順）
+        self._hot_bytes = 0
+        self._last_purge = 0.0
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " token TEXT PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+        # 全セッションを通した機能ごとの利用回数（先読みする分析の選択に使う）
+        self._db.execute("CREATE TABLE IF NOT EXISTS usage (name TEXT PRIMARY KEY, count INTEGER NOT NULL)")
+        self._db.commit()
+
+    def session(self, token):
+        return StoredSession(self, token)
+
+    def exists(self, token):
+        with self._lock:
+            if token in self._hot:
+                return True
+            row = self._db.execute("SELECT 1 FROM sessions WHERE token = ?", (token,)).fetchone()
+            return row is not None
+
+    def _load(self, token):
+        # ロックを取った状態で呼ぶ。メモリになければディスクから読み込む
+        now = time.time()
+        entry = self._hot.get(token)
+        if entry is None:
+            row = self._db.execute("SELECT data FROM sessions WHERE token = ?", (token,)).fetchone()
+            data = _decode(row[0]) if row else {}
+            entry = [data, _size_of(data), now]
+            self._hot[token] = entry
+            self._hot_bytes += entry[1]
+        else:
+            entry[2] = now
+            self._hot.move_to_end(token)
+        return entry
+
+    def get(self, token, key, default=""):
+        with self._lock:
+            entry = self._load(token)
+            value = entry[0].get(key, default)
+            self._enforce_limits(keep=token)
+            return value
+
+    def set(self, token, key, value):
+        self._write(token, lambda data: data.__setitem__(key, value))
+
+    def delete(self, token, *keys):
+        self._write(token, lambda data: [data.pop(key, None) for key in keys])
+
+    def _write(self, token, update):
+        with self._lock:
+            entry = self._load(token)
+            update(entry[0])
+            self._hot_bytes -= entry[1]
+            entry[1] = _size_of(entry[0])
+            self._hot_bytes += entry[1]
+            # 書き込みは即座にディスクへ（メモリから外しても失われない）
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (token, data, updated_at) VALUES (?, ?, ?)",
+                (token, _encode(entry[0]), time.time()),
+            )
+            self._db.commit()
+            self._enforce_limits(keep=token)
+            self._purge_expired()
+
+    def _enforce_limits(self, keep=None):
+        # 使われていないセッションと、上限を超えた分（古い順）をメモリから外す
+        now = time.time()
+        for token in list(self._hot):
+            if token == keep:
+                continue
+            data, size, last_access = self._hot[token]
+            over = len(self._hot) > self.max_hot_sessions or self._hot_bytes > self.max_hot_bytes
+            if not over and now - last_access <= self.idle_seconds:
+                break
+            del self._hot[token]
+            self._hot_bytes -= size
+
+    def _purge_expired(self):
+        now = time.time()
+        if now - self._last_purge < PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = now
+        self._db.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.retention_seconds,))
+        self._db.commit()
+
+    def record_usage(self, name):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO usage (name, count) VALUES (?, 1)"
+                " ON CONFLICT(name) DO UPDATE SET count = count + 1",
+                (name,),
+            )
+            self._db.commit()
+
+    def usage_counts(self):
+        with self._lock:
+            return dict(self._db.execute("SELECT name, count FROM usage").fetchall())
+
+    def stats(self):
+        with self._lock:
+            return {"hot_sessions": len(self._hot), "hot_bytes": self._hot_bytes}
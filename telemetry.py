@@ -0,0 +1,247 @@
+# --- 生成呼び出しのテレメトリ ---
+# Geminiの呼び出しごとに、レイテンシ・最初のトークンまでの時間・トークン数・finish_reason・
+# ブロック理由・リトライ回数・キャッシュヒットを記録する。
+# - ローテーションするJSONLログに1呼び出し1行で書き出す
+# - Prometheus形式のメトリクスをHTTPで公開できる（LEAN_CANVAS_METRICS_PORT を設定した場合）
+# - 直近の記録からステップごとのパーセンタイルを計算し、管理パネルに表示する
+import json
+import math
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+
+DEFAULT_LOG_PATH = os.getenv(
+    "LEAN_CANVAS_TELEMETRY_LOG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".telemetry", "generations.jsonl"),
+)
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# パーセンタイル計算に使う直近の記録数（ステップごと）
+RECENT_SAMPLES = 1000
+# Prometheus のヒストグラムのバケット（ミリ秒）
+LATENCY_BUCKETS_MS = [100, 250, 500, 1000, 2500, 5000, 10000, 20000, 30000, 60000]
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, q):
+    # 最近傍法によるパーセンタイル（values は昇順）
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def describe_response(response):
+    """API応答からトークン数・finish_reason・ブロック理由を取り出す（取れないものは None）"""
+    info = {"prompt_tokens": None, "output_tokens": None, "cached_tokens": None,
+            "finish_reason": None, "block_reason": None}
+    if response is None:
+        return info
+    try:
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            info["prompt_tokens"] = getattr(usage, "prompt_token_count", None)
+            info["output_tokens"] = getattr(usage, "candidates_token_count", None)
+            # 共有コンテキスト（コンテキストキャッシュ）から読み込まれた入力トークン数
+            info["cached_tokens"] = getattr(usage, "cached_content_token_count", None)
+        candidates = getattr(response, "candidates", None)
+        if candidates:
+            finish_reason = getattr(candidates[0], "finish_reason", None)
+            info["finish_reason"] = getattr(finish_reason, "name", None) or (str(finish_reason) if finish_reason is not None else None)
+        prompt_feedback = getattr(response, "prompt_feedback", None)
+        block_reason = getattr(prompt_feedback, "block_reason", None)
+        if block_reason:
+            info["block_reason"] = getattr(block_reason, "name", None) or str(block_reason)
+    except Exception as e:
+        logger.debug("Could not read response metadata: %s", e)
+    return info
+
+
+class CallRecorder:
+    """1回の生成呼び出しの計測。GeminiClient.generate の中で使う"""
+
+    def __init__(self, telemetry, step, model_name, session_id):
+        self.telemetry = telemetry
+        self.step = step
+        self.model_name = model_name
+        self.session_id = session_id
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.retries = 0
+        self.hedged = False
+        self.fallbacks = 0
+
+    def first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def retry(self):
+        self.retries += 1
+
+    def hedge(self):
+        self.hedged = True
+
+    def fallback(self):
+        self.fallbacks += 1
+
+    def finish(self, response=None, cache_hit=False, error=None):
+        now = time.perf_counter()
+        latency_ms = (now - self.started) * 1000
+        # ストリーミングしない場合・キャッシュヒットの場合は、全体のレイテンシが最初のトークンまでの時間になる
+        ttft_ms = (self.first_token_at - self.started) * 1000 if self.first_token_at else latency_ms
+        event = {
+            "ts": time.time(),
+            "step": self.step,
+            "model": self.model_name,
+            "session": self.session_id,
+            "status": "error" if error is not None else "ok",
+            "latency_ms": round(latency_ms, 1),
+            "ttft_ms": round(ttft_ms, 1),
+            "cache_hit": cache_hit,
+            "retries": self.retries,
+            "hedged": self.hedged,
+            "fallbacks": self.fallbacks,
+            "error": type(error).__name__ if error is not None else None,
+        }
+        event.update(describe_response(response))
+        self.telemetry.record(event)
+        return event
+
+
+class Telemetry:
+    def __init__(self, log_path=DEFAULT_LOG_PATH):
+        self._lock = threading.Lock()
+        self._recent = defaultdict(lambda: deque(maxlen=RECENT_SAMPLES))
+        self._counters = defaultdict(float)
+        self._histogram = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))
+        self._latency_sum = defaultdict(float)
+        self._server = None
+        self._log = logging.getLogger(f"{__name__}.events")
+        self._log.propagate = False
+        if log_path and not self._log.handlers:
+            try:
+                os.makedirs(os.path.dirname(log_path), exist_ok=True)
+                handler = RotatingFileHandler(log_path, maxBytes=LOG_MAX_BYTES,
+                                              backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                self._log.addHandler(handler)
+                self._log.setLevel(logging.INFO)
+            except OSError as e:
+                logger.warning("Telemetry log disabled: %s", e)
+
+    def start_call(self, step, model_name, session_id=None):
+        return CallRecorder(self, step or "unknown", model_name, session_id)
+
+    def record(self, event):
+        self._log.info(json.dumps(event, ensure_ascii=False, default=str))
+        step = event["step"]
+        with self._lock:
+            self._recent[step].append(event)
+            self._counters[("requests", step, event["status"])] += 1
+            if event["cache_hit"]:
+                self._counters[("cache_hits", step, "")] += 1
+            self._counters[("retries", step, "")] += event["retries"]
+            if event.get("hedged"):
+                self._counters[("hedges", step, "")] += 1
+            self._counters[("fallbacks", step, "")] += event.get("fallbacks", 0)
+            for kind in ("prompt_tokens", "output_tokens", "cached_tokens"):
+                if event.get(kind):
+                    self._counters[(kind, step, "")] += event[kind]
+            if event.get("block_reason"):
+                self._counters[("blocked", step, event["block_reason"])] += 1
+            buckets = self._histogram[step]
+            for i, bound in enumerate(LATENCY_BUCKETS_MS):
+                if event["latency_ms"] <= bound:
+                    buckets[i] += 1
+                    break
+            else:
+                buckets[-1] += 1
+            self._latency_sum[step] += event["latency_ms"]
+
+    def summary(self):
+        """ステップごとの件数・キャッシュヒット率・レイテンシのパーセンタイルを返す"""
+        rows = []
+        with self._lock:
+            recent = {step: list(events) for step, events in self._recent.items()}
+        for step, events in sorted(recent.items()):
+            latencies = sorted(e["latency_ms"] for e in events)
+            ttfts = sorted(e["ttft_ms"] for e in events)
+            rows.append({
+                "step": step,
+                "calls": len(events),
+                "errors": sum(1 for e in events if e["status"] == "error"),
+                "hedged": sum(1 for e in events if e.get("hedged")),
+                "cache_hit_rate": sum(1 for e in events if e["cache_hit"]) / len(events),
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95),
+                "p99_ms": percentile(latencies, 99),
+                "ttft_p50_ms": percentile(ttfts, 50),
+                "ttft_p95_ms": percentile(ttfts, 95),
+            })
+        return rows
+
+    def render_prometheus(self):
+        """Prometheusのテキスト形式でメトリクスを返す"""
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            histogram = {step: list(buckets) for step, buckets in self._histogram.items()}
+            latency_sum = dict(self._latency_sum)
+
+        for name in ("requests", "cache_hits", "retries", "hedges", "fallbacks",
+                     "prompt_tokens", "output_tokens", "cached_tokens", "blocked"):
+            metric = f"lean_canvas_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (kind, step, label), value in sorted(counters.items()):
+                if kind != name:
+                    continue
+                labels = f'step="{step}"'
+                if kind == "requests":
+                    labels += f',status="{label}"'
+                elif kind == "blocked":
+                    labels += f',reason="{label}"'
+                lines.append(f"{metric}{{{labels}}} {value:g}")
+
+        metric = "lean_canvas_latency_ms"
+        lines.append(f"# TYPE {metric} histogram")
+        for step, buckets in sorted(histogram.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS_MS, buckets):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{step="{step}",le="{bound}"}} {cumulative}')
+            cumulative += buckets[-1]
+            lines.append(f'{metric}_bucket{{step="{step}",le="+Inf"}} {cumulative}')
+            lines.append(f'{metric}_sum{{step="{step}"}} {latency_sum.get(step, 0):g}')
+            lines.append(f'{metric}_count{{step="{step}"}} {cumulative}')
+        return "\n".join(lines) + "\n"
+
+    def start_metrics_server(self, port, host="127.0.0.1"):
+        """/metrics でメトリクスを公開するHTTPサーバーをバックグラウンドで起動する（1プロセス1回）"""
+        if self._server is not None:
+            return self._server
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = telemetry.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # アクセスログは出さない
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+        logger.info("Metrics endpoint listening on http://%s:%d/metrics", host, port)
+        return self._server
@@ -0,0 +1,77 @@
+import json
+
+import batch
+from prompts import QUESTIONS
+
+
+def write_ideas(path, ids):
+    with open(path, "w", encoding="utf-8") as f:
+        for idea_id in ids:
+            f.write(json.dumps({"id": idea_id, **{key: "入力" for key in QUESTIONS}}, ensure_ascii=False) + "\n")
+
+
+def test_resume_skips_ideas_already_recorded(tmp_path, monkeypatch):
+    ideas = tmp_path / "ideas.jsonl"
+    out = tmp_path / "results.jsonl"
+    write_ideas(ideas, ["a", "b", "c"])
+    # 前回は a が完了、b が失敗し、c の途中で中断した
+    with open(out, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"id": "a", "status": "ok"}) + "\n")
+        f.write(json.dumps({"id": "b", "status": "error", "error": "RuntimeError: boom"}) + "\n")
+        f.write('{"id": "c", "sta')
+
+    processed = []
+
+    def fake_run_idea(client, user_inputs, frameworks, session_id=None, **kwargs):
+        processed.append(session_id)
+        return {"user_inputs": user_inputs, "errors": {}}
+
+    monkeypatch.setenv("GEMINI_API_KEY", "test")
+    monkeypatch.setattr(batch, "run_idea", fake_run_idea)
+    assert batch.main([str(ideas), "--out", str(out), "--checkpoint-dir", str(tmp_path / "checkpoints")]) == 0
+
+    assert sorted(processed) == ["b", "c"]
+    with open(out, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    # 途中までの行はそのまま残り、新しい結果はその次の行から書かれる
+    assert lines[2] == '{"id": "c", "sta'
+    records = [json.loads(line) for line in lines[3:]]
+    assert sorted(record["id"] for record in records) == ["b", "c"]
+    assert all(record["status"] == "ok" for record in records)
+
+
+class FlakyAnalysisClient:
+    """分析の呼び出しだけが1回目に失敗する偽のクライアント"""
+
+    context_cache = None
+
+    def __init__(self, *args, **kwargs):
+        self.steps = []
+
+    def generate(self, prompt, step=None, **kwargs):
+        self.steps.append(step)
+        if step.startswith("analysis_") and self.steps.count(step) == 1:
+            raise RuntimeError("429 Resource exhausted")
+        return f"{step} の結果", None
+
+
+def test_partial_results_rerun_only_the_failed_stage(tmp_path, monkeypatch):
+    ideas = tmp_path / "ideas.jsonl"
+    out = tmp_path / "results.jsonl"
+    write_ideas(ideas, ["a"])
+    client = FlakyAnalysisClient()
+    monkeypatch.setenv("GEMINI_API_KEY", "test")
+    monkeypatch.setattr(batch, "GeminiClient", lambda *args, **kwargs: client)
+    argv = [str(ideas), "--out", str(out), "--checkpoint-dir", str(tmp_path / "checkpoints"), "--frameworks", "SWOT分析"]
+
+    assert batch.main(argv) == 1
+    with open(out, encoding="utf-8") as f:
+        assert json.loads(f.readline())["status"] == "partial"
+    first_run_steps = len(client.steps)
+
+    assert batch.main(argv) == 0
+    assert client.steps[first_run_steps:] == ["analysis_SWOT分析"]
+    with open(out, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert [record["status"] for record in records] == ["partial", "ok"]
+    assert records[1]["analysis_SWOT分析"] == "analysis_SWOT分析 の結果"
@@ -0,0 +1,187 @@
+from canvas_sections import (
+    CANVAS_SECTIONS, parse_canvas, compact_canvas, map_feedback_to_sections, unmapped_feedback_points, merge_sections,
+)
+from engine import plan_section_revision
+
+CANVAS = """
+承知しました。以下がLean Canvasのドラフトです。
+
+**1. 課題 (Problem):**
+* 中小飲食店は食材の発注を経験と勘に頼っており、廃棄が多い
+
+**2. 顧客セグメント (Customer Segments):**
+* 席数30席以下の個人経営の飲食店
+
+**3. 独自の価値提案 (Unique Value Proposition):**
+* POSデータから翌日の発注量を自動で提案し、廃棄を3割減らす
+
+**4. ソリューション (Solution):**
+* POS連携の需要予測と発注リストの自動作成
+
+**5. チャネル (Channels):**
+* POSベンダー経由の紹介、飲食店向け展示会
+
+**6. 収益の流れ (Revenue Streams):**
+* 月額9,800円のサブスクリプション
+
+**7. コスト構造 (Cost Structure):**
+* 開発人件費、サーバー費用、営業費用
+
+**8. 主要指標 (Key Metrics):**
+* 導入店舗数、廃棄削減率
+
+**9. 圧倒的優位性 (Unfair Advantage):**
+* 大手POSベンダーとの提携
+
+**10. 競合 (Competitors):**
+* 汎用の在庫管理SaaS
+
+---
+ご不明な点があればお知らせください。
+"""
+
+# 各セクションの中に、セクション名を含む太字の小見出しがあるドラフト
+CANVAS_WITH_SUB_BULLETS = """
+**課題:**
+* 発注が経験と勘に頼っている
+* **既存の代替品:** 紙の発注ノート、Excel
+
+**顧客セグメント:**
+* 個人経営の飲食店
+* **アーリーアダプター:** 複数店舗を持つオーナー
+
+**独自の価値提案:**
+* 翌日の発注量を自動で提案する
+
+**ソリューション:**
+* 需要予測による発注リスト
+* **コスト削減効果:** 月3万円の廃棄削減
+* POS連携で入力の手間をなくす
+
+**収益の流れ:**
+* 月額9,800円
+
+**コスト構造:**
+* 開発人件費、サーバー費用
+
+**競合:**
+* 在庫管理SaaS
+"""
+
+# FEEDBACK_PROMPT_TEMPLATE の4つの観点に沿った、典型的なフィードバック（見出しは `###` 形式）
+FEEDBACK_HASH_HEADINGS = """
+## VCフィードバック
+
+### 1. 強み (Strengths)
+* **明確な課題設定:** 食材廃棄という顧客の課題が具体的で、市場のニーズもありそうです。
+* **技術の活用:** POSデータを使った需要予測は技術的に筋が良く、チャネルとしてPOSベンダーを使うのも良い判断です。
+* **優位性:** 大手POSベンダーとの提携が実現すれば強い差別化になります。
+
+### 2. 弱み/懸念点 (Weaknesses/Concerns)
+* **価格設定の根拠:** 月額9,800円が小規模店舗にとって妥当か、根拠が示されていません。
+* **需要予測の精度:** 小規模店舗はデータ量が少なく、予測の精度が出るか疑問です。
+
+### 3. 不足している視点 (Missing Perspectives)
+* **競合分析:** POSベンダー自身が同様の機能を提供する可能性が検討されていません。
+
+### 4. 次に行うべきこと/問いかけ (Next Steps/Questions)
+1. 廃棄削減率をどう測定し、主要指標として追跡しますか？
+2. 10店舗程度で手動の発注提案を試し、支払意思を確認できますか？
+3. POSベンダーにとっての提携のメリットは何ですか？
+"""
+
+# 同じ内容を `1. **強み (Strengths):**` 形式の見出しで書いたもの
+FEEDBACK_BOLD_HEADINGS = """
+このLean Canvasに対するフィードバックです。
+
+1. **強み (Strengths):** 課題が具体的です。
+    * **明確な課題設定:** 食材廃棄という顧客の課題が具体的で、市場のニーズもありそうです。
+    * **技術の活用:** POSデータを使った需要予測は技術的に筋が良く、チャネルとしてPOSベンダーを使うのも良い判断です。
+    * **優位性:** 大手POSベンダーとの提携が実現すれば強い差別化になります。
+
+2. **弱み/懸念点 (Weaknesses/Concerns):**
+    * **価格設定の根拠:** 月額9,800円が小規模店舗にとって妥当か、根拠が示されていません。
+    * **需要予測の精度:** 小規模店舗はデータ量が少なく、予測の精度が出るか疑問です。
+
+3. **不足している視点 (Missing Perspectives):**
+    * **競合分析:** POSベンダー自身が同様の機能を提供する可能性が検討されていません。
+
+4. **次に行うべきこと/問いかけ (Next Steps/Questions):**
+    * 廃棄削減率をどう測定し、主要指標として追跡しますか？
+    * 10店舗程度で手動の発注提案を試し、支払意思を確認できますか？
+"""
+
+
+def test_parse_canvas_splits_numbered_headings_and_drops_closing_text():
+    sections = parse_canvas(CANVAS)
+    assert list(sections) == CANVAS_SECTIONS
+    assert sections["収益の流れ"] == "* 月額9,800円のサブスクリプション"
+    assert "ご不明な点" not in sections["競合"]
+
+
+def test_bold_sub_bullets_stay_in_their_section():
+    sections = parse_canvas(CANVAS_WITH_SUB_BULLETS)
+    assert list(sections) == ["課題", "顧客セグメント", "独自の価値提案", "ソリューション", "収益の流れ", "コスト構造", "競合"]
+    assert "**既存の代替品:** 紙の発注ノート" in sections["課題"]
+    assert "**アーリーアダプター:**" in sections["顧客セグメント"]
+    assert sections["ソリューション"].endswith("* POS連携で入力の手間をなくす")
+    assert "**コスト削減効果:**" in sections["ソリューション"]
+    assert sections["コスト構造"] == "* 開発人件費、サーバー費用"
+    assert sections["収益の流れ"] == "* 月額9,800円"
+
+
+def test_compaction_keeps_sub_bullet_content():
+    compacted = compact_canvas(CANVAS_WITH_SUB_BULLETS, ["ソリューション", "競合"])
+    assert "POS連携" in compacted
+    assert "開発人件費" not in compacted
+
+
+def test_bulleted_section_headings_are_still_recognized():
+    canvas = "- **課題:** 廃棄が多い\n- **顧客セグメント (Customer Segments):** 飲食店\n- **競合:** 在庫管理SaaS"
+    assert parse_canvas(canvas) == {"課題": "廃棄が多い", "顧客セグメント": "飲食店", "競合": "在庫管理SaaS"}
+
+
+def test_strengths_are_not_mapped():
+    for feedback in (FEEDBACK_HASH_HEADINGS, FEEDBACK_BOLD_HEADINGS):
+        points = map_feedback_to_sections(feedback)
+        assert "チャネル" not in points
+        assert "圧倒的優位性" not in points
+        assert all("明確な課題設定" not in point for values in points.values() for point in values)
+
+
+def test_weaknesses_map_to_their_sections():
+    points = map_feedback_to_sections(FEEDBACK_HASH_HEADINGS)
+    assert set(points) == {"収益の流れ", "ソリューション", "主要指標", "競合"}
+    assert points["収益の流れ"] == ["**価格設定の根拠:** 月額9,800円が小規模店舗にとって妥当か、根拠が示されていません。"]
+
+
+def test_typical_feedback_selects_incremental_revision():
+    for feedback in (FEEDBACK_HASH_HEADINGS, FEEDBACK_BOLD_HEADINGS):
+        points, general_points, notice = plan_section_revision(CANVAS, feedback)
+        assert 0 < len(points) < len(CANVAS_SECTIONS) * 0.6
+        # どのセクションにも当てはまらない指摘は捨てずに返し、利用者にも知らせる
+        assert "10店舗程度で手動の発注提案を試し、支払意思を確認できますか？" in general_points
+        assert "全体を再生成する" in notice
+
+
+def test_unmapped_points_are_returned():
+    unmapped = unmapped_feedback_points(FEEDBACK_HASH_HEADINGS)
+    assert unmapped == [
+        "**需要予測の精度:** 小規模店舗はデータ量が少なく、予測の精度が出るか疑問です。",
+        "10店舗程度で手動の発注提案を試し、支払意思を確認できますか？",
+        "POSベンダーにとっての提携のメリットは何ですか？",
+    ]
+
+
+def test_merge_replaces_only_the_revised_section():
+    merged = merge_sections(CANVAS_WITH_SUB_BULLETS, {"ソリューション": "* 改訂したソリューション"})
+    sections = parse_canvas(merged)
+    assert sections["ソリューション"] == "* 改訂したソリューション"
+    assert sections["コスト構造"] == "* 開発人件費、サーバー費用"
+    assert "**アーリーアダプター:**" in sections["顧客セグメント"]
+    assert merged.count("**コスト構造:**") == 1
+
+
+def test_feedback_without_part_headings_uses_every_line():
+    points = map_feedback_to_sections("- 価格の根拠が不明です\n- 差別化が弱いです")
+    assert set(points) == {"収益の流れ", "圧倒的優位性"}
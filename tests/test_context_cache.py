@@ -0,0 +1,50 @@
+from context_cache import ContextCache, GeminiContextBackend, LocalContextBackend
+
+
+class RecordingBackend(GeminiContextBackend):
+    def __init__(self):
+        self.created = []
+
+    def create(self, model_name, system_instruction, context_text, ttl_seconds):
+        self.created.append(model_name)
+        return object()
+
+    def delete(self, handle):
+        pass
+
+
+def test_accepts_measures_context_without_output_reserve():
+    cache = ContextCache(LocalContextBackend(), min_tokens=1000)
+    assert not cache.accepts("", "あ" * 1998)
+    assert cache.accepts("", "あ" * 2000)
+
+
+def test_gemini_backend_requires_versioned_model():
+    backend = RecordingBackend()
+    cache = ContextCache(backend, min_tokens=0)
+    assert cache.acquire("gemini-1.5-flash-latest", "前置き", "canvas", "s1") is None
+    assert backend.created == []
+    assert cache.acquire("gemini-1.5-flash-002", "前置き", "canvas", "s1") is not None
+    assert backend.created == ["gemini-1.5-flash-002"]
+
+
+def test_session_keeps_contexts_per_canvas_across_models():
+    backend = LocalContextBackend()
+    cache = ContextCache(backend, min_tokens=0)
+    # ドラフトと改訂版のそれぞれを、フィードバック用と分析用の2つのモデルで使う
+    for canvas in ("draft", "revised"):
+        for model_name in ("fast-model", "strong-model"):
+            cache.acquire(model_name, "前置き", canvas, "s1")
+    for canvas in ("draft", "revised"):
+        for model_name in ("fast-model", "strong-model"):
+            cache.acquire(model_name, "前置き", canvas, "s1")
+    assert cache.stats["created"] == 4
+    assert cache.stats["deleted"] == 0
+
+    # 3つ目のLean Canvasで、最も古いもの（両モデル分）が削除される
+    cache.acquire("fast-model", "前置き", "revised-2", "s1")
+    assert cache.stats["deleted"] == 2
+    assert len(backend) == 3
+
+    cache.release("s1")
+    assert len(backend) == 0
@@ -0,0 +1,66 @@
+import threading
+import time
+
+import pytest
+
+from engine import revise_sections
+from jobs import JobCancelled
+
+CANVAS = "\n\n".join(f"**{name}:**\n{name}の内容" for name in [
+    "課題", "顧客セグメント", "独自の価値提案", "ソリューション", "チャネル", "収益の流れ",
+])
+
+
+class SlowClient:
+    context_cache = None
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = 0
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    def generate(self, prompt, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.prompts.append(prompt)
+        time.sleep(self.delay)
+        return "改訂した内容", None
+
+
+def test_cancel_stops_queued_section_calls():
+    client = SlowClient(delay=0.5)
+    feedback_points = {name: ["具体的にしてください"] for name in [
+        "課題", "顧客セグメント", "独自の価値提案", "ソリューション", "チャネル",
+    ]}
+    cancelled = threading.Event()
+    threading.Timer(0.2, cancelled.set).start()
+
+    def check_cancelled():
+        if cancelled.is_set():
+            raise JobCancelled("cancelled")
+
+    started = time.perf_counter()
+    with pytest.raises(JobCancelled):
+        revise_sections(client, CANVAS, feedback_points, check_cancelled=check_cancelled)
+    # 実行中のセクションの完了を待たずに戻り、開始前のセクションは呼び出されない
+    assert time.perf_counter() - started < 0.5
+    time.sleep(0.6)
+    assert client.calls == 4
+
+
+def test_revise_sections_merges_updates():
+    client = SlowClient(delay=0)
+    progress = []
+    revised = revise_sections(client, CANVAS, {"課題": ["a"], "チャネル": ["b"]}, on_progress=progress.append)
+    assert "**課題:**\n改訂した内容" in revised
+    assert "**チャネル:**\n改訂した内容" in revised
+    assert "**顧客セグメント:**\n顧客セグメントの内容" in revised
+    assert progress[-1] == revised
+
+
+def test_general_points_are_passed_to_each_section():
+    client = SlowClient(delay=0)
+    revise_sections(client, CANVAS, {"課題": ["a"], "チャネル": ["b"]}, general_points=["規制への対応が不明です"])
+    assert len(client.prompts) == 2
+    assert all("規制への対応が不明です" in prompt for prompt in client.prompts)
@@ -0,0 +1,149 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import model_router
+from gemini_client import GeminiClient
+from jobs import JobCancelled
+from model_router import ModelRouter
+from rate_limiter import QuotaScheduler
+from response_cache import ResponseCache
+from telemetry import Telemetry
+
+MODEL = "fake-model"
+
+
+class FakeModel:
+    """呼び出し回数を数える偽のモデル。responses[n] が n 回目の呼び出しの (遅延秒数, チャンク数)"""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        with self._lock:
+            index = self.calls
+            self.calls += 1
+        delay, chunks = self.responses[min(index, len(self.responses) - 1)]
+        if not stream:
+            time.sleep(delay)
+            return SimpleNamespace(text=f"response {index}", usage_metadata=None)
+
+        def iterate():
+            time.sleep(delay)
+            for i in range(chunks):
+                yield SimpleNamespace(text=f"{index}-{i} ")
+                time.sleep(0.05)
+        return iterate()
+
+
+@pytest.fixture
+def make_client(tmp_path, monkeypatch):
+    import google.generativeai as genai
+    monkeypatch.setattr(model_router, "HEDGE_MIN_DELAY_SECONDS", 0.05)
+    monkeypatch.setattr(genai, "configure", lambda **kwargs: None)
+
+    def make(fake_model, streaming):
+        monkeypatch.setattr(genai, "GenerativeModel", lambda name: fake_model)
+        router = ModelRouter({"default": [MODEL]}, hedging=True)
+        for _ in range(model_router.HEDGE_MIN_SAMPLES):
+            router.record(MODEL, 0.01, streaming) # 直近の p95 を 0.01 秒にしておく（ヘッジは 0.05 秒後）
+        return GeminiClient(
+            "test-key", MODEL, cache=ResponseCache(str(tmp_path / "cache")),
+            scheduler=QuotaScheduler(requests_per_minute=6000, tokens_per_minute=10 ** 9),
+            telemetry=Telemetry(log_path=None), context_cache=None, router=router,
+        )
+    return make
+
+
+def test_streaming_call_is_not_hedged_after_first_token(make_client):
+    # 最初のトークンはすぐに届くが、ストリーム全体はヘッジの待ち時間より長くかかる
+    fake_model = FakeModel([(0.0, 8)])
+    client = make_client(fake_model, streaming=True)
+    received = []
+
+    text, _response = client.generate("prompt", on_text=received.append, step="feedback")
+
+    assert fake_model.calls == 1
+    assert text == "".join(f"0-{i} " for i in range(8))
+    assert client.telemetry.summary()[0]["hedged"] == 0
+
+
+def test_slow_unary_call_is_hedged(make_client):
+    fake_model = FakeModel([(1.0, 0), (0.0, 0)])
+    client = make_client(fake_model, streaming=False)
+
+    text, _response = client.generate("prompt", step="feedback")
+
+    assert fake_model.calls == 2
+    assert text == "response 1"
+    assert client.telemetry.summary()[0]["hedged"] == 1
+
+
+def test_cancelled_caller_does_not_fail_identical_request(make_client):
+    # 同じプロンプトを実行中の呼び出しがキャンセルされても、それを待っていた呼び出しは自分で生成し直す
+    fake_model = FakeModel([(0.2, 3)])
+    client = make_client(fake_model, streaming=True)
+    client.router.hedging = False
+
+    def cancelled(text):
+        raise JobCancelled("job was cancelled")
+
+    errors = []
+    first = threading.Thread(target=lambda: _collect_error(errors, client.generate, "prompt", on_text=cancelled))
+    first.start()
+    time.sleep(0.05)
+    text, _response = client.generate("prompt", on_text=lambda text: None)
+    first.join(5)
+
+    assert isinstance(errors[0].__cause__, JobCancelled)
+    assert fake_model.calls == 2
+    assert text == "1-0 1-1 1-2 "
+
+
+def _collect_error(errors, fn, *args, **kwargs):
+    try:
+        fn(*args, **kwargs)
+    except Exception as e:
+        errors.append(e)
+
+
+def test_embeddings_do_not_use_the_generation_quota(make_client, monkeypatch):
+    import google.generativeai as genai
+    monkeypatch.setattr(genai, "embed_content", lambda **kwargs: {"embedding": [1.0, 0.0]})
+    client = make_client(FakeModel([(0.0, 0)]), streaming=False)
+    # 生成のクォータを使い切っていても、埋め込みは待たずに呼び出せる
+    client.scheduler = QuotaScheduler(requests_per_minute=1, tokens_per_minute=10 ** 9)
+    client.scheduler.acquire("other", 0, 1)
+
+    started = time.perf_counter()
+    assert client.embed("アイデア", "models/text-embedding-004") == [1.0, 0.0]
+    assert time.perf_counter() - started < 0.5
+    assert client.telemetry.summary()[0]["step"] == "embedding"
+
+
+class UnavailableModel:
+    calls = 0
+
+    def generate_content(self, prompt, **kwargs):
+        self.calls += 1
+        error = Exception("503 Service Unavailable")
+        error.code = 503
+        raise error
+
+
+def test_fallback_response_is_not_cached_for_primary_model(make_client, monkeypatch):
+    import google.generativeai as genai
+    primary, fallback = UnavailableModel(), FakeModel([(0.0, 0)])
+    client = make_client(fallback, streaming=False)
+    monkeypatch.setattr(genai, "GenerativeModel", lambda name: primary if name == "primary" else fallback)
+    client.router = ModelRouter({"default": ["primary", MODEL]}, hedging=False)
+
+    assert client.generate("prompt")[0] == "response 0"
+    assert client.generate("prompt")[0] == "response 1"
+    # 2回目も優先するモデルから試し直す（フォールバック先の応答はキャッシュされていない）
+    assert primary.calls == 2
+    assert fallback.calls == 2
@@ -0,0 +1,34 @@
+from idea_index import IdeaIndex, LocalEmbedder
+
+IDEA = {"ターゲット顧客": "個人経営の飲食店", "顧客の課題": "食材の廃棄が多い"}
+
+
+class CountingEmbedder(LocalEmbedder):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def embed(self, text, **call_kwargs):
+        self.calls.append(call_kwargs)
+        return super().embed(text)
+
+
+def test_similar_ideas_are_limited_to_the_owner(tmp_path):
+    embedder = CountingEmbedder()
+    index = IdeaIndex(embedder, index_dir=str(tmp_path))
+    index.add(IDEA, "ユーザーAのドラフト", owner="user-a")
+
+    score, entry = index.find_similar(IDEA, owner="user-a", session_id="s1")
+    assert entry["canvas_draft"] == "ユーザーAのドラフト"
+    assert embedder.calls[-1] == {"session_id": "s1"}
+
+    # 他のユーザーのエントリしかなければ、埋め込みを計算せずに None を返す
+    calls = len(embedder.calls)
+    assert index.find_similar(IDEA, owner="user-b") is None
+    assert len(embedder.calls) == calls
+
+
+def test_shared_index_finds_other_owners(tmp_path):
+    index = IdeaIndex(LocalEmbedder(), index_dir=str(tmp_path), shared=True)
+    index.add(IDEA, "ユーザーAのドラフト", owner="user-a")
+    assert index.find_similar(IDEA, owner="user-b")[1]["canvas_draft"] == "ユーザーAのドラフト"
@@ -0,0 +1,35 @@
+import threading
+import time
+
+from jobs import JobManager, JobCancelled
+from rate_limiter import QuotaScheduler, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+
+
+def test_jobs_waiting_for_quota_do_not_block_priority_jobs():
+    # 1分に1回しか呼び出せない状態で、2人分の分析ジョブがクォータ待ちになっている
+    scheduler = QuotaScheduler(requests_per_minute=1, tokens_per_minute=10**9)
+    scheduler.acquire("warmup", PRIORITY_INTERACTIVE, 1)
+    manager = JobManager()
+    stop = threading.Event()
+
+    def acquire(session_id, priority, on_wait=None):
+        def wait_or_stop(position):
+            if stop.is_set():
+                raise JobCancelled("test finished")
+            if on_wait is not None:
+                on_wait(position)
+        return lambda job: scheduler.acquire(session_id, priority, 1, on_wait=wait_or_stop)
+
+    try:
+        for i in range(16):
+            manager.submit(f"analysis_{i}", acquire(f"user-{i % 2}", PRIORITY_BACKGROUND))
+        positions = []
+        manager.submit("canvas_draft", acquire("user-3", PRIORITY_INTERACTIVE, positions.append))
+        deadline = time.time() + 5
+        while not positions and time.time() < deadline:
+            time.sleep(0.01)
+        # 後から来たドラフトもスケジューラの順番待ちに入り、分析より先の順番になる
+        assert positions and positions[-1] == 1
+        assert scheduler.queue_length() == 17
+    finally:
+        stop.set()
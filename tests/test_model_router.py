@@ -0,0 +1,25 @@
+from model_router import should_fall_back
+
+
+class APIError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+class NotFound(Exception):
+    pass
+
+
+def test_falls_back_only_on_server_errors_and_missing_models():
+    assert should_fall_back(APIError(500))
+    assert should_fall_back(APIError(503))
+    assert should_fall_back(APIError(404))
+    assert should_fall_back(NotFound("model not found"))
+
+
+def test_does_not_fall_back_on_client_errors_or_rate_limits():
+    # 400/401/403 はどのモデルでも同じ結果になり、429 はスケジューラのバックオフで再試行する
+    for code in (400, 401, 403, 429):
+        assert not should_fall_back(APIError(code))
+    assert not should_fall_back(ValueError("blocked"))
@@ -0,0 +1,139 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import rate_limiter
+from rate_limiter import (
+    QuotaScheduler, TokenBucket, backoff_delay, PRIORITY_FOLLOW_UP, PRIORITY_BACKGROUND, PRIORITY_SPECULATIVE,
+)
+
+
+class ResourceExhausted(Exception):
+    pass
+
+
+class PermissionDenied(Exception):
+    pass
+
+
+class HttpError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limiter, "time", SimpleNamespace(monotonic=lambda: now[0], sleep=time.sleep))
+    return now
+
+
+def exhausted_scheduler(requests_per_minute):
+    scheduler = QuotaScheduler(requests_per_minute=requests_per_minute, tokens_per_minute=10 ** 9)
+    for _ in range(int(requests_per_minute)):
+        scheduler.acquire("warmup", PRIORITY_FOLLOW_UP, 1)
+    return scheduler
+
+
+def test_speculative_requests_are_served_last():
+    scheduler = exhausted_scheduler(120)
+    served = []
+
+    def acquire(name, priority):
+        scheduler.acquire(name, priority, 1)
+        served.append(name)
+
+    threads = []
+    for name, priority in (("speculative", PRIORITY_SPECULATIVE), ("analysis", PRIORITY_BACKGROUND),
+                           ("feedback", PRIORITY_FOLLOW_UP)):
+        thread = threading.Thread(target=acquire, args=(name, priority))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join(timeout=5)
+    assert served == ["feedback", "analysis", "speculative"]
+
+
+def test_token_bucket_refills_at_rate(clock):
+    bucket = TokenBucket(60) # 1秒に1つ
+    bucket.consume(60)
+    assert bucket.wait_time(1) == 1.0
+    clock[0] += 0.5
+    assert bucket.wait_time(1) == 0.5
+    clock[0] += 0.5
+    assert bucket.wait_time(1) == 0.0
+
+
+def test_token_bucket_caps_at_capacity(clock):
+    bucket = TokenBucket(60)
+    clock[0] += 3600
+    bucket.refund(100)
+    assert bucket.tokens == 60
+    # 容量を超える要求は、満タンになれば通す
+    assert bucket.wait_time(1000) == 0.0
+    bucket.consume(30)
+    assert bucket.wait_time(1000) == 30.0
+
+
+def test_token_bucket_refund_returns_unused_tokens(clock):
+    bucket = TokenBucket(60)
+    bucket.consume(60)
+    bucket.refund(10)
+    assert bucket.wait_time(10) == 0.0
+    assert bucket.wait_time(11) == 1.0
+
+
+def test_backoff_delay_grows_exponentially_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(rate_limiter.random, "uniform", lambda low, high: high)
+    assert [backoff_delay(attempt) for attempt in range(7)] == [1, 2, 4, 8, 16, 30, 30]
+
+
+def run_with_errors(errors, max_retries=4):
+    # errors を順に投げてから成功する関数を実行し、(結果, 呼び出し回数, on_retry の記録) を返す
+    scheduler = QuotaScheduler(requests_per_minute=6000, max_retries=max_retries)
+    calls = []
+    retries = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return "ok"
+
+    result = scheduler.run(fn, "s1", PRIORITY_FOLLOW_UP, 1,
+                           on_retry=lambda attempt, delay, error: retries.append((attempt, delay, error)))
+    return result, len(calls), retries
+
+
+def test_run_retries_retryable_errors_with_backoff(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "backoff_delay", lambda attempt: 0.01 * (attempt + 1))
+    errors = [ResourceExhausted("quota"), HttpError(503)]
+    result, calls, retries = run_with_errors(errors)
+    assert (result, calls) == ("ok", 3)
+    assert retries == [(1, 0.01, errors[0]), (2, 0.02, errors[1])]
+
+
+def test_run_retries_the_wrapped_cause(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "backoff_delay", lambda attempt: 0)
+    wrapped = RuntimeError("stream failed")
+    wrapped.__cause__ = ResourceExhausted("quota")
+    result, calls, retries = run_with_errors([wrapped])
+    assert (result, calls) == ("ok", 2)
+    assert isinstance(retries[0][2], ResourceExhausted)
+
+
+def test_run_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "backoff_delay", lambda attempt: 0)
+    with pytest.raises(ResourceExhausted):
+        run_with_errors([ResourceExhausted("quota")] * 3, max_retries=2)
+
+
+def test_run_does_not_retry_other_errors(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "backoff_delay", lambda attempt: 0)
+    for error in (PermissionDenied("bad key"), HttpError(400)):
+        with pytest.raises(type(error)):
+            run_with_errors([error])
@@ -0,0 +1,70 @@
+import threading
+import time
+
+import pytest
+
+from response_cache import ResponseCache
+
+
+class Cancelled(Exception):
+    pass
+
+
+def test_waiting_caller_takes_over_when_leader_is_cancelled(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    leader_started = threading.Event()
+    cancel_leader = threading.Event()
+    calls = []
+
+    def cancelled_compute():
+        calls.append("leader")
+        leader_started.set()
+        cancel_leader.wait()
+        raise Cancelled()
+
+    def compute():
+        calls.append("follower")
+        return "text"
+
+    follower_result = {}
+
+    def leader():
+        with pytest.raises(Cancelled):
+            cache.get_or_compute("key", cancelled_compute, is_private_error=lambda e: isinstance(e, Cancelled))
+
+    leader_thread = threading.Thread(target=leader)
+    leader_thread.start()
+    leader_started.wait()
+    follower_thread = threading.Thread(
+        target=lambda: follower_result.update(value=cache.get_or_compute("key", compute)))
+    follower_thread.start()
+    time.sleep(0.1) # 後から来た呼び出しが実行中のリクエストを待ち始めるまで
+    cancel_leader.set()
+    leader_thread.join(5)
+    follower_thread.join(5)
+
+    assert calls == ["leader", "follower"]
+    assert follower_result["value"] == ("text", False)
+    assert cache.get("key") == "text"
+
+
+def test_refresh_replaces_cached_text(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.set("key", "old")
+    assert cache.get_or_compute("key", lambda: "new") == ("old", True)
+    assert cache.get_or_compute("key", lambda: "new", refresh=True) == ("new", False)
+    assert cache.get("key") == "new"
+
+
+def test_eviction_does_not_scan_directory_on_every_write(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path), max_entries=3)
+    scans = []
+    entries = cache._entries
+    monkeypatch.setattr(cache, "_entries", lambda: scans.append(1) or entries())
+    for i in range(10):
+        cache.set(f"key{i}", "text")
+        time.sleep(0.01) # 参照時刻に差をつける
+    assert len(scans) == 1
+    assert len(list(tmp_path.rglob("*.json"))) == 3
+    assert cache.get("key9") == "text"
+    assert cache.get("key0") is None
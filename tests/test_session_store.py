@@ -0,0 +1,63 @@
+import sqlite3
+import time
+
+from session_store import SessionStore
+
+
+def test_session_is_restored_by_token_after_restart(tmp_path):
+    db_path = str(tmp_path / "sessions.sqlite3")
+    store = SessionStore(db_path)
+    session = store.session("token")
+    session["feedback"] = "フィードバック"
+    session["canvas_draft"] = "ドラフト"
+    session.pop("canvas_draft")
+
+    # サーバーの再起動（メモリ上のセッションはなくなる）
+    restored = SessionStore(db_path)
+    assert restored.stats()["hot_sessions"] == 0
+    assert restored.exists("token")
+    assert not restored.exists("other")
+    assert restored.session("token")["feedback"] == "フィードバック"
+    assert "canvas_draft" not in restored.session("token")
+
+
+def test_least_recently_used_sessions_are_spilled(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.sqlite3"), max_hot_sessions=2)
+    for token in ("a", "b", "c"):
+        store.set(token, "feedback", token)
+    assert store.stats()["hot_sessions"] == 2
+    # メモリから外れたセッションもディスクから読み直せる
+    assert store.get("a", "feedback") == "a"
+    assert store.stats()["hot_sessions"] == 2
+
+
+def test_hot_bytes_limit_spills_large_sessions(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.sqlite3"), max_hot_bytes=1000)
+    store.set("a", "feedback", "あ" * 600)
+    store.set("b", "feedback", "い" * 600)
+    stats = store.stats()
+    assert stats["hot_sessions"] == 1
+    assert stats["hot_bytes"] <= 1000
+    assert store.get("a", "feedback") == "あ" * 600
+
+
+def test_idle_sessions_are_spilled(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.sqlite3"), idle_seconds=0.05)
+    store.set("a", "feedback", "a")
+    time.sleep(0.1)
+    store.set("b", "feedback", "b")
+    assert store.stats()["hot_sessions"] == 1
+
+
+def test_sessions_past_retention_are_purged(tmp_path):
+    db_path = str(tmp_path / "sessions.sqlite3")
+    SessionStore(db_path).set("old", "feedback", "古い")
+    db = sqlite3.connect(db_path)
+    db.execute("UPDATE sessions SET updated_at = ?", (time.time() - 3600,))
+    db.commit()
+    db.close()
+
+    store = SessionStore(db_path, retention_seconds=60)
+    store.set("new", "feedback", "新しい")
+    assert not store.exists("old")
+    assert store.exists("new")
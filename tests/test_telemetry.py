@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+from telemetry import Telemetry, percentile
+
+
+def record(telemetry, step, latency_ms, status="ok", cache_hit=False, retries=0, **extra):
+    event = {
+        "step": step, "model": "model", "session": "s1", "status": status,
+        "latency_ms": latency_ms, "ttft_ms": latency_ms / 2, "cache_hit": cache_hit,
+        "retries": retries, "hedged": False, "fallbacks": 0, "error": None,
+    }
+    event.update(extra)
+    telemetry.record(event)
+
+
+def test_percentile_uses_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 100) == 100
+    assert percentile([], 50) is None
+
+
+def test_summary_per_step():
+    telemetry = Telemetry(log_path=None)
+    for latency in range(1, 101):
+        record(telemetry, "feedback", latency * 10, cache_hit=latency <= 25)
+    record(telemetry, "canvas_draft", 300, status="error")
+
+    draft, feedback = telemetry.summary()
+    assert draft["step"] == "canvas_draft"
+    assert (draft["calls"], draft["errors"]) == (1, 1)
+    assert feedback["calls"] == 100
+    assert feedback["cache_hit_rate"] == 0.25
+    assert (feedback["p50_ms"], feedback["p95_ms"], feedback["p99_ms"]) == (500, 950, 990)
+    assert feedback["ttft_p50_ms"] == 250
+
+
+def test_finish_records_usage_from_response():
+    telemetry = Telemetry(log_path=None)
+    response = SimpleNamespace(
+        usage_metadata=SimpleNamespace(prompt_token_count=120, candidates_token_count=80,
+                                       cached_content_token_count=None),
+        candidates=[SimpleNamespace(finish_reason=SimpleNamespace(name="STOP"))],
+        prompt_feedback=None,
+    )
+    recorder = telemetry.start_call("feedback", "model", "s1")
+    recorder.retry()
+    event = recorder.finish(response)
+    assert event["status"] == "ok"
+    assert (event["prompt_tokens"], event["output_tokens"], event["finish_reason"]) == (120, 80, "STOP")
+    assert event["retries"] == 1
+
+
+def test_render_prometheus():
+    telemetry = Telemetry(log_path=None)
+    record(telemetry, "feedback", 80, retries=2, prompt_tokens=100, output_tokens=50)
+    record(telemetry, "feedback", 700, cache_hit=True)
+    record(telemetry, "feedback", 90000, status="error", block_reason="SAFETY")
+
+    lines = telemetry.render_prometheus().splitlines()
+    assert "# TYPE lean_canvas_requests_total counter" in lines
+    assert 'lean_canvas_requests_total{step="feedback",status="ok"} 2' in lines
+    assert 'lean_canvas_requests_total{step="feedback",status="error"} 1' in lines
+    assert 'lean_canvas_cache_hits_total{step="feedback"} 1' in lines
+    assert 'lean_canvas_retries_total{step="feedback"} 2' in lines
+    assert 'lean_canvas_prompt_tokens_total{step="feedback"} 100' in lines
+    assert 'lean_canvas_blocked_total{step="feedback",reason="SAFETY"} 1' in lines
+    # ヒストグラムのバケットは累積で、上限を超えたものは +Inf にだけ入る
+    assert "# TYPE lean_canvas_latency_ms histogram" in lines
+    assert 'lean_canvas_latency_ms_bucket{step="feedback",le="100"} 1' in lines
+    assert 'lean_canvas_latency_ms_bucket{step="feedback",le="1000"} 2' in lines
+    assert 'lean_canvas_latency_ms_bucket{step="feedback",le="60000"} 2' in lines
+    assert 'lean_canvas_latency_ms_bucket{step="feedback",le="+Inf"} 3' in lines
+    assert 'lean_canvas_latency_ms_sum{step="feedback"} 90780' in lines
+    assert 'lean_canvas_latency_ms_count{step="feedback"} 3' in lines